@@ -1,19 +1,25 @@
 import numpy as np
+from .preset import set_property
 
 
-def multi_channel_aqc(presets, dmd):
+def multi_channel_aqc(presets, dmd, sink=None, row=0, col=0, position=None):
     ''' Apply all the settings to aqcuire a channel. Returns a stack of all aqcuired images.
             Args:
                 presets: A list of presets describing a channel, including exposure times for camera and dmd.
+                sink: optional utils.image_sink.ImageSink. If given, every image is written to it
+                    (at row, col, channel = index of the preset) instead of being returned, and None is returned.
+                row, col, position: tile and stage position of the images, for the sink
     '''
     stack = []
-    for preset in presets:
+    for channel, preset in enumerate(presets):
         dmd_exposure_time = preset.dmd_exposure_time
         camera_exposure_time = int(preset.camera_exposure_time)
         preset.apply()
         img_captured = dmd.capture_and_stim_full_on(dmd_exposure_time, camera_exposure_time, delay=0)
-        presets[0].core.set_property("Spectra RIGHT", "White_Level", 0)  # turn off the light source to avoid light leaks
-        stack.append(img_captured)
+        set_property(presets[0].core, "Spectra RIGHT", "White_Level", 0)  # turn off the light source to avoid light leaks
+        _collect(stack, img_captured, sink, row, col, channel, position)
+    if sink is not None:
+        return None
     stack = np.array(stack, ndmin=3)  # CYX format
     return stack  # CYX format
 
@@ -27,41 +33,55 @@ def acq(core):
     return img
 
 
-def acq_multi(presets, dmd):
+def acq_multi(presets, dmd, sink=None, row=0, col=0, position=None):
     ''' Apply all the settings to aqcuire a channel. Returns a stack of all aqcuired images.
             Args:
                 presets: A list of presets describing a channel, including exposure times for camera and dmd.
+                sink, row, col, position: see multi_channel_aqc
     '''
     stack = []
-    for preset in presets:
+    for channel, preset in enumerate(presets):
         preset.apply()
         dmd.all_on()
         img = acq(dmd.core)
         dmd.all_off()
-        stack.append(img)
+        _collect(stack, img, sink, row, col, channel, position)
+    if sink is not None:
+        return None
     stack = np.array(stack, ndmin=3)  # CYX format
     return stack  # CYX format
 
 
-def acq_multi_dark(presets, dmd):
+def acq_multi_dark(presets, dmd, sink=None, row=0, col=0, position=None):
     ''' Take dark exposure with DMD all off for background subtractions.
         Apply all the settings to aqcuire a channel. Returns a stack of all aqcuired images.
             Args:
                 presets: A list of presets describing a channel, including exposure times for camera and dmd.
+                sink, row, col, position: see multi_channel_aqc
     '''
     stack = []
-    for preset in presets:
+    for channel, preset in enumerate(presets):
         camera_exposure_time = int(preset.camera_exposure_time)
         preset.apply()
         dmd.all_off()
         dmd.core.set_exposure(camera_exposure_time)  # should be done in preset apply
         img = acq(dmd.core)
         dmd.all_off()
-        stack.append(img)
+        _collect(stack, img, sink, row, col, channel, position)
+    if sink is not None:
+        return None
     stack = np.array(stack, ndmin=3)  # CYX format
     return stack  # CYX format
 
 
+def _collect(stack, img, sink, row, col, channel, position):
+    '''Hands img to the sink if there is one (blocks while the writer is behind), otherwise adds it to stack.'''
+    if sink is None:
+        stack.append(img)
+    else:
+        sink.put(img, row, col, channel, position)
+
+
 def acq_stim(img, preset, affine, dmd):
     ''' Apply all the settings to aqcuire a channel. Upload image on DMD. Capture and returns image.
     '''
@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .preset import state_cache
+from .stage import _focus_target
+
+
+class async_core:
+    '''asyncio facade over the micro-manager core, so independent devices can be commanded at the same time
+    and awaited together:
+        acore = async_core(core)
+        await asyncio.gather(move_to_async(acore, pos), apply_async(acore, preset), upload_mask_async(acore, dmd, mask))
+    Every core method is available as a coroutine, e.g. await acore.set_property(device, prop, value).
+    The blocking calls run on a bounded thread pool. Waiting for a device polls device_busy instead
+    of blocking in wait_for_device, so a wait holds neither a worker thread nor the bridge.
+    '''
+    def __init__(self, core, max_workers=4, poll_interval=0.005, core_factory=None):
+        '''Args:
+            core: MMCore object from bridge.get_core() (or simulated_core)
+            max_workers: max number of blocking calls in flight
+            poll_interval: time between device_busy polls in s
+            core_factory: function that returns a new core object, e.g. pycromanager.Core. If given, every
+                worker thread gets its own core (and socket) and calls run in parallel. Otherwise all calls go
+                through the shared core, one at a time, as the bridge is not thread safe.
+        '''
+        self.core = core
+        self.poll_interval = poll_interval
+        self.core_factory = core_factory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='async_core')
+        self.lock = threading.Lock() if core_factory is None else None
+        self.local = threading.local()
+
+    def _core(self):
+        if self.core_factory is None:
+            return self.core
+        if not hasattr(self.local, 'core'):
+            self.local.core = self.core_factory()
+        return self.local.core
+
+    def _call(self, name, args):
+        if self.lock is None:
+            return getattr(self._core(), name)(*args)
+        with self.lock:
+            return getattr(self.core, name)(*args)
+
+    async def call(self, name, *args):
+        '''Runs core.name(*args) on the thread pool and returns its result.'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._call, name, args)
+
+    async def run(self, fn, *args):
+        '''Runs a blocking function (e.g. mask preparation) on the thread pool.'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    async def wait_for_device(self, device):
+        while await self.call('device_busy', device):
+            await asyncio.sleep(self.poll_interval)
+
+    async def wait_for_devices(self, devices):
+        '''Waits until none of the devices is busy anymore.'''
+        await asyncio.gather(*(self.wait_for_device(device) for device in devices))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+async def move_to_async(acore, pos, focus=None):
+    '''Async stage.move_to: starts the move and waits for the stage and the focus device together.'''
+    xy_stage = await acore.get_xy_stage_device()
+    focus_device = await acore.get_focus_device()
+    target = _focus_target(pos, focus)
+    if target is not None and focus == 'z' and await acore.is_continuous_focus_enabled():
+        await acore.enable_continuous_focus(False)  # see stage.move_to
+    await acore.set_xy_position(xy_stage, pos.x, pos.y)
+    if target is not None and focus == 'z':
+        await acore.set_position(focus_device, target)
+    elif target is not None:
+        await acore.set_auto_focus_offset(target)
+    await acore.wait_for_devices([xy_stage, focus_device])
+
+
+async def apply_async(acore, preset, force=False):
+    '''Async preset.apply_no_retry: sets the properties that are not applied yet, then waits for
+    all the devices that changed at the same time, instead of one after the other.
+    '''
+    cache = state_cache(preset.core)
+    touched = []
+    try:
+        for device, prop, value in preset.settings:
+            if preset.skip_applied and not force and cache.is_applied(device, prop, value):
+                continue
+            await acore.set_property(device, prop, value)
+            cache.update(device, prop, value)
+            if device not in touched:
+                touched.append(device)
+        if preset.camera_exposure_time is not None:
+            await acore.set_exposure(preset.camera_exposure_time)
+        await acore.wait_for_devices(touched)
+    except Exception:
+        preset.invalidate()
+        raise
+
+
+async def upload_mask_async(acore, dmd, mask):
+    '''Async dmd.upload_mask: converts the mask on the thread pool and uploads it. Nothing is displayed yet.'''
+    buffer = await acore.run(dmd.prepare_mask, mask)
+    await acore.set_slm_image(dmd.name, buffer)
+
+
+async def acq_async(acore):
+    '''Async acquisition.acq.'''
+    await acore.snap_image()
+    tagged_img = await acore.get_tagged_image()
+    return tagged_img.pix.reshape(tagged_img.tags['Height'], tagged_img.tags['Width'])
+
+
+async def display_uploaded_async(acore, dmd):
+    '''Async part of dmd.display_buffer after the upload: display the uploaded mask until all_off.'''
+    await acore.set_slm_exposure(dmd.name, 200000)
+    await acore.set_property(dmd.name, 'OverlapMode', 'On')
+    state_cache(dmd.core).update(dmd.name, 'OverlapMode', 'On')
+    await acore.display_slm_image(dmd.name)
+
+
+async def all_off_async(acore, dmd):
+    '''Async dmd.all_off.'''
+    await acore.set_slm_exposure(dmd.name, 1)
+    await acore.set_property(dmd.name, 'OverlapMode', 'Off')
+    state_cache(dmd.core).update(dmd.name, 'OverlapMode', 'Off')
+    await acore.set_slm_pixels_to(dmd.name, 0)
+    await acore.display_slm_image(dmd.name)
+
+
+async def acq_mask_async(acore, mask, preset, dmd, pos=None):
+    '''Async acquisition.acq_mask, optionally at a new stage position. The stage move, the preset
+    (e.g. a filter wheel turn) and the mask upload run at the same time, then the mask is exposed and imaged.
+    Args:
+        pos: stage_position to move to first, or None to stay
+    '''
+    steps = [apply_async(acore, preset), upload_mask_async(acore, dmd, mask)]
+    if pos is not None:
+        steps.append(move_to_async(acore, pos))
+    await asyncio.gather(*steps)
+    await display_uploaded_async(acore, dmd)
+    img = await acq_async(acore)
+    await all_off_async(acore, dmd)
+    return img
@@ -0,0 +1,272 @@
+'''Benchmarks of the hardware hot paths on the simulated core, no microscope needed.
+Run from the repository root:
+    python -m manager.benchmark --tiles 50
+'''
+import time
+import zlib
+import asyncio
+import argparse
+import tracemalloc
+import numpy as np
+from .acquisition import acq, acq_mask
+from .async_core import async_core, acq_mask_async
+from .dmd import dmd, grid_points, apply_transform
+from .focus import autofocus, focus_score
+from .preset import preset, state_cache
+from .print_job import print_job
+from .simulation import simulated_core
+from .stage import stage_position, move_to
+from .trace import traced_core
+
+
+def measure(fn, repeats=1):
+    '''Runs fn repeats times. Returns (mean time per call in s, peak traced memory in bytes, last result).'''
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / repeats
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def _setup(latencies=None, **kwargs):
+    core = simulated_core(latencies=latencies, seed=0, **kwargs)
+    device = dmd(core)
+    channel = preset(core, [
+        ['TIFilterBlock1', 'State', '1'],
+        ['Wheel-C', 'State', 1],
+        ['Spectra RIGHT', 'Violet_Enable', 1],
+        ['Spectra RIGHT', 'Violet_Level', 100],
+    ], skip_applied=True)
+    channel.camera_exposure_time = 10
+    state_cache(core).invalidate()
+    return core, device, channel
+
+
+def _breakdown(core, n):
+    '''Simulated hardware time per tile, per kind of call, in ms.'''
+    return {kind: 1000 * t / n for kind, t in sorted(core.time_per_kind.items())}
+
+
+def bench_upload_mask(repeats=50):
+    '''dmd.upload_mask for the mask dtypes in use, against the former list based conversion.'''
+    core, device, _ = _setup(latencies={k: 0 for k in simulated_core.default_latencies})
+    rng = np.random.default_rng(0)
+    masks = {
+        'float64': rng.random((device.height, device.width)),
+        'bool': rng.random((device.height, device.width)) > 0.5,
+        'uint8': (rng.random((device.height, device.width)) > 0.5).astype(np.uint8),
+    }
+    results = {}
+    for name, mask in masks.items():
+        t, peak, _ = measure(lambda: device.upload_mask(mask), repeats)
+        t_list, peak_list, _ = measure(lambda: np.array(mask.ravel().tolist()).astype(np.uint8), max(1, repeats // 10))
+        results[name] = {'ms': 1000 * t, 'ms_tolist': 1000 * t_list, 'peak_kb': peak / 1024, 'peak_kb_tolist': peak_list / 1024}
+    return results
+
+
+def bench_preset_apply(repeats=20, latencies=None):
+    '''preset.apply of an unchanged preset, as in the tiling loop, with and without the state cache.'''
+    core, _, channel = _setup(latencies)
+    channel.apply()
+    core.reset_stats()
+    t_cached, _, _ = measure(channel.apply, repeats)
+    calls_cached = core.call_count / repeats
+    core.reset_stats()
+    t_forced, _, _ = measure(lambda: channel.apply(force=True), repeats)
+    calls_forced = core.call_count / repeats
+    return {'ms_cached': 1000 * t_cached, 'calls_cached': calls_cached,
+            'ms_forced': 1000 * t_forced, 'calls_forced': calls_forced}
+
+
+def bench_acq(repeats=20, latencies=None):
+    '''acq and acq_mask round trips.'''
+    core, device, channel = _setup(latencies)
+    mask = np.ones((device.height, device.width), dtype=np.uint8)
+    t_acq, _, _ = measure(lambda: acq(core), repeats)
+    core.reset_stats()
+    t_mask, peak, _ = measure(lambda: acq_mask(mask, channel, device), repeats)
+    return {'ms_acq': 1000 * t_acq, 'ms_acq_mask': 1000 * t_mask, 'peak_kb_acq_mask': peak / 1024,
+            'breakdown_ms': _breakdown(core, repeats)}
+
+
+def bench_calibrate(latencies=None):
+    '''Three point calibration against the grid calibration: time, snaps and accuracy.'''
+    core, device, _ = _setup(latencies, affine=[[1.2, 0.05, 30.5], [-0.04, 1.25, 80.2]])
+    truth = core.true_calibration()
+    points = grid_points(device.height, device.width, 5, 5)
+    camera = apply_transform(core.affine, points)
+
+    def error(affine):
+        # dmd position each calibration assigns to the camera images of known dmd points
+        return float(np.abs(apply_transform(affine, camera) - points).max())
+
+    results = {}
+    for name, fn in (('three_points', device.calibrate),
+                     ('grid', lambda: device.calibrate_grid()[0])):
+        core.reset_stats()
+        t, _, affine = measure(fn)
+        results[name] = {'s': t, 'snaps': core.calls_per_kind['snap'], 'max_error_px': error(affine)}
+    core.reset_stats()
+    t, _, affine = measure(lambda: device.calibrate_grid(initial_affine=truth)[0])
+    results['grid_single_frame'] = {'s': t, 'snaps': core.calls_per_kind['snap'], 'max_error_px': error(affine)}
+    return results
+
+
+def _save(index, img):
+    '''Stand-in for saving a captured image, about 30 ms of compression per 1024x1024 image.'''
+    return len(zlib.compress(img.tobytes(), 1))
+
+
+def bench_print(n_tiles=50, latencies=None, on_image=None):
+    '''Tiles per minute of the notebook's serial print loop against print_job.
+    print_job can only hide host side work (mask conversion, on_image) behind the hardware, the hardware
+    calls themselves stay serial. Without on_image a tile is almost all hardware time, so the gain is small.
+    '''
+    rng = np.random.default_rng(0)
+    results = {}
+    for name in ('serial', 'print_job'):
+        core, device, channel = _setup(latencies)
+        tiles = [rng.random((device.height, device.width)) > 0.5 for _ in range(n_tiles)]
+        positions = [stage_position(100. * i, 0., None) for i in range(n_tiles)]
+
+        def serial():
+            out = []
+            for index, (tile, pos) in enumerate(zip(tiles, positions)):
+                move_to(core, pos)
+                img = acq_mask(tile, channel, device)
+                out.append(img if on_image is None else on_image(index, img))
+            return out
+
+        def pipelined():
+            return print_job(device, channel, tiles, positions, on_image=on_image).run()
+
+        t, peak, _ = measure(serial if name == 'serial' else pipelined)
+        results[name] = {'tiles_per_minute': 60 * n_tiles / t, 'peak_mb': peak / 2 ** 20,
+                         'breakdown_ms': _breakdown(core, n_tiles)}
+    return results
+
+
+def bench_async(n_tiles=20, latencies=None):
+    '''Tiles per minute when every tile changes the filter wheel: blocking helpers against the async_core,
+    where the stage move, the wheel turn and the mask upload overlap.'''
+    rng = np.random.default_rng(0)
+    results = {}
+    for name in ('serial', 'async'):
+        core, device, channel = _setup(latencies)
+        other = preset(core, [['Wheel-C', 'State', 2]] + [list(s) for s in channel.settings if s[0] != 'Wheel-C'],
+                       skip_applied=True)
+        other.camera_exposure_time = channel.camera_exposure_time
+        presets = [channel, other]
+        tiles = [rng.random((device.height, device.width)) > 0.5 for _ in range(n_tiles)]
+        positions = [stage_position(100. * i, 0., None) for i in range(n_tiles)]
+
+        def serial():
+            for index in range(n_tiles):
+                move_to(core, positions[index])
+                acq_mask(tiles[index], presets[index % 2], device)
+
+        async def concurrent():
+            acore = async_core(core)
+            try:
+                for index in range(n_tiles):
+                    await acq_mask_async(acore, tiles[index], presets[index % 2], device, positions[index])
+            finally:
+                acore.close()
+
+        t, _, _ = measure(serial if name == 'serial' else lambda: asyncio.run(concurrent()))
+        results[name] = {'tiles_per_minute': 60 * n_tiles / t}
+    return results
+
+
+def bench_live_view(n_frames=200, latencies=None):
+    '''Frames per second from the simulated core into the live view ring buffer.'''
+    from utils.live_view import FrameRingBuffer
+    core, _, _ = _setup(latencies)
+    frames = FrameRingBuffer(core.get_image_height(), core.get_image_width(), downsample=2)
+    core.start_continuous_sequence_acquisition(0)
+
+    def run():
+        for i in range(n_frames):
+            frames.put(core.get_last_image())
+            if i % 3 == 0:  # display at a third of the acquisition rate
+                frames.latest()
+
+    t, peak, _ = measure(run)
+    core.stop_sequence_acquisition()
+    return {'fps': n_frames / t, 'dropped': frames.dropped, 'peak_mb': peak / 2 ** 20}
+
+
+def bench_trace_overhead(calls=20000):
+    '''Cost of traced_core per core call, on a core without latency.
+    Timed without tracemalloc, which would dominate the cost of the small allocations per record.'''
+    core = simulated_core(latencies={k: 0 for k in simulated_core.default_latencies})
+    traced = traced_core(core)
+    timings = {}
+    for name, target in (('plain', core), ('traced', traced)):
+        start = time.perf_counter()
+        for _ in range(calls):
+            target.get_property('Camera', 'Exposure')
+        timings[name] = (time.perf_counter() - start) / calls
+    return {'us_per_call': 1e6 * (timings['traced'] - timings['plain']), 'records': traced.trace_position()}
+
+
+def bench_autofocus(focus_z=3.7, start_z=-4., latencies=None):
+    '''Software autofocus on the projected checkerboard, and the cost of the live view focus metric per frame.'''
+    core, device, _ = _setup(latencies, focus_z=focus_z)
+    core.z = start_z
+    t, _, (z, samples) = measure(lambda: autofocus(core, device))
+    img = core.render_image()
+    results = {'seconds': t, 'error_um': abs(z - focus_z), 'positions': len(samples)}
+    for metric in ('laplacian', 'brenner'):
+        start = time.perf_counter()
+        for _ in range(20):
+            focus_score(img, metric)
+        results[f'{metric}_ms'] = 1000 * (time.perf_counter() - start) / 20
+    return results
+
+
+def run_all(n_tiles=50, latencies=None):
+    '''Runs all benchmarks and returns their results by name.'''
+    return {
+        'upload_mask': bench_upload_mask(),
+        'preset_apply': bench_preset_apply(latencies=latencies),
+        'acq': bench_acq(latencies=latencies),
+        'calibrate': bench_calibrate(latencies=latencies),
+        'print': bench_print(n_tiles, latencies=latencies),
+        'print_saving': bench_print(n_tiles, latencies=latencies, on_image=_save),
+        'async': bench_async(latencies=latencies),
+        'live_view': bench_live_view(latencies=latencies),
+        'trace_overhead': bench_trace_overhead(),
+        'autofocus': bench_autofocus(latencies=latencies),
+    }
+
+
+def _print(results, indent=0):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(' ' * indent + f'{key}:')
+            _print(value, indent + 2)
+        elif isinstance(value, float):
+            print(' ' * indent + f'{key}: {value:.3f}')
+        else:
+            print(' ' * indent + f'{key}: {value}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tiles', type=int, default=50, help='number of tiles for the print benchmark')
+    parser.add_argument('--latency', action='append', default=[], metavar='KIND=SECONDS',
+                        help=f'override a simulated latency, kinds: {", ".join(simulated_core.default_latencies)}')
+    args = parser.parse_args()
+    latencies = {}
+    for item in args.latency:
+        kind, value = item.split('=')
+        latencies[kind] = float(value)
+    _print(run_all(args.tiles, latencies or None))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import json
+import time
+import hashlib
+from pathlib import Path
+import numpy as np
+
+
+class calibration_store:
+    '''On-disk store of dmd calibrations, so they survive restarts of the notebook.
+    Calibrations are keyed by the optical configuration: the preset settings, the camera binning,
+    the objective and the dmd size. Every entry has a timestamp; entries older than max_age are
+    recalibrated, younger entries are checked with a single verification snap (dmd.verify_calibration).
+    '''
+    def __init__(self, path, max_age=7 * 24 * 3600, tolerance=2., ignore_properties=('Level',)):
+        '''Args:
+            path: json file the calibrations are stored in. Created if it doesn't exist.
+            max_age: entries older than this (in s) are recalibrated without verification
+            tolerance: max verification error in dmd pixels for an entry to be reused
+            ignore_properties: preset settings whose property name ends with one of these don't change
+                the geometry (e.g. light source levels) and are left out of the key
+        '''
+        self.path = Path(path)
+        self.max_age = max_age
+        self.tolerance = tolerance
+        self.ignore_properties = tuple(ignore_properties)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def key(self, preset, dmd, objective=None):
+        '''Key of the optical configuration of preset, and the current camera binning of the core.'''
+        settings = sorted([str(s[0]), str(s[1]), str(s[2])] for s in preset.settings
+                          if not str(s[1]).endswith(self.ignore_properties))
+        core = preset.core
+        try:
+            binning = str(core.get_property(core.get_camera_device(), 'Binning'))
+        except Exception:
+            binning = None
+        config = {
+            'settings': settings,
+            'binning': binning,
+            'objective': None if objective is None else str(objective),
+            'dmd': [dmd.height, dmd.width],
+        }
+        text = json.dumps(config, sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest(), config
+
+    def get(self, key):
+        '''Returns (affine, entry) for key, or (None, None) if there is no entry.'''
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+        return np.array(entry['affine'], dtype=np.float64), entry
+
+    def put(self, key, config, affine, report=None):
+        '''Store an affine under key and write the store to disk.'''
+        entry = {
+            'affine': np.asarray(affine).tolist(),
+            'config': config,
+            'timestamp': time.time(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if report is not None:
+            entry['rms'] = report.get('rms')
+            entry['max'] = report.get('max')
+        self.entries[key] = entry
+        self.save()
+
+    def touch(self, key, report):
+        '''Mark an entry as verified now.'''
+        self.entries[key]['verified'] = time.time()
+        self.entries[key]['verification_max'] = report['max']
+        self.save()
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+        self.save()
+
+    def is_stale(self, entry):
+        return time.time() - entry['timestamp'] > self.max_age
+
+    def save(self):
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        tmp.replace(self.path)
+
+    def calibrate(self, preset, dmd, objective=None, verbous=False, **kwargs):
+        '''Make sure preset.affine holds a valid calibration for the current optical configuration.
+        A stored calibration that is not stale is verified with one snap and reused if it didn't drift.
+        Otherwise the preset is recalibrated with dmd.calibrate_grid, starting from the stored affine if
+        there is one, and the result is stored.
+        Args:
+            objective: name of the objective in use, part of the key
+            kwargs: passed on to dmd.calibrate_grid
+        Returns:
+            status: 'verified', 'recalibrated' or 'calibrated'
+        '''
+        key, config = self.key(preset, dmd, objective)
+        affine, entry = self.get(key)
+        preset.apply()
+        if entry is not None and not self.is_stale(entry):
+            report = dmd.verify_calibration(affine)
+            if verbous:
+                print(f"{preset.name}: stored calibration from {entry['date']}, error {report['max']:.2f} px")
+            if report['max'] <= self.tolerance:
+                self.touch(key, report)
+                preset.affine = affine
+                return 'verified'
+        status = 'calibrated' if entry is None else 'recalibrated'
+        try:
+            preset.calibrate_dmd(dmd, grid=True, initial_affine=affine, **kwargs)
+        except RuntimeError:
+            if affine is None:
+                raise
+            #drifted too far to match the spots to the stored calibration, start from scratch
+            preset.calibrate_dmd(dmd, grid=True, initial_affine=None, **kwargs)
+        self.put(key, config, preset.affine, preset.calibration_report)
+        if verbous:
+            print(f"{preset.name}: {status}, rms residual {preset.calibration_report['rms']:.2f} px")
+        return status
@@ -0,0 +1,248 @@
+import time
+import queue
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from .dmd import apply_transform, coordinates_to_lightmap
+
+
+def segment_nuclei(img, threshold=None, blur=1., min_area=20, max_area=None, min_contrast=5.):
+    '''Segments bright objects (e.g. nuclei) in a camera image.
+    Args:
+        img: camera image
+        threshold: intensity threshold, Otsu's threshold if None
+        blur: sigma of the gaussian blur before thresholding, 0 for none
+        min_area: smaller objects are dropped
+        max_area: larger objects are dropped, defaults to a tenth of the image
+        min_contrast: with Otsu's threshold, the objects must be brighter than the background by this many
+            standard deviations of the background noise, else nothing is segmented. Otsu splits any image in
+            two, a blank or noise-only frame would otherwise be segmented into the whole field or into noise.
+    Returns:
+        coords: (n, 2) array of the centroids (y, x)
+        areas: (n,) array of the areas in pixels
+        labels: label image, object i of coords has label i+1, dropped objects 0
+    '''
+    img = np.asarray(img, dtype=np.float32)
+    if max_area is None:
+        max_area = img.size / 10
+    if blur > 0:
+        img = cv2.GaussianBlur(img, (0, 0), blur)
+    if threshold is None:
+        low, high = float(img.min()), float(img.max())
+        if high - low <= 0:
+            return _no_objects(img.shape)
+        scaled = cv2.convertScaleAbs(img, alpha=255 / (high - low), beta=-255 * low / (high - low))
+        _, binary = cv2.threshold(scaled, 0, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        if not binary.any() or binary.all() or _contrast(img, binary.view(bool)) < min_contrast:
+            return _no_objects(img.shape)
+    else:
+        binary = (img > threshold).astype(np.uint8)
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = (areas >= min_area) & (areas <= max_area)
+    #relabel so the kept objects are 1..n_kept, in one lookup
+    lookup = np.zeros(n, dtype=np.int32)
+    lookup[1:][keep] = np.arange(1, keep.sum() + 1)
+    labels = lookup[labels]
+    coords = centroids[1:][keep][:, ::-1].copy()
+    return coords, areas[keep], labels
+
+
+def _contrast(img, foreground):
+    '''Difference of the median foreground and background levels, in units of the background noise
+    (robust standard deviation from the median absolute deviation).'''
+    background = img[~foreground]
+    level = np.median(background)
+    noise = 1.4826 * np.median(np.abs(background - level))
+    return (np.median(img[foreground]) - level) / max(float(noise), 1e-6)
+
+
+def _no_objects(shape):
+    return np.empty((0, 2)), np.empty(0, dtype=np.int32), np.zeros(shape, dtype=np.int32)
+
+
+def _put_latest(q, item):
+    '''Puts item into a queue of size 1, replacing an item that was not taken yet.'''
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class closed_loop:
+    '''Image -> light mask pipeline for one or more FOVs, running on worker threads:
+    segment -> link with the FOV's Linker -> select the cells to stimulate -> render the light mask of all
+    selected cells in one pass -> warp it to dmd space. The results go into fov.tracks_queue and
+    fov.light_mask_queue.
+    Every FOV keeps only its newest frame: a frame that is replaced before a worker picks it up, or that is
+    older than max_latency, is dropped, so the latency stays bounded. FOVs with a pending frame are served
+    in round-robin order.
+    '''
+    def __init__(self, dmd, affine, segment=segment_nuclei, render='disk', radius=3, max_latency=None,
+                 workers=1, seed=None):
+        '''Args:
+            dmd: dmd object, for the size of the light mask and its warp map
+            affine: camera -> dmd calibration (2x3 affine or 3x3 homography)
+            segment: function(img) -> (coords, areas, labels), see segment_nuclei
+            render: 'disk' draws a circle of radius dmd pixels at the position of every selected cell,
+                'cell' lights up the whole segmented area of the selected cells
+            radius: circle radius in dmd pixels for render='disk'
+            max_latency: frames older than this (in s) when a worker picks them up are dropped, None to keep all
+            workers: number of worker threads. A FOV is never processed by two workers at once.
+            seed: seed for the random selection of the cells to stimulate
+        '''
+        if render not in ('disk', 'cell'):
+            raise ValueError(f"render must be 'disk' or 'cell', not {render!r}.")
+        self.dmd = dmd
+        self.affine = np.asarray(affine, dtype=np.float64)
+        self.segment = segment
+        self.render = render
+        self.radius = radius
+        self.max_latency = max_latency
+        self.rng = np.random.default_rng(seed)
+        self.warp = dmd.get_warp_map(self.affine) if render == 'cell' else None
+        self.pending = {}  # id(fov) -> (fov, img, t, submit time), the newest frame of every FOV
+        self.order = deque()  # ids of the FOVs with a pending frame, round-robin
+        self.busy = set()  # ids of the FOVs a worker is processing
+        self.frames = {}  # id(fov) -> number of frames linked
+        self.seen = {}  # id(fov) -> particle ids that were already considered for stimulation
+        self.condition = threading.Condition()
+        self.timings = deque(maxlen=1000)
+        self.dropped = 0
+        self.running = True
+        self.threads = [threading.Thread(target=self._work, name=f'closed_loop_{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, fov, img, t=None):
+        '''Queues a new frame of fov. Returns immediately, the light mask arrives in fov.light_mask_queue.
+        Args:
+            t: time of the frame, defaults to now
+        '''
+        now = time.perf_counter()
+        with self.condition:
+            key = id(fov)
+            if key in self.pending:
+                self.dropped += 1  # not processed yet, the newer frame wins
+            else:
+                self.order.append(key)
+            self.pending[key] = (fov, img, now if t is None else t, now)
+            self.condition.notify()
+
+    def _next(self):
+        '''Next frame in round-robin order of a FOV that is not being processed. Drops stale frames.
+        Call with the lock held.'''
+        for _ in range(len(self.order)):
+            key = self.order.popleft()
+            if key in self.busy:
+                self.order.append(key)
+                continue
+            item = self.pending.pop(key)
+            if self.max_latency is not None and time.perf_counter() - item[3] > self.max_latency:
+                self.dropped += 1
+                continue
+            return item
+        return None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                item = self._next()
+                while item is None and self.running:
+                    self.condition.wait()
+                    item = self._next()
+                if item is None:
+                    return
+                fov, img, t, submitted = item
+                self.busy.add(id(fov))
+            try:
+                light_mask, tracks, timing = self.process(fov, img, t)
+                timing['latency'] = time.perf_counter() - submitted
+                self.timings.append(timing)
+                _put_latest(fov.tracks_queue, tracks)
+                _put_latest(fov.light_mask_queue, light_mask)
+            except Exception as e:
+                print(f'closed_loop: FOV {fov.index} failed: {e!r}')
+            finally:
+                with self.condition:
+                    self.busy.discard(id(fov))
+                    self.condition.notify()
+
+    def process(self, fov, img, t):
+        '''Runs the pipeline on one frame of fov, on the calling thread.
+        Returns:
+            light_mask: uint8 mask in dmd space
+            tracks: dict of arrays particle, y, x, area and stim (whether the cell is stimulated)
+            timing: time per step in s
+        '''
+        start = time.perf_counter()
+        coords, areas, labels = self.segment(img)
+        segmented = time.perf_counter()
+
+        key = id(fov)
+        if self.frames.get(key, 0) == 0:
+            fov.linker.init_level(coords, t)
+        else:
+            fov.linker.next_level(coords, t)
+        self.frames[key] = self.frames.get(key, 0) + 1
+        particles = np.asarray(fov.linker.particle_ids, dtype=np.int64)
+        fov.last_frame_time = t
+        linked = time.perf_counter()
+
+        stim = self.select(fov, particles)
+        selected = time.perf_counter()
+
+        shape = (self.dmd.height, self.dmd.width)
+        if not stim.any():
+            light_mask = np.zeros(shape, dtype=np.uint8)  # nothing to stimulate, the previous mask must go
+        elif self.render == 'disk':
+            points = apply_transform(self.affine, coords[stim][:, ::-1])[:, ::-1]  # (y,x) in dmd space
+            light_mask = coordinates_to_lightmap(points, np.zeros(shape, dtype=np.uint8), self.radius)
+        else:
+            # labels of the selected cells -> light, all other labels and the background -> dark
+            lookup = np.zeros(len(coords) + 1, dtype=np.uint8)
+            lookup[1:][stim] = 1
+            light_mask = self.warp.warp_mask(lookup[labels], reuse=False)
+        rendered = time.perf_counter()
+
+        tracks = {'particle': particles, 'y': coords[:, 0], 'x': coords[:, 1], 'area': areas, 'stim': stim}
+        timing = {'segment': segmented - start, 'link': linked - segmented, 'select': selected - linked,
+                  'render': rendered - selected, 'total': rendered - start}
+        return light_mask, tracks, timing
+
+    def select(self, fov, particles):
+        '''Decides once for every new particle whether it is stimulated, with probability fov.percentage/100.
+        The stimulated particles are kept in fov.cells_to_stim. Returns a bool array over particles.
+        '''
+        seen = self.seen.setdefault(id(fov), set())
+        new = [p for p in particles.tolist() if p not in seen]
+        if new:
+            chosen = self.rng.random(len(new)) < fov.percentage / 100
+            fov.cells_to_stim.extend(p for p, c in zip(new, chosen) if c)
+            seen.update(new)
+        return np.isin(particles, fov.cells_to_stim)
+
+    def stats(self):
+        '''Mean and 95th percentile of the time per step in ms over the last frames, and the dropped frames.'''
+        timings = list(self.timings)
+        summary = {'frames': len(timings), 'dropped': self.dropped}
+        if timings:
+            for step in timings[0]:
+                values = 1000 * np.array([t[step] for t in timings])
+                summary[step] = {'mean': float(values.mean()), 'p95': float(np.percentile(values, 95))}
+        return summary
+
+    def close(self):
+        '''Stops the workers after the frames they are processing.'''
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,46 @@
+import queue
+import itertools
+import threading
+from concurrent.futures import Future
+
+
+class command_queue:
+    '''Runs all calls to the micro-manager core on a single owner thread, one after the other.
+    Commands are submitted from any thread and return a concurrent.futures.Future.
+    Commands with a lower priority number run first, commands of equal priority in submission order.
+    '''
+    def __init__(self, name='command_queue'):
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()  # keeps the order of commands with equal priority
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            _, _, item = self.queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn, *args, priority=0, **kwargs):
+        '''Queue fn(*args, **kwargs) to run on the owner thread. Returns a Future for its result.'''
+        future = Future()
+        self.queue.put((priority, next(self.counter), (future, fn, args, kwargs)))
+        return future
+
+    def call(self, fn, *args, priority=0, **kwargs):
+        '''Submit a command and block until it is done. Returns its result.'''
+        if threading.current_thread() is self.thread:
+            return fn(*args, **kwargs)  # already on the owner thread, queueing would dead lock
+        return self.submit(fn, *args, priority=priority, **kwargs).result()
+
+    def close(self):
+        '''Finish all submitted commands, then stop the thread.'''
+        self.queue.put((float('inf'), next(self.counter), None))
+        self.thread.join()
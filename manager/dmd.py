@@ -3,24 +3,169 @@ import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 import time
+import functools
 import scipy
 from .acquisition import acq
+from .preset import set_property
+from .warp import warp_map
+
+def coordinates_to_lightmap(xy, mask, radius=3, out=None):
+    '''Takes a list of coordinates [(y,x),(y,x),...] and draws a filled circle on a mask for every point.
+    All circles are drawn in one vectorized pass.
+    Args:
+        xy: a single (y,x) or a list/array of them
+        mask: array with the shape and dtype of the light map
+        radius: circle radius in pixels
+        out: light map to draw into, it is cleared first. Defaults to a new array.
+    '''
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if out is None:
+        light_mask = np.zeros_like(mask)
+    else:
+        light_mask = out
+        light_mask[:] = 0
+    #pixel offsets of a circle, stamped at every point
+    r = int(np.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dy ** 2 + dx ** 2 <= radius ** 2
+    ys = xy[:, 0].astype(int)[:, None] + dy[inside][None, :]
+    xs = xy[:, 1].astype(int)[:, None] + dx[inside][None, :]
+    valid = (ys >= 0) & (ys < light_mask.shape[0]) & (xs >= 0) & (xs < light_mask.shape[1])
+    light_mask[ys[valid], xs[valid]] = 1
+    return light_mask
 
-def coordinates_to_lightmap(xy, mask):
-    '''Takes a list of coordinates [(y,x),(y,x),...] and draws an ellipse on a mask for every point. '''
 
-    #Elipse properties
-    axesLength = (3, 3) 
-    angle = 0
-    startAngle = 0
-    endAngle = 360
-    color = (1) 
-    thickness = -1
-    light_mask = np.zeros_like(mask)        
-    center_coordinates = (int(xy[1]),int(xy[0]))
-    light_mask = cv2.ellipse(light_mask, center_coordinates, axesLength, angle, startAngle, endAngle, color, thickness) 
+MASK_THRESHOLD = 0.5  # pixels of non-bool masks >= this are switched on
 
-    return light_mask
+
+def binarize_mask(mask, threshold=MASK_THRESHOLD, out=None):
+    '''The pixels of a mask the dmd switches on, as bool: a bool mask as it is, others >= threshold.
+    Whatever decides if a tile is lit (e.g. empty tiles, deduplication) must use this to agree with the upload.
+    Args:
+        out: bool array of the shape of mask to write into
+    '''
+    mask = np.asarray(mask)
+    if mask.dtype != np.bool_:
+        return np.greater_equal(mask, threshold, out=out)
+    if out is None:
+        return mask
+    np.copyto(out, mask)
+    return out
+
+
+def grid_points(height, width, rows, cols, margin=0.15):
+    '''Returns rows*cols points [(x,y),...] on a regular grid, keeping a margin (fraction of the size) to the border.'''
+    xs = np.linspace(margin * width, (1 - margin) * width, cols)
+    ys = np.linspace(margin * height, (1 - margin) * height, rows)
+    return np.array([(x, y) for y in ys for x in xs], dtype=np.float32)
+
+
+@functools.lru_cache(maxsize=8)
+def checker_board_pattern(height, width, pixels=20):
+    '''Checkerboard of squares of pixels x pixels, uint8 0/1 of shape (height, width).
+    Built once per size and shared, the returned array is read only.
+    '''
+    ys = np.arange(height) // pixels
+    xs = np.arange(width) // pixels
+    pattern = ((ys[:, None] + xs[None, :] + 1) % 2).astype(np.uint8)
+    pattern.flags.writeable = False
+    return pattern
+
+
+def detect_spots(frames, blur=5, threshold=0.3, min_area=4):
+    '''Finds bright spots in a stack of frames and measures them in every frame at once.
+    Args:
+        frames: stack of camera images (n_frames, height, width), showing spots at fixed positions
+        blur: size of the box filter applied before thresholding
+        threshold: fraction between background and maximum of the brightest frame where a pixel counts as spot
+        min_area: spots with less pixels are dropped
+    Returns:
+        centroids: (n_spots, 2) subpixel x/y positions, intensity weighted
+        intensities: (n_spots, n_frames) summed background-free intensity of every spot in every frame
+    '''
+    frames = np.asarray(frames, dtype=np.float32)
+    if frames.ndim == 2:
+        frames = frames[np.newaxis]
+    blurred = np.stack([cv2.blur(frame, (blur, blur)) for frame in frames])
+    background = np.median(blurred, axis=(1, 2), keepdims=True)
+    signal = np.clip(blurred - background, 0, None)
+    projection = signal.max(axis=0)
+    binary = (projection > threshold * projection.max()).astype(np.uint8)
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    labels = labels.ravel()
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    keep[0] = False  # label 0 is the background
+    inside = keep[labels]
+    labels_inside = labels[inside]
+
+    #intensity weighted centroids of all spots in one pass
+    weights = projection.ravel()[inside]
+    ys, xs = np.divmod(np.flatnonzero(inside), projection.shape[1])
+    total = np.bincount(labels_inside, weights, n_labels)
+    cx = np.bincount(labels_inside, weights * xs, n_labels)
+    cy = np.bincount(labels_inside, weights * ys, n_labels)
+    ids = np.flatnonzero(keep)
+    centroids = np.column_stack([cx[ids] / total[ids], cy[ids] / total[ids]]).astype(np.float32)
+
+    intensities = np.stack([np.bincount(labels_inside, frame.ravel()[inside], n_labels)[ids] for frame in signal], axis=1)
+    return centroids, intensities
+
+
+def apply_transform(matrix, points):
+    '''Applies a 2x3 affine or 3x3 homography on points [(x,y),...].'''
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+    if len(points) == 0:
+        return np.empty((0, 2), dtype=np.float32)  # cv2 returns None for no points
+    if matrix.shape == (3, 3):
+        return cv2.perspectiveTransform(points, matrix).reshape(-1, 2)
+    return cv2.transform(points, matrix).reshape(-1, 2)
+
+
+def _sequence_repeats(exposure_times):
+    '''Number of times every frame is repeated to play exposure_times (ms) at one common exposure, and that
+    exposure in ms. (None, None) if there are no frames or an exposure time is not positive.'''
+    us = np.round(np.asarray(exposure_times, dtype=np.float64) * 1000).astype(np.int64)
+    if len(us) == 0 or (us <= 0).any():
+        return None, None
+    base = int(np.gcd.reduce(us))
+    return us // base, base / 1000
+
+
+def invert_transform(matrix):
+    '''Inverse of a 2x3 affine or 3x3 homography.'''
+    if matrix.shape == (3, 3):
+        return np.linalg.inv(matrix)
+    return cv2.invertAffineTransform(matrix)
+
+
+def fit_transform(points_camera, points_DMD, model='affine', ransac_threshold=3.):
+    '''Least squares fit of the camera -> dmd transformation with RANSAC.
+    Returns:
+        matrix: 2x3 affine or 3x3 homography
+        report: dict with the rms and max residual in dmd pixels, and the inlier mask
+    '''
+    points_camera = np.asarray(points_camera, dtype=np.float32)
+    points_DMD = np.asarray(points_DMD, dtype=np.float32)
+    if model == 'affine':
+        matrix, inliers = cv2.estimateAffine2D(points_camera, points_DMD, method=cv2.RANSAC,
+                                               ransacReprojThreshold=ransac_threshold)
+    elif model == 'homography':
+        matrix, inliers = cv2.findHomography(points_camera, points_DMD, cv2.RANSAC, ransac_threshold)
+    else:
+        raise ValueError(f"model must be 'affine' or 'homography', not {model!r}.")
+    if matrix is None:
+        raise RuntimeError('Calibration failed, could not fit a transformation to the detected spots.')
+    inliers = inliers.ravel().astype(bool)
+    residuals = np.linalg.norm(apply_transform(matrix, points_camera) - points_DMD, axis=1)
+    report = {
+        'n_points': len(points_DMD),
+        'n_inliers': int(inliers.sum()),
+        'inliers': inliers,
+        'residuals': residuals,
+        'rms': float(np.sqrt(np.mean(residuals[inliers] ** 2))),
+        'max': float(residuals[inliers].max()),
+    }
+    return matrix, report
 
 
 class dmd():
@@ -40,22 +185,34 @@ class dmd():
         self.width = self.core.get_slm_width(self.name)
         self.bppx = self.core.get_slm_bytes_per_pixel(self.name)
         self.exposure_time = self.core.get_slm_exposure(self.name)
+        #preallocated upload buffer, reused for every mask that is uploaded
+        self.mask_buffer = np.zeros(self.height * self.width, dtype=np.uint8)
+        self.warp_maps = {}  # warp_map per calibration, see get_warp_map
+
+    def get_warp_map(self, affine):
+        '''Returns the warp_map for affine. It is computed on the first call and reused afterwards.
+        '''
+        key = np.asarray(affine, dtype=np.float64).tobytes()
+        if key not in self.warp_maps:
+            if len(self.warp_maps) >= 8:
+                self.warp_maps.pop(next(iter(self.warp_maps)))
+            self.warp_maps[key] = warp_map(affine, self.height, self.width)
+        return self.warp_maps[key]
 
     def transform_img(self, img,affine):
         '''Applies transformation matrix on image in camera space. Returns mask in dmd space.
         Args:
             img: image in camera space
-            affine: affine transformation matrix
+            affine: affine transformation matrix (2x3) or homography (3x3)
         '''
-        img_transformed = cv2.warpAffine(img, affine, (self.width, self.height))
+        img_transformed = self.get_warp_map(affine).warp(img, reuse=False)
         return img_transformed
 
-
     def all_on(self):
         '''turn on projector all pixels for a long time
         '''
         self.core.set_slm_exposure(self.name, 200000)
-        self.core.set_property(self.name, 'OverlapMode', 'On')
+        set_property(self.core, self.name, 'OverlapMode', 'On')
         self.core.set_slm_pixels_to(self.name, 1)
         self.core.display_slm_image(self.name)   
 
@@ -63,34 +220,59 @@ class dmd():
         '''turn off pixels
         '''
         self.core.set_slm_exposure(self.name, 1)
-        self.core.set_property(self.name, 'OverlapMode', 'Off')
+        set_property(self.core, self.name, 'OverlapMode', 'Off')
         self.core.set_slm_pixels_to(self.name, 0)
         self.core.display_slm_image(self.name) 
 
+    def prepare_mask(self, mask, out=None, threshold=MASK_THRESHOLD):
+        '''Thresholds a mask into a contiguous uint8 buffer of 0/1 values, ready to be uploaded.
+        Works in a single vectorized pass, without intermediate copies of the mask.
+        Args:
+            mask: array in shape of dmd (height, width) or flattened (height*width). bool, integer or float.
+            out: flat uint8 buffer of size height*width to write into. Defaults to the dmd's own buffer.
+            threshold: pixels >= threshold are switched on. Ignored for bool masks.
+        '''
+        mask = np.asarray(mask)
+        if mask.shape != (self.height, self.width) and mask.shape != (self.height * self.width,):
+            raise ValueError(f'Mask shape {mask.shape} does not match dmd shape ({self.height}, {self.width}).')
+        if mask.dtype.kind not in 'biuf':
+            raise TypeError(f'Unsupported mask dtype {mask.dtype}.')
+        if out is None:
+            out = self.mask_buffer
+        binarize_mask(mask, threshold, out=out.view(np.bool_).reshape(mask.shape))
+        return out
+
+    def upload_buffer(self, buffer):
+        '''Uploads a buffer prepared with prepare_mask to the dmd.
+        '''
+        self.core.set_slm_image(self.name, buffer)
+
     def upload_mask(self, mask):
-        '''Converts np.array in shape of dmd into string, and uploades it to the dmd.
+        '''Converts np.array in shape of dmd into a uint8 buffer, and uploades it to the dmd.
         Args:
             mask: binary array in shape of dmd
         '''
-        flatarray = mask.ravel().tolist()
-        self.core.set_slm_image(self.name, np.array(flatarray).astype(np.uint8))
+        self.upload_buffer(self.prepare_mask(mask))
 
     def checker_board(self, pixels = 20):
         '''display a checkerboard pattern for a long time
         '''
-        #build checkerboard
-        checker_board = np.kron([[1, 0] * 20, [0, 1] * 20] * 15, np.ones((20, 20))) #https://stackoverflow.com/a/37440123
         self.core.set_slm_exposure(self.name, 200000)
-        self.core.set_property(self.name, 'OverlapMode', 'On')
-        self.upload_mask(checker_board)
+        set_property(self.core, self.name, 'OverlapMode', 'On')
+        self.upload_mask(checker_board_pattern(self.height, self.width, pixels))
         self.core.display_slm_image(self.name)   
     
     def display_mask(self,mask):
         '''Display the mask loaded on the dmd. Displays it for the set exposure.
         '''
-        self.upload_mask(mask)
+        self.display_buffer(self.prepare_mask(mask))
+
+    def display_buffer(self, buffer):
+        '''Same as display_mask, for a buffer that was already converted with prepare_mask.
+        '''
+        self.upload_buffer(buffer)
         self.core.set_slm_exposure(self.name, 200000)
-        self.core.set_property(self.name, 'OverlapMode', 'On')
+        set_property(self.core, self.name, 'OverlapMode', 'On')
         self.core.display_slm_image(self.name)
 
     def set_exposure(self, exposure_time):
@@ -107,7 +289,7 @@ class dmd():
         self.core.set_slm_exposure(self.name, dmd_exposure_time)#set exposure dmd
         self.core.set_exposure(camera_exposure_time)#set exposure camera
         self.upload_mask(mask) #upload mask to dmd        
-        self.display_mask()#display on dmd
+        self.core.display_slm_image(self.name)#display on dmd for dmd_exposure_time
         time.sleep(delay)#time between stimulation begin and capture begin
         self.core.snap_image()#take picture
         tagged_img = self.core.get_tagged_image()
@@ -132,12 +314,73 @@ class dmd():
         img = tagged_img.pix.reshape(img_height, img_width)
         return img
 
+    def sequence_max_length(self):
+        '''Max number of frames the dmd adapter can play as a hardware sequence. 0 if it can't.
+        '''
+        try:
+            return int(self.core.get_slm_sequence_max_length(self.name))
+        except Exception:
+            return 0
+
+    def play_sequence(self, masks, exposure_times, snap=False):
+        '''Display a stack of masks, each for its own exposure time, e.g. for grayscale dithering or dose ramps.
+        If the adapter supports sequences, the stack is uploaded in one call and played by the hardware.
+        A sequence has a single exposure time, so for different exposure times every frame is repeated:
+        exposure times of 10, 20 and 30 ms are played as 1, 2 and 3 frames of 10 ms (the greatest common
+        divisor, in us). If the expanded sequence is longer than the adapter accepts, or with snap, the frames
+        are played in a loop with the minimal number of calls: masks are converted up front and the exposure
+        is only set when it changes.
+        Args:
+            masks: stack of masks in dmd space (n_frames, height, width)
+            exposure_times: dmd exposure time per frame in ms, or a single value for all frames
+            snap: take an image during every frame (loop mode only)
+        Returns:
+            timing: dict with the mode ('hardware' or 'loop'), the total time and the time per frame in s
+            imgs: list of the captured images, empty without snap
+        '''
+        n_frames = len(masks)
+        exposure_times = np.broadcast_to(np.asarray(exposure_times, dtype=np.float64), (n_frames,))
+        buffers = np.empty((n_frames, self.height * self.width), dtype=np.uint8)
+        for frame in range(n_frames):
+            self.prepare_mask(masks[frame], out=buffers[frame])
+
+        start = time.perf_counter()
+        repeats, base = _sequence_repeats(exposure_times)
+        if not snap and repeats is not None and repeats.sum() <= self.sequence_max_length():
+            self.core.set_slm_exposure(self.name, base)
+            self.core.load_slm_sequence(self.name, list(np.repeat(buffers, repeats, axis=0)))
+            self.core.start_slm_sequence(self.name)
+            time.sleep(float(exposure_times.sum()) / 1000)
+            self.core.wait_for_device(self.name)
+            self.core.stop_slm_sequence(self.name)
+            total = time.perf_counter() - start
+            self.exposure_time = base
+            return {'mode': 'hardware', 'total': total, 'frames': list(total * repeats / repeats.sum())}, []
+
+        frames = []
+        imgs = []
+        current = None
+        for frame in range(n_frames):
+            frame_start = time.perf_counter()
+            if exposure_times[frame] != current:
+                current = exposure_times[frame]
+                self.core.set_slm_exposure(self.name, float(current))
+            self.upload_buffer(buffers[frame])
+            self.core.display_slm_image(self.name)
+            if snap:
+                imgs.append(acq(self.core))
+            self.core.wait_for_device(self.name)
+            frames.append(time.perf_counter() - frame_start)
+        if current is not None:
+            self.exposure_time = float(current)
+        return {'mode': 'loop', 'total': time.perf_counter() - start, 'frames': frames}, imgs
+
 
     def capture_and_stim_img(self, img, affine, dmd_exposure_time,camera_exposure_time,delay=0):
         '''Transform img using affine matrix, then stimulate using dmd and take an image.
         ''' 
         #mask = scipy.ndimage.affine_transform(img, affine, output_shape=(self.width, self.height))
-        mask = cv2.warpAffine(img, affine, (self.width, self.height))
+        mask = self.get_warp_map(affine).warp(img)
         img_captured = self.capture_and_stim_mask(mask, dmd_exposure_time,camera_exposure_time, delay)
         return img_captured
 
@@ -145,7 +388,7 @@ class dmd():
     def transform_and_disp(self, img, affine):
         '''Transform img using affine matrix, then uplaod and display it.
         ''' 
-        mask = cv2.warpAffine(img, affine, (self.width, self.height))
+        mask = self.get_warp_map(affine).warp(img)
         #self.core.set_slm_exposure(self.name, 20000)#set exposure dmd    
         self.display_mask(mask)#display on dmd
 
@@ -250,7 +493,103 @@ class dmd():
            #plt.show()
         return warp_mat
 
+    def snap_spots(self, points, circle_size=6):
+        '''Display circles at points [(x,y),...] in dmd space and take an image.
+        '''
+        mask = np.zeros((self.height, self.width), dtype=np.uint8)
+        for x, y in points:
+            cv2.circle(mask, (int(round(x)), int(round(y))), circle_size, 1, -1)
+        self.display_mask(mask)
+        return acq(self.core)
+
+    def verify_calibration(self, affine, rows=3, cols=4, circle_size=6, blur=5):
+        '''Check a calibration with a single frame: project a grid of spots, detect them in the camera image,
+        and compare their positions mapped through affine with the projected positions.
+        Returns:
+            report: dict with the rms and max error in dmd pixels, and the number of spots found
+        '''
+        points_DMD = grid_points(self.height, self.width, rows, cols)
+        img = self.snap_spots(points_DMD, circle_size)
+        self.all_off()
+        centroids, _ = detect_spots(img, blur=blur)
+        n_spots = len(points_DMD)
+        report = {'n_points': n_spots, 'n_detected': 0, 'rms': np.inf, 'max': np.inf}
+        if len(centroids) == 0:
+            return report
+        mapped = apply_transform(affine, centroids)
+        errors = np.linalg.norm(points_DMD[:, np.newaxis] - mapped[np.newaxis], axis=2).min(axis=1)
+        #spots that are further away than half the grid spacing were not found
+        spacing = np.linalg.norm(points_DMD[0] - points_DMD[1]) if n_spots > 1 else np.inf
+        found = errors < spacing / 2
+        report['n_detected'] = int(found.sum())
+        report['errors'] = errors
+        if found.all():
+            report['rms'] = float(np.sqrt(np.mean(errors ** 2)))
+            report['max'] = float(errors.max())
+        return report
+
+    def calibrate_grid(self, rows=3, cols=4, circle_size=6, blur=5, model='affine',
+                       initial_affine=None, ransac_threshold=3., verbous=False):
+        '''Calibrate the dmd and camera coordinate systems with a grid of spots, detected all at once.
+        Without initial_affine, the spots are multiplexed over ceil(log2(rows*cols+1)) frames:
+        spot k is on in the frames of the set bits of k+1, which identifies every detected spot.
+        With initial_affine (e.g. from a previous calibration), a single frame with all spots is projected
+        and the spots are matched to the positions predicted by initial_affine.
+        Args:
+            rows, cols: size of the spot grid
+            circle_size: radius of the spots in dmd pixels
+            model: 'affine' or 'homography'
+            initial_affine: approximate camera -> dmd transformation, enables the single frame mode
+            ransac_threshold: max residual in dmd pixels for a spot to count as inlier
+        Returns:
+            warp_mat: camera -> dmd transformation, 2x3 affine or 3x3 homography
+            report: dict with residuals, see fit_transform
+        '''
+        points_DMD = grid_points(self.height, self.width, rows, cols)
+        n_spots = len(points_DMD)
+        if initial_affine is None:
+            codes = np.arange(1, n_spots + 1)
+            n_frames = int(np.ceil(np.log2(n_spots + 1)))
+            on = (codes[:, np.newaxis] >> np.arange(n_frames)) & 1  # (n_spots, n_frames)
+        else:
+            n_frames = 1
+            on = np.ones((n_spots, 1), dtype=int)
+
+        frames = [self.snap_spots(points_DMD[on[:, frame] == 1], circle_size) for frame in range(n_frames)]
+        self.all_off()
+
+        centroids, intensities = detect_spots(frames, blur=blur)
+        if initial_affine is None:
+            #decode the frames each spot was on in
+            bits = intensities > 0.5 * intensities.max(axis=1, keepdims=True)
+            decoded = (bits * (1 << np.arange(n_frames))).sum(axis=1) - 1
+            valid = (decoded >= 0) & (decoded < n_spots)
+            index_DMD = decoded[valid]
+            points_camera = centroids[valid]
+        else:
+            predicted = apply_transform(invert_transform(initial_affine), points_DMD)
+            distance = np.linalg.norm(predicted[:, np.newaxis] - centroids[np.newaxis], axis=2)
+            nearest = distance.argmin(axis=1)
+            spacing = np.linalg.norm(predicted[0] - predicted[1])
+            valid = distance[np.arange(n_spots), nearest] < spacing / 2
+            index_DMD = np.flatnonzero(valid)
+            points_camera = centroids[nearest[valid]]
+
+        #a spot that is detected twice is ambiguous, drop it
+        unique, counts = np.unique(index_DMD, return_counts=True)
+        single = np.isin(index_DMD, unique[counts == 1])
+        index_DMD, points_camera = index_DMD[single], points_camera[single]
+        minimum = 3 if model == 'affine' else 4
+        if len(index_DMD) < minimum:
+            raise RuntimeError(f'Calibration failed, only {len(index_DMD)} of {n_spots} spots were detected.')
+
+        warp_mat, report = fit_transform(points_camera, points_DMD[index_DMD], model, ransac_threshold)
+        report['n_frames'] = n_frames
+        report['n_detected'] = len(index_DMD)
 
-
-
-
+        if verbous:
+            fig, ax = plt.subplots(figsize=(8, 8), dpi=150)
+            ax.imshow(np.max(frames, axis=0), cmap='gray')
+            ax.scatter(points_camera[:, 0], points_camera[:, 1], marker='x', c=np.where(report['inliers'], 'green', 'red'))
+            ax.set_title(f"rms residual {report['rms']:.2f} px, {report['n_inliers']}/{n_spots} inliers")
+        return warp_mat, report
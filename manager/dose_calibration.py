@@ -0,0 +1,269 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .acquisition import acq, acq_mask
+from .path_planner import plan_path
+from .stage import stage_position, move_to
+from .warp import warp_map
+
+
+def test_pattern(height, width, widths=(2, 4, 8, 16, 32), margin=40):
+    '''Line gratings for the dose calibration: one horizontal band per feature width,
+    each with vertical bars of that width and a period of twice the width.
+    Args:
+        height, width: size of the dmd
+        widths: bar widths in dmd pixels
+        margin: empty border in dmd pixels
+    Returns:
+        mask: uint8 pattern in dmd space
+        layout: dict with the widths, the (y0, y1) rows of every band and the x0, x1 columns of the gratings
+    '''
+    widths = tuple(int(w) for w in widths)
+    period = 2 * int(np.lcm.reduce(widths))
+    x0 = margin
+    x1 = x0 + (width - 2 * margin) // period * period  # a whole number of periods for every width
+    if x1 <= x0:
+        raise ValueError(f'The dmd is too narrow for a grating with a period of {period} pixels.')
+    band_height = (height - 2 * margin) // len(widths)
+    gap = band_height // 5
+    mask = np.zeros((height, width), dtype=np.uint8)
+    bands = []
+    xs = np.arange(x1 - x0)
+    for i, w in enumerate(widths):
+        y0 = margin + i * band_height
+        y1 = y0 + band_height - gap
+        mask[y0:y1, x0:x1] = (xs // w) % 2 == 0
+        bands.append((y0, y1))
+    return mask, {'widths': widths, 'bands': bands, 'x0': x0, 'x1': x1}
+
+
+_warp_maps = {}  # warp_map per calibration, kept in every worker process
+
+
+def analyse_images(imgs, affine, height, width, layout):
+    '''Feature width, edge sharpness and contrast of the gratings in a stack of images.
+    Runs in a worker process. The images are warped into dmd space, every band is averaged along
+    its bars into a profile, and all profiles are analysed at once.
+    Args:
+        imgs: camera images (n, camera_height, camera_width)
+        affine: camera -> dmd calibration of the exposure preset
+        height, width: size of the dmd
+        layout: layout from test_pattern
+    Returns:
+        dict of (n, n_bands) arrays: width (measured bar width in dmd pixels),
+        width_error (measured - designed width), contrast (Michelson) and sharpness
+        (steepest slope of the normalized edges per pixel, 1 for a perfect step)
+    '''
+    key = (np.asarray(affine, dtype=np.float64).tobytes(), height, width)
+    if key not in _warp_maps:
+        _warp_maps.clear()
+        _warp_maps[key] = warp_map(affine, height, width)
+    mapper = _warp_maps[key]
+    x0, x1 = layout['x0'], layout['x1']
+    profiles = []
+    for img in imgs:
+        warped = mapper.warp(np.asarray(img, dtype=np.float32))
+        # middle half of every band, away from the ends of the bars
+        profiles.append([warped[y0 + (y1 - y0) // 4:y1 - (y1 - y0) // 4, x0:x1].mean(axis=0)
+                         for y0, y1 in layout['bands']])
+    profiles = np.array(profiles)  # (n, n_bands, length)
+
+    widths = np.array(layout['widths'])
+    xs = np.arange(x1 - x0)
+    design = (xs[None, :] // widths[:, None]) % 2 == 0  # (n_bands, length)
+    on = (profiles * design).sum(-1) / design.sum(-1)
+    off = (profiles * ~design).sum(-1) / (~design).sum(-1)
+    contrast = np.abs(on - off) / np.maximum(on + off, 1e-9)
+    # 1 on the bars, 0 between them, whatever the polarity of the image
+    normalized = (profiles - off[..., None]) / np.where(np.abs(on - off) > 1e-9, on - off, 1e-9)[..., None]
+
+    measured = np.empty_like(contrast)
+    sharpness = np.empty_like(contrast)
+    for band, w in enumerate(widths):
+        periods = normalized[:, band].reshape(len(profiles), -1, 2 * w)
+        measured[:, band] = (periods > 0.5).sum(-1).mean(-1)
+        steps = np.diff(periods, axis=-1)
+        sharpness[:, band] = 0.5 * (steps.max(-1) + (-steps).max(-1)).mean(-1)
+    return {'width': measured, 'width_error': measured - widths, 'contrast': contrast, 'sharpness': sharpness}
+
+
+class dose_calibration:
+    '''Exposure calibration grid: prints a test pattern with every combination of led power (columns)
+    and exposure time (rows), as the exposure calibration mode of the notebook did, and analyses the images
+    in a process pool while the grid is still printing. From the results, it fits a dose-response model
+    and recommends exposure settings.
+    '''
+    def __init__(self, dmd, preset, led_powers, exposure_times, x_offset, y_offset, x_start=None, y_start=None,
+                 imaging_preset=None, widths=(2, 4, 8, 16, 32), min_contrast=0.2, processes=2):
+        '''Args:
+            dmd: dmd object used for the exposures
+            preset: exposure preset, with a dmd calibration in preset.affine. Its power is the last setting (see set_power).
+            led_powers: one power per column of the grid
+            exposure_times: one camera (= light) exposure time in ms per row of the grid
+            x_offset, y_offset: stage step between grid cells in um
+            x_start, y_start: stage position of cell (0, 0), defaults to the current position
+            imaging_preset: preset that images the printed pattern without curing (e.g. red light with the dmd all on).
+                If None, the image taken during the exposure is analysed.
+            widths: bar widths of the test pattern in dmd pixels
+            min_contrast: bands with a lower contrast count as not resolved
+            processes: number of worker processes for the analysis
+        '''
+        if preset.affine is None:
+            raise ValueError('The exposure preset needs a dmd calibration (preset.affine) to locate the features.')
+        self.dmd = dmd
+        self.core = dmd.core
+        self.preset = preset
+        self.imaging_preset = imaging_preset
+        self.led_powers = np.asarray(led_powers)
+        self.exposure_times = np.asarray(exposure_times)
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+        self.x_start = x_start
+        self.y_start = y_start
+        self.min_contrast = min_contrast
+        self.processes = processes
+        self.pattern, self.layout = test_pattern(dmd.height, dmd.width, widths)
+        self.results = []
+        self.results_lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return len(self.exposure_times), len(self.led_powers)
+
+    def _capture(self, row, col):
+        power = self.led_powers[col]
+        self.preset.set_power(power.item())
+        self.preset.camera_exposure_time = self.exposure_times[row].item()
+        img = acq_mask(self.pattern, self.preset, self.dmd)
+        if self.imaging_preset is None:
+            return img
+        self.imaging_preset.apply()
+        if self.imaging_preset.camera_exposure_time is not None:
+            self.core.set_exposure(int(self.imaging_preset.camera_exposure_time))
+        self.dmd.all_on()
+        img = acq(self.core)
+        self.dmd.all_off()
+        return img
+
+    def run(self, on_result=None, progress=None):
+        '''Prints and analyses the grid. Returns the results sorted by (row, col), see analyse_images.
+        Args:
+            on_result: function(result) called as soon as the analysis of a cell is done, while the grid
+                is still printing. result is a dict with row, col, power, exposure_time, dose and the metrics.
+            progress: optional function(index) called whenever a cell is printed, e.g. pbar.update
+        '''
+        if self.x_start is None or self.y_start is None:
+            point = self.core.get_xy_stage_position()
+            self.x_start, self.y_start = point.get_x(), point.get_y()
+        rows, cols = self.shape
+        cells = [[self.pattern] * cols for _ in range(rows)]
+        plan = plan_path(cells, self.x_offset, self.y_offset, self.x_start, self.y_start, skip_empty=False)
+        self.results = []
+        original_power = self.preset.settings[-1][2]
+        original_exposure = self.preset.camera_exposure_time
+        pending = []
+        try:
+            with ProcessPoolExecutor(max_workers=self.processes) as pool:
+                for index, (pos, (row, col)) in enumerate(zip(plan.positions, plan.tile_indices)):
+                    move_to(self.core, pos)
+                    img = self._capture(row, col)
+                    future = pool.submit(analyse_images, img[None], self.preset.affine,
+                                         self.dmd.height, self.dmd.width, self.layout)
+                    future.add_done_callback(lambda f, row=row, col=col: self._collect(f, row, col, on_result))
+                    pending.append(future)
+                    if progress is not None:
+                        progress(index)
+                for future in pending:
+                    future.result()  # raises errors of the analysis
+        finally:
+            self.preset.set_power(original_power)
+            self.preset.camera_exposure_time = original_exposure
+            move_to(self.core, stage_position(self.x_start, self.y_start, None))
+        with self.results_lock:
+            self.results.sort(key=lambda r: (r['row'], r['col']))
+            return list(self.results)
+
+    def _collect(self, future, row, col, on_result):
+        if future.cancelled() or future.exception() is not None:
+            return
+        metrics = future.result()
+        power = float(self.led_powers[col])
+        exposure_time = float(self.exposure_times[row])
+        result = {'row': row, 'col': col, 'power': power, 'exposure_time': exposure_time,
+                  'dose': power * exposure_time}
+        result.update({key: value[0] for key, value in metrics.items()})
+        with self.results_lock:
+            self.results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    def maps(self):
+        '''Mean metrics over the bands and the smallest resolved bar width (resolution) as (rows, cols) arrays,
+        e.g. for plt.imshow. Cells not analysed yet are nan.'''
+        with self.results_lock:
+            results = list(self.results)
+        maps = {key: np.full(self.shape, np.nan) for key in ('width_error', 'contrast', 'sharpness', 'resolution')}
+        widths = np.array(self.layout['widths'])
+        for r in results:
+            for key in ('width_error', 'contrast', 'sharpness'):
+                maps[key][r['row'], r['col']] = float(np.mean(r[key]))
+            resolved = widths[r['contrast'] >= self.min_contrast]
+            if len(resolved):
+                maps['resolution'][r['row'], r['col']] = resolved.min()
+        return maps
+
+    def fit(self):
+        '''Fits the dose-response model to the results so far (can be called during run).
+        Feature width and contrast grow with the logarithm of the dose, as in the working curve of
+        photoresists: width_error = a + b*ln(dose), on the bands with at least min_contrast,
+        and mean contrast = k*ln(dose/threshold_dose).
+        Returns:
+            dict with a, b, k, threshold_dose and the dose at which the features have their designed width,
+            or None if there are not enough printed cells with different doses
+        '''
+        with self.results_lock:
+            results = list(self.results)
+        if not results:
+            return None
+        dose = np.array([r['dose'] for r in results])
+        contrast = np.array([r['contrast'] for r in results])  # (cells, bands)
+        resolved = contrast >= self.min_contrast
+        printed = resolved.any(axis=1)
+        # bars that are not resolved have no meaningful width
+        errors = np.array([r['width_error'] for r in results])
+        width_error = (errors * resolved).sum(axis=1) / np.maximum(resolved.sum(axis=1), 1)
+        contrast = contrast.mean(axis=1)
+        if len(np.unique(dose[printed])) < 2 or len(np.unique(dose)) < 2:
+            return None
+        log_dose = np.log(dose)
+        b, a = np.polyfit(log_dose[printed], width_error[printed], 1)
+        k, c = np.polyfit(log_dose, contrast, 1)
+        threshold_dose = float(np.exp(-c / k)) if k > 0 else np.nan
+        target_dose = float(np.exp(-a / b)) if b > 0 else np.nan
+        return {'a': float(a), 'b': float(b), 'k': float(k), 'threshold_dose': threshold_dose,
+                'target_dose': target_dose, 'cells': len(results), 'printed': int(printed.sum())}
+
+    def recommend(self):
+        '''Recommended exposure settings for the results so far (can be called during run).
+        Returns:
+            dict with the fit, the grid cell closest to the target dose and, for the highest led power that
+            allows it, the exposure time that gives the target dose. None if the model can't be fitted.
+        '''
+        model = self.fit()
+        if model is None or not np.isfinite(model['target_dose']):
+            return None
+        target = max(model['target_dose'], model['threshold_dose']) if np.isfinite(model['threshold_dose']) \
+            else model['target_dose']
+        doses = self.exposure_times[:, None] * self.led_powers[None, :]
+        row, col = np.unravel_index(np.argmin(np.abs(np.log(doses) - np.log(target))), doses.shape)
+        recommendation = {'model': model, 'dose': target, 'cell': (int(row), int(col)),
+                          'cell_power': float(self.led_powers[col]),
+                          'cell_exposure_time': float(self.exposure_times[row])}
+        # shortest exposure: highest power that doesn't need an exposure below the calibrated range
+        times = target / self.led_powers
+        valid = times >= self.exposure_times.min()
+        if np.any(valid):
+            best = np.argmax(np.where(valid, self.led_powers, -np.inf))
+            recommendation['power'] = float(self.led_powers[best])
+            recommendation['exposure_time'] = float(times[best])
+        return recommendation
@@ -0,0 +1,127 @@
+import time
+import cv2
+import numpy as np
+
+
+def _prepare(img, downsample):
+    img = np.asarray(img, dtype=np.float32)
+    if downsample > 1:
+        img = cv2.resize(img, (max(1, img.shape[1] // downsample), max(1, img.shape[0] // downsample)),
+                         interpolation=cv2.INTER_AREA)
+    return img
+
+
+def laplacian_variance(img, downsample=2):
+    '''Variance of the Laplacian of the image, higher is sharper.'''
+    return float(cv2.Laplacian(_prepare(img, downsample), cv2.CV_32F).var())
+
+
+def brenner(img, downsample=2):
+    '''Brenner gradient: mean squared difference of pixels two apart, in x and y. Higher is sharper.'''
+    img = _prepare(img, downsample)
+    dx = img[:, 2:] - img[:, :-2]
+    dy = img[2:, :] - img[:-2, :]
+    return float((dx * dx).mean() + (dy * dy).mean())
+
+
+metrics = {'laplacian': laplacian_variance, 'brenner': brenner}
+
+
+def focus_score(img, metric='laplacian', downsample=2):
+    '''Sharpness of a camera image.
+    Args:
+        img: camera image, 2D
+        metric: 'laplacian' (variance of the Laplacian) or 'brenner' (Brenner gradient)
+        downsample: the image is reduced by this factor first, which also suppresses pixel noise
+    '''
+    if metric not in metrics:
+        raise ValueError(f"metric must be one of {list(metrics)}, not {metric!r}.")
+    return metrics[metric](img, downsample)
+
+
+def _direct(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def _frame_after_move(core, skip=1, timeout=5., call=_direct):
+    '''Newest frame of the running sequence acquisition that was exposed after the call.
+    The first skip frames are dropped, they may have been exposed while the focus was still moving.
+    '''
+    call(core.clear_circular_buffer)
+    deadline = time.perf_counter() + timeout
+    while call(core.get_remaining_image_count) <= skip:
+        if time.perf_counter() > deadline:
+            raise TimeoutError('No new frame from the camera.')
+        time.sleep(0.001)
+    return np.reshape(call(core.get_last_image), call(_image_shape, core))
+
+
+def _image_shape(core):
+    return core.get_image_height(), core.get_image_width()
+
+
+def _move_focus(core, focus_device, z):
+    core.set_position(focus_device, z)
+    core.wait_for_device(focus_device)
+
+
+def _peak(zs, scores):
+    '''z of the maximum of scores, refined with a parabola through the maximum and its neighbours.'''
+    best = int(np.argmax(scores))
+    if 0 < best < len(zs) - 1:
+        s0, s1, s2 = scores[best - 1], scores[best], scores[best + 1]
+        curvature = s0 - 2 * s1 + s2
+        if curvature < 0:
+            step = zs[best + 1] - zs[best]
+            return float(zs[best] + step * 0.5 * (s0 - s2) / curvature)
+    return float(zs[best])
+
+
+def autofocus(core, dmd=None, z_range=20., steps=9, refine=2, metric='laplacian', downsample=2, skip=1, timeout=5.,
+              call=_direct):
+    '''Software autofocus: sweeps the focus drive around the current z and moves to the sharpest image.
+    The sweep is coarse to fine: every level samples steps positions, the next level samples the two steps
+    around the best one of the previous level. Frames come from the continuous sequence acquisition (started
+    if it is not running), so there is no snap per position.
+    Args:
+        dmd: if given, the checkerboard is projected, for a sample without structure. The dmd is switched
+            off afterwards, also if the sweep fails (the core can't read back the pattern displayed before).
+        z_range: range of the first sweep in um, centered on the current z
+        steps: positions per level
+        refine: number of finer levels after the first sweep
+        metric, downsample: see focus_score
+        skip: frames dropped after every move, see _frame_after_move
+        call: function(fn, *args) that runs every hardware step, e.g. on the thread that owns the core.
+            The steps are short (move, poll, grab), so others can use the core in between.
+    Returns:
+        z: the z the focus was moved to
+        samples: (n, 2) array of all sampled (z, score)
+    '''
+    focus_device = call(core.get_focus_device)
+    center = call(core.get_position, focus_device)
+    span = z_range
+    started = False
+    samples = []
+    try:
+        if dmd is not None:
+            call(dmd.checker_board)
+        started = not call(core.is_sequence_running)
+        if started:
+            call(core.start_continuous_sequence_acquisition, 0)
+        for _ in range(refine + 1):
+            zs = np.linspace(center - span / 2, center + span / 2, steps)
+            scores = []
+            for z in zs:
+                call(_move_focus, core, focus_device, z)
+                frame = _frame_after_move(core, skip, timeout, call)
+                scores.append(focus_score(frame, metric, downsample))  # on the calling thread
+            samples.extend(zip(zs, scores))
+            center = _peak(zs, scores)
+            span = 2 * (zs[1] - zs[0])
+        call(_move_focus, core, focus_device, center)
+    finally:
+        if started:
+            call(core.stop_sequence_acquisition)
+        if dmd is not None:
+            call(dmd.all_off)
+    return center, np.array(samples)
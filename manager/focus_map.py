@@ -0,0 +1,127 @@
+import numpy as np
+from scipy.interpolate import RBFInterpolator
+from .stage import move_to, position_table
+
+
+class focus_map:
+    '''Focus (z or PFS offset) as a smooth function of the stage x/y, fitted to a few focus measurements.
+    The slide tilt is captured by a plane, local warping by a thin-plate spline. The focus of all tiles of
+    a print is predicted in one call, so the stage can go to every tile with one combined XYZ move
+    (move_to(core, pos, focus='z')) instead of refocusing at every tile.
+    '''
+    def __init__(self, x, y, z, method='auto', smoothing=0.01):
+        '''Args:
+            x, y: stage positions of the measurements in um
+            z: measured focus at these positions (z in um or PFS offset)
+            method: 'plane', 'tps' (thin-plate spline with a plane as trend) or 'auto' (tps from 6 points on)
+            smoothing: thin-plate smoothing, for coordinates scaled to the extent of the measurements.
+                The default keeps the noise of the focus measurements out of the map at little cost for
+                exact measurements, 0 interpolates the measurements exactly.
+        '''
+        if method not in ('auto', 'plane', 'tps'):
+            raise ValueError(f"method must be 'auto', 'plane' or 'tps', not {method!r}.")
+        x, y, z = (np.asarray(v, dtype=np.float64).ravel() for v in (x, y, z))
+        valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(z)
+        self.x, self.y, self.z = x[valid], y[valid], z[valid]
+        if len(self.z) < 3:
+            raise ValueError(f'A focus map needs at least 3 measurements, got {len(self.z)}.')
+        if method == 'auto':
+            method = 'tps' if len(self.z) >= 6 else 'plane'
+        self.method = method
+        #center the coordinates, stage positions are large numbers
+        self.center = np.array([self.x.mean(), self.y.mean()])
+        xy = self._xy(self.x, self.y)
+        #measurements on one line (e.g. a single row of tiles) don't define a surface:
+        #fit along the line, the focus is constant across it
+        _, singular, vt = np.linalg.svd(xy, full_matrices=False)
+        if singular[0] <= 1e-9 * max(1., np.abs(self.center).max()):
+            raise ValueError('The focus measurements are all at the same position.')
+        self.axis = vt[0] if singular[1] <= 1e-6 * singular[0] else None
+        coords = self._coords(xy)
+        self.extent = float(np.abs(coords).max())  # the spline is fitted on coordinates in [-1, 1]
+        if method == 'plane':
+            design = np.column_stack([coords, np.ones(len(coords))])
+            self.plane, *_ = np.linalg.lstsq(design, self.z, rcond=None)
+            self.surface = None
+        else:
+            self.plane = None
+            self.surface = RBFInterpolator(coords / self.extent, self.z, kernel='thin_plate_spline', degree=1,
+                                           smoothing=smoothing)
+
+    @classmethod
+    def from_positions(cls, positions, field='z', **kwargs):
+        '''Focus map from measured positions, e.g. stage.load_pos_file(...) or FabscopeUI.position_list.
+        Positions where field is nan are ignored.
+        Args:
+            field: 'z' or 'pfs_offset'
+        '''
+        table = positions if isinstance(positions, position_table) else position_table.from_positions(positions)
+        return cls(table.x, table.y, getattr(table, field), **kwargs)
+
+    def _xy(self, x, y):
+        return np.column_stack([np.ravel(x), np.ravel(y)]) - self.center
+
+    def _coords(self, xy):
+        '''Coordinates the map is fitted in: x/y, or the position along the line of the measurements.'''
+        return xy if self.axis is None else (xy @ self.axis)[:, np.newaxis]
+
+    def predict(self, x, y):
+        '''Focus at the stage positions x, y (scalars or arrays of any shape).'''
+        shape = np.shape(x)
+        coords = self._coords(self._xy(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)))
+        if self.plane is not None:
+            z = coords @ self.plane[:-1] + self.plane[-1]
+        else:
+            z = self.surface(coords / self.extent)
+        return z.reshape(shape) if shape else float(z[0])
+
+    def residuals(self):
+        '''Measured minus predicted focus at the measurements. Zero for a thin-plate spline without smoothing.'''
+        return self.z - self.predict(self.x, self.y)
+
+    def tilt(self):
+        '''Slope of the best fitting plane in x and y (focus units per um).'''
+        design = np.column_stack([self._xy(self.x, self.y), np.ones(len(self.z))])
+        plane, *_ = np.linalg.lstsq(design, self.z, rcond=None)
+        return float(plane[0]), float(plane[1])
+
+    def apply(self, positions, field='z'):
+        '''Copy of the positions (position_table or list of stage_position) with field set to the predicted focus,
+        e.g. focus_map.apply(plan.positions) before print_job(..., focus='z').'''
+        table = positions if isinstance(positions, position_table) else position_table.from_positions(positions)
+        data = table.data.copy()
+        data[field] = self.predict(data.x, data.y)
+        return position_table(data)
+
+
+def sample_points(positions, rows=3, cols=3):
+    '''Sparse measurement points for a focus map: the positions closest to a rows x cols grid over their
+    bounding box, without duplicates, as a position_table.'''
+    table = positions if isinstance(positions, position_table) else position_table.from_positions(positions)
+    xy = table.xy
+    gx = np.linspace(xy[:, 0].min(), xy[:, 0].max(), cols)
+    gy = np.linspace(xy[:, 1].min(), xy[:, 1].max(), rows)
+    grid = np.stack(np.meshgrid(gx, gy), axis=-1).reshape(-1, 2)
+    distances = ((grid[:, None, :] - xy[None, :, :]) ** 2).sum(axis=-1)
+    closest = np.unique(distances.argmin(axis=1))
+    return table[closest]
+
+
+def measure_focus(core, positions, autofocus=None):
+    '''Visits the positions and records the focus found there.
+    Args:
+        autofocus: optional function(core) run at every position before reading the focus, e.g. a software
+            autofocus. Without it, the focus is read as the PFS left it.
+    Returns:
+        position_table with the measured z and PFS offset at every position
+    '''
+    table = positions if isinstance(positions, position_table) else position_table.from_positions(positions)
+    data = table.data.copy()
+    focus_device = core.get_focus_device()
+    for i in range(len(data)):
+        move_to(core, data[i])
+        if autofocus is not None:
+            autofocus(core)
+        data.z[i] = core.get_position(focus_device)
+        data.pfs_offset[i] = core.get_auto_focus_offset()
+    return position_table(data)
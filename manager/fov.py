@@ -1,5 +1,7 @@
 import queue
 from trackpy.linking import Linker
+from .stage import move_to
+from .async_core import move_to_async
 
 class FOV:
     ''' Class that provides FOV abstraction. Every FOV has properties like:
@@ -8,10 +10,12 @@ class FOV:
             stage_position: the position of the X/Y microscope stage
             treatment: the experimental treatment associated with that FOV
             index: an index between [0,total number FOVs]
+            focus: None to keep the PFS, 'z' or 'pfs_offset' to move the focus with the stage, see stage.move_to
     '''
-    def __init__(self, core, stage_position, treatment, index, search_range, memory,percentage):
+    def __init__(self, core, stage_position, treatment, index, search_range, memory,percentage, focus=None):
         self.core = core
         self.pos = stage_position
+        self.focus = focus
         self.treatment = treatment
         self.index = index
         self.pipeline_thread = None
@@ -35,9 +39,8 @@ class FOV:
         self.light_mask = self.light_mask_queue.get() #take the latest tracks and store locally
 
     def move_stage_to_fov(self):
-        xy_stage = self.core.get_xy_stage_device()
-        focus_device = self.core.get_focus_device()
-        self.core.set_xy_position(xy_stage,self.pos.x,self.pos.y)
-        #self.core.set_position(self.pos.z) #TODO disable to keep PFS
-        self.core.wait_for_device(xy_stage)
-        self.core.wait_for_device(focus_device)
+        move_to(self.core, self.pos, self.focus)
+
+    async def move_stage_to_fov_async(self, acore):
+        '''See move_stage_to_fov, on an async_core: other devices can be commanded while the stage moves.'''
+        await move_to_async(acore, self.pos, self.focus)
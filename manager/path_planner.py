@@ -0,0 +1,139 @@
+import numpy as np
+from .stage import position_table
+
+
+class path_plan:
+    '''Ordered list of stage positions for a tiled print, with the tile (row, col) printed at each of them.
+    '''
+    def __init__(self, positions, tile_indices, distance, time, method):
+        self.positions = positions  # position_table, in print order
+        self.tile_indices = tile_indices  # list of (row, col) into tiles[row][col]
+        self.distance = distance  # estimated stage travel in um
+        self.time = time  # estimated stage travel time in s
+        self.method = method
+
+    def __len__(self):
+        return len(self.positions)
+
+    def select(self, tiles):
+        '''The tiles of a grid tiles[row][col] in the order of the plan, e.g. for print_job.'''
+        return [tiles[row][col] for row, col in self.tile_indices]
+
+    def __repr__(self):
+        return (f'path_plan({self.method}: {len(self)} tiles, '
+                f'{self.distance / 1000:.1f} mm, {self.time:.1f} s travel)')
+
+
+def tile_coordinates(tiles, x_offset, y_offset, x_start=0., y_start=0., skip_empty=True):
+    '''Stage coordinates of the tiles in a grid tiles[row][col], as printed in the notebook:
+    tile (row, col) is at x_start + col*x_offset, y_start + row*y_offset.
+    Args:
+        skip_empty: drop tiles where all pixels are zero
+    Returns:
+        indices: (n, 2) array of (row, col)
+        xy: (n, 2) array of stage coordinates
+    '''
+    grid_height = len(tiles)
+    grid_width = len(tiles[0]) if grid_height > 0 else 0
+    indices = [(row, col) for row in range(grid_height) for col in range(grid_width)
+               if not skip_empty or np.any(tiles[row][col])]
+    indices = np.array(indices, dtype=int).reshape(-1, 2)
+    xy = np.column_stack([x_start + indices[:, 1] * x_offset, y_start + indices[:, 0] * y_offset])
+    return indices, xy
+
+
+def _step_lengths(xy):
+    '''Travel for every move along the path. The axes of the stage move at the same time,
+    so a move takes as long as its longest axis.'''
+    return np.abs(np.diff(xy, axis=0)).max(axis=1) if len(xy) > 1 else np.zeros(0)
+
+
+def serpentine_order(indices):
+    '''Column by column like the notebook, but every second column is walked backwards (no flyback).'''
+    if len(indices) == 0:
+        return np.zeros(0, dtype=int)
+    rows = np.where(indices[:, 1] % 2 == 0, indices[:, 0], -indices[:, 0])
+    return np.lexsort((rows, indices[:, 1]))
+
+
+def nearest_neighbour_order(xy, start):
+    '''Greedy path: always move to the closest tile that is not printed yet.'''
+    n = len(xy)
+    order = np.empty(n, dtype=int)
+    visited = np.zeros(n, dtype=bool)
+    current = np.asarray(start, dtype=float)
+    for i in range(n):
+        distance = np.abs(xy - current).max(axis=1)
+        distance[visited] = np.inf
+        nearest = int(np.argmin(distance))
+        order[i] = nearest
+        visited[nearest] = True
+        current = xy[nearest]
+    return order
+
+
+def two_opt(xy, order, start, max_passes=50):
+    '''Improve an open path that begins at start by reversing segments, until no reversal shortens it.
+    Every pass evaluates all segment ends for one segment begin at once.
+    '''
+    order = np.array(order, dtype=int)
+    n = len(order)
+    if n < 3:
+        return order
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            path = np.vstack([start, xy[order]])  # path[k+1] is tile order[k]
+            prev = path[i]
+            first = path[i + 1]
+            ends = path[i + 2:]  # candidate last tiles of the reversed segment
+            nexts = path[i + 3:]  # the tiles after them, the last end has none
+            removed = np.abs(prev - first).max() + np.append(np.abs(nexts - ends[:-1]).max(axis=1), 0.)
+            added = np.abs(prev - ends).max(axis=1) + np.append(np.abs(nexts - first).max(axis=1), 0.)
+            gain = removed - added
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                j = i + 1 + best
+                order[i:j + 1] = order[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def plan_path(tiles, x_offset, y_offset, x_start=0., y_start=0., z=None, method='auto',
+              stage_speed=5000., settle_time=0.1, skip_empty=True):
+    '''Plan the order in which tiles are printed, dropping empty tiles.
+    Args:
+        tiles: 2D list of masks tiles[row][col], e.g. from utils.mask_handler.tile_array
+        x_offset, y_offset: measured stage step between neighbouring tiles in um
+        x_start, y_start: stage position of tile (0, 0), the path starts there
+        z: z of all returned positions
+        method: 'serpentine', 'nearest' (nearest neighbour + 2-opt) or 'auto' (the shorter of both)
+        stage_speed: stage speed in um/s, to estimate the travel time
+        settle_time: time per move in s, to estimate the travel time
+    Returns:
+        path_plan
+    '''
+    if method not in ('auto', 'serpentine', 'nearest'):
+        raise ValueError(f"method must be 'auto', 'serpentine' or 'nearest', not {method!r}.")
+    indices, xy = tile_coordinates(tiles, x_offset, y_offset, x_start, y_start, skip_empty)
+    start = np.array([x_start, y_start], dtype=float)
+
+    candidates = {}
+    if method in ('auto', 'serpentine'):
+        candidates['serpentine'] = serpentine_order(indices)
+    if method in ('auto', 'nearest'):
+        candidates['nearest'] = two_opt(xy, nearest_neighbour_order(xy, start), start)
+
+    def length(order):
+        return _step_lengths(np.vstack([start, xy[order]])).sum()
+
+    best = min(candidates, key=lambda name: length(candidates[name]))
+    order = candidates[best]
+    steps = _step_lengths(np.vstack([start, xy[order]]))
+    moves = np.count_nonzero(steps)
+    positions = position_table.from_arrays(xy[order, 0], xy[order, 1], z)
+    tile_indices = [tuple(i) for i in indices[order].tolist()]
+    return path_plan(positions, tile_indices, float(steps.sum()),
+                     float(steps.sum() / stage_speed + moves * settle_time), best)
@@ -1,42 +1,144 @@
 import time
+import threading
+import weakref
+
+
+class device_state_cache:
+    '''Shadow copy of the device properties that were set through presets, keyed by (device, property).
+    Allows to skip writes of values that are already applied. Shared by all presets of the same core.
+    It only knows about writes through presets, set_property and the dmd class. Properties changed any other
+    way (core.set_property in a notebook, the micro-manager GUI) must be forgotten with invalidate,
+    otherwise presets with skip_applied skip writes that are needed.
+    '''
+    def __init__(self):
+        self.state = {}
+
+    def is_applied(self, device, prop, value):
+        key = (device, prop)
+        return key in self.state and self.state[key] == str(value)
+
+    def update(self, device, prop, value):
+        self.state[(device, prop)] = str(value)
+
+    def invalidate(self, device=None, prop=None):
+        '''Forget the cached values, e.g. after an error or after a property was changed outside of a preset.
+        Args:
+            device: only forget properties of this device. All devices if None.
+            prop: only forget this property. All properties if None.
+        '''
+        for key in list(self.state):
+            if (device is None or key[0] == device) and (prop is None or key[1] == prop):
+                del self.state[key]
+
+
+_state_caches = weakref.WeakKeyDictionary()  # core -> device_state_cache, dropped with the core
+_state_caches_lock = threading.Lock()
+
+def unwrap_core(core):
+    '''The core behind wrappers of it. A wrapper (e.g. trace.traced_core) defines a method unwrap()
+    that returns the object it wraps. It is looked up on the class, so wrappers that forward unknown
+    attributes to the core don't pass for a core.
+    '''
+    while hasattr(type(core), 'unwrap'):
+        core = core.unwrap()
+    return core
+
+def state_cache(core):
+    '''Returns the device_state_cache shared by all presets that use core.
+    A wrapped core (e.g. trace.traced_core(core)) shares the cache of the core it wraps.
+    The cache is held with a weak reference to the core and dropped with it.
+    '''
+    core = unwrap_core(core)
+    with _state_caches_lock:
+        try:
+            cache = _state_caches.get(core)
+            if cache is None:
+                cache = _state_caches[core] = device_state_cache()
+        except TypeError:
+            raise TypeError(f'{type(core).__name__} does not support weak references, '
+                            'it can not have a device state cache.') from None
+        return cache
+
+
+def set_property(core, device, prop, value):
+    '''Sets a device property and records it in the state cache, so presets know about the change.'''
+    core.set_property(device, prop, value)
+    state_cache(core).update(device, prop, value)
+
 
 class preset:
-    def __init__(self,core,settings = []):
+    def __init__(self,core,settings = [], skip_applied = False):
         '''Allows to store and apply multiple device properties at once.
         A dmd calibration affine transformation matrix can be created and stored.
+        Args:
+            skip_applied: don't set properties that the state cache (see device_state_cache) says are already
+                applied. Only safe if the properties are not changed outside of presets, set_property and
+                the dmd class, or if the cache is invalidated after that.
         '''
         #list of commands in the form of
         #[['device_name', 'property_name', 'property_value'],
         #     ['device_name_2', 'property_name_2', 'property_value_2']]
         self.settings = settings
         self.affine = None #as dmd calibrations are done per channel, it makes sense to store them with a preset
+        self.calibration_report = None
         self.core = core
         self.camera_exposure_time = None
         self.dmd_exposure_time = None
         self.name = None
+        self.skip_applied = skip_applied
         
     def set_power(self, power):
         '''change the power of the laser/led. put property to change in last line of prests'''
         self.settings[-1][2] = power
         
-    def apply_no_retry(self, verbous = False):
-        '''Apply the settings by setting the respective device properties in micro manager. 
-        Waits until all the devices are not busy anymore.
-        Args: 
+    def set_settings(self, verbous = False, force = False):
+        '''Set all device properties (with skip_applied only those not already applied), then wait for the
+        devices that changed.
+        Args:
             verbous: print out all changes applied
+            force: set all properties, even with skip_applied
         '''
+        cache = state_cache(self.core)
+        skip = self.skip_applied and not force
+        touched = []
         for setting in self.settings:
+            if skip and cache.is_applied(setting[0], setting[1], setting[2]):
+                continue
             #will result in such a command:
             #core.set_property('Core', 'AutoShutter', 0)
             if verbous:
                 print(str(setting[0])+": Set " + str(setting[1]) + " to " + str(setting[2]))
             self.core.set_property(setting[0], setting[1], setting[2])
-        for setting in self.settings:
+            cache.update(setting[0], setting[1], setting[2])
+            if setting[0] not in touched:
+                touched.append(setting[0])
+        for device in touched:
             #wait until none of the devices changed are busy anymore
-            self.core.wait_for_device(setting[0])
+            self.core.wait_for_device(device)
+
+    def invalidate(self):
+        '''Forget the cached state of all properties in settings. The next apply sets all of them again.
+        '''
+        cache = state_cache(self.core)
+        for setting in self.settings:
+            cache.invalidate(setting[0], setting[1])
+
+    def apply_no_retry(self, verbous = False, force = False):
+        '''Apply the settings by setting the respective device properties in micro manager. 
+        With skip_applied, properties that are already applied (see device_state_cache) are skipped.
+        Waits until all the devices that changed are not busy anymore.
+        Args: 
+            verbous: print out all changes applied
+            force: set all properties, even with skip_applied
+        '''
+        try:
+            self.set_settings(verbous = verbous, force = force)
+        except Exception:
+            self.invalidate()
+            raise
 
 
-    def apply(self, verbous = False, max_retries = 10, i = 0):
+    def apply(self, verbous = False, max_retries = 10, i = 0, force = False):
         '''See apply_no_retry, but retries max_retries-times if an error is caught (e.g. Wheel-C cannot turn)
         '''
         if i > max_retries:
@@ -44,15 +146,7 @@ class preset:
             print('Cannot apply setting. Break.')
             raise RuntimeError
         try:
-            for setting in self.settings:
-                #will result in such a command:
-                #core.set_property('Core', 'AutoShutter', 0)
-                if verbous:
-                    print(str(setting[0])+": Set " + str(setting[1]) + " to " + str(setting[2]))
-                self.core.set_property(setting[0], setting[1], setting[2])
-            for setting in self.settings:
-                #wait until none of the devices changed are busy anymore
-                self.core.wait_for_device(setting[0])
+            self.set_settings(verbous = verbous, force = force)
              
             if self.camera_exposure_time != None:
                 self.core.set_exposure(self.camera_exposure_time)
@@ -63,10 +157,11 @@ class preset:
             raise KeyboardInterrupt
         except Exception as e:
             print(e)
-            #Caught an error. Try again.
+            #Caught an error. The device state is unknown now, so set everything again.
+            self.invalidate()
             print(f'Error when applying setting. Retry nb. {i}.')
             time.sleep(1)
-            self.apply(verbous = verbous, max_retries = max_retries, i = i+1)
+            self.apply(verbous = verbous, max_retries = max_retries, i = i+1, force = True)
 
     def test_apply(self):
         '''Debug mode, doesn't upload any settings to micro manager.
@@ -74,10 +169,18 @@ class preset:
         for setting in self.settings:
             print(str(setting[0])+": Set \"" + str(setting[1]) + "\" to " + str(setting[2]))
 
-    def calibrate_dmd(self, dmd, dmd_exposure_time, camera_exposure_time):
+    def calibrate_dmd(self, dmd, dmd_exposure_time = None, camera_exposure_time = None, grid = False, **kwargs):
         '''Apply the preset, then run the calibration routine. Stores the resulting affine in self.affine.
+        Args:
+            grid: use dmd.calibrate_grid instead of dmd.calibrate. If the preset is already calibrated,
+                its affine is used to calibrate from a single frame. The residuals are stored in self.calibration_report.
+            kwargs: passed on to the calibration routine
         '''
         self.apply() 
-        affine = dmd.calibrate()
+        if grid:
+            kwargs.setdefault('initial_affine', self.affine)
+            affine, self.calibration_report = dmd.calibrate_grid(**kwargs)
+        else:
+            affine = dmd.calibrate(**kwargs)
         self.affine = affine
 
@@ -0,0 +1,279 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from .acquisition import acq
+from .command_queue import command_queue
+from .stage import move_to, pfs_off
+from .trace import span, trace_position
+
+
+class print_job:
+    '''Prints a list of tiles, overlapping host side work with the hardware.
+    While tile N is exposed, the mask of tile N+1 is converted to a dmd buffer on a worker thread,
+    and the captured image of tile N-1 is handed to on_image on another worker thread.
+    All calls to the core go through one command_queue, in the order of the tiles.
+    '''
+    def __init__(self, dmd, preset, tiles, positions, on_image=None, lookahead=2, workers=2, apply_preset='once',
+                 keys=None, empty=None, cache_size=16, verifier=None, max_reexpose=1,
+                 focus=None):
+        '''Args:
+            dmd: dmd object used for the exposures
+            preset: preset that is applied for the exposures
+            tiles: list of masks in dmd space, one per position
+            positions: position_table or list of stage_position, in the order they are printed
+            on_image: function(index, img) called on a worker thread for every captured image.
+                Its return value is collected instead of the image.
+            lookahead: number of tiles that are prepared ahead of the hardware
+            workers: number of threads for mask preparation and image handling
+            apply_preset: 'once' applies the preset before the first tile, 'tile' before every tile
+            keys: optional id per tile, equal for identical tiles (e.g. from utils.tile_store.TileStore.select).
+                The dmd buffer of a key is converted once and reused for repeats.
+            empty: optional flag per tile, empty tiles are skipped and get None as result
+            cache_size: max number of converted buffers kept for reuse
+            verifier: optional verification.print_verifier. Every captured image is verified against its
+                tile while the print continues, tiles that fail are exposed again after the last tile.
+                If the verifier has no dark reference yet, one is captured before the first tile.
+            max_reexpose: max number of times the failed tiles are exposed again
+            focus: None keeps the PFS, 'z' or 'pfs_offset' moves the focus to the value of the position together
+                with the stage (see stage.move_to), e.g. for positions from focus_map.apply. With 'z' the PFS
+                is switched off for the job and on again at the end if it was on.
+        '''
+        if len(tiles) != len(positions):
+            raise ValueError(f'Got {len(tiles)} tiles but {len(positions)} positions.')
+        for name, values in (('keys', keys), ('empty', empty)):
+            if values is not None and len(values) != len(tiles):
+                raise ValueError(f'Got {len(tiles)} tiles but {len(values)} {name}.')
+        if apply_preset not in ('once', 'tile'):
+            raise ValueError(f"apply_preset must be 'once' or 'tile', not {apply_preset!r}.")
+        if focus not in (None, 'z', 'pfs_offset'):
+            raise ValueError(f"focus must be None, 'z' or 'pfs_offset', not {focus!r}.")
+        self.dmd = dmd
+        self.core = dmd.core
+        self.preset = preset
+        self.tiles = tiles
+        self.positions = positions
+        self.on_image = on_image
+        self.lookahead = max(1, lookahead)
+        self.workers = workers
+        self.apply_preset = apply_preset
+        self.keys = keys
+        self.empty = empty
+        self.cache_size = cache_size
+        self.verifier = verifier
+        self.max_reexpose = max_reexpose
+        self.focus = focus
+        self.reexposed = []  # indices of the tiles exposed again in every re-expose pass of the last run
+        self.converted = {}  # key -> converted buffer
+        self.converted_lock = threading.Lock()
+        self.timings = []
+        self.total_time = None
+        self.trace_since = None  # trace_position of the core at the start of the last run, if it is traced
+        self.preset_applied = False
+        self.failed = threading.Event()
+
+    def _prepare(self, index, buffer, free_buffers):
+        '''Converts the tile into buffer. Returns (buffer to upload, whether it is a pool buffer, time).'''
+        start = time.perf_counter()
+        key = None if self.keys is None else self.keys[index]
+        if key is not None and key in self.converted:
+            free_buffers.put(buffer)  # repeat of a converted tile, the pool buffer is not needed
+            return self.converted[key], False, time.perf_counter() - start
+        try:
+            self.dmd.prepare_mask(self.tiles[index], out=buffer)
+        except BaseException:
+            free_buffers.put(buffer)
+            raise
+        if key is not None:
+            with self.converted_lock:
+                if len(self.converted) < self.cache_size:
+                    self.converted[key] = buffer.copy()
+        return buffer, True, time.perf_counter() - start
+
+    def _expose(self, index, prepared, free_buffers):
+        '''Runs on the command queue: move, expose, capture. Recorded as a span if the core is traced.'''
+        with span(self.core, 'tile', index=index):
+            return self._expose_tile(index, prepared, free_buffers)
+
+    def _expose_tile(self, index, prepared, free_buffers):
+        if self.failed.is_set():
+            _release(prepared, free_buffers)
+            raise RuntimeError(f'Tile {index} skipped, an earlier tile failed.')
+        try:
+            buffer, pooled, prepare_time = prepared.result()
+        except BaseException:
+            self.failed.set()
+            raise
+        released = not pooled
+        try:
+            start = time.perf_counter()
+            move_to(self.core, self.positions[index], self.focus)
+            moved = time.perf_counter()
+            if self.apply_preset == 'tile' or not self.preset_applied:
+                self.preset.apply()
+                self.preset_applied = True
+                if self.preset.camera_exposure_time is not None:
+                    self.core.set_exposure(int(self.preset.camera_exposure_time))
+            if self.verifier is not None and self.verifier.dark is None:
+                # background reference for tiles that are lit everywhere
+                self.dmd.all_off()
+                self.verifier.set_dark(acq(self.core))
+            self.dmd.display_buffer(buffer)
+            if pooled:
+                free_buffers.put(buffer)  # the core keeps its own copy after the upload
+                released = True
+            img = acq(self.core)
+            self.dmd.all_off()
+            end = time.perf_counter()
+        except BaseException:
+            self.failed.set()
+            raise
+        finally:
+            if not released:
+                free_buffers.put(buffer)
+        self.timings[index] = {
+            'prepare': prepare_time,
+            'move': moved - start,
+            'expose': end - moved,
+        }
+        return img
+
+    def _handle(self, index, img):
+        if self.verifier is not None:
+            self.verifier.submit(index, self.tiles[index], img)
+        if self.on_image is None:
+            return img
+        return self.on_image(index, img)
+
+    def run(self, progress=None):
+        '''Print all tiles. Returns the captured images (or the results of on_image), in tile order.
+        Args:
+            progress: optional function(index) called whenever the exposure of a tile is done, e.g. pbar.update
+        '''
+        n = len(self.tiles)
+        self.timings = [None] * n
+        self.trace_since = trace_position(self.core)
+        self.converted = {}
+        self.preset_applied = False
+        self.failed = threading.Event()
+        self.reexposed = []
+        if self.verifier is not None:
+            self.verifier.reset()  # failures of an earlier job must not be re-exposed in this one
+        start = time.perf_counter()
+        pfs_was_on = self.focus == 'z' and pfs_off(self.core)
+        try:
+            results = self._run_pass(range(n), progress)
+            if self.verifier is not None:
+                self.verifier.flush()
+                for _ in range(self.max_reexpose):
+                    indices = self.verifier.failed
+                    if not indices:
+                        break
+                    self.reexposed.append(indices)
+                    for index, result in zip(indices, self._run_pass(indices, None)):
+                        results[index] = result
+                    self.verifier.flush()
+            return results
+        finally:
+            if pfs_was_on:
+                self.core.enable_continuous_focus(True)
+            self.total_time = time.perf_counter() - start
+
+    def _run_pass(self, indices, progress):
+        '''Exposes the tiles in indices, returns their results in the same order.'''
+        free_buffers = queue.Queue()
+        for _ in range(self.lookahead + 1):
+            free_buffers.put(np.zeros(self.dmd.height * self.dmd.width, dtype=np.uint8))
+
+        commands = command_queue()
+        prepare_pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prepare')
+        handle_pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='handle')
+        exposures = []
+        results = []
+        try:
+            for index in indices:
+                if self.empty is not None and self.empty[index]:
+                    results.append(_done(None))
+                    if progress is not None:
+                        progress(index)
+                    continue
+                # blocks while lookahead tiles are waiting for the hardware
+                buffer = self._free_buffer(free_buffers)
+                if buffer is None:
+                    break
+                prepared = prepare_pool.submit(self._prepare, index, buffer, free_buffers)
+                exposure = commands.submit(self._expose, index, prepared, free_buffers)
+                exposures.append(exposure)
+                results.append(self._chain(exposure, handle_pool, index, progress))
+            return [r.result() for r in results]
+        finally:
+            for e in exposures:
+                e.cancel()
+            commands.close()
+            prepare_pool.shutdown()
+            handle_pool.shutdown()
+
+    def _free_buffer(self, free_buffers, poll_interval=0.1):
+        '''Next free upload buffer, or None as soon as a tile failed.'''
+        while not self.failed.is_set():
+            try:
+                return free_buffers.get(timeout=poll_interval)
+            except queue.Empty:
+                pass
+        return None
+
+    def _chain(self, exposure, pool, index, progress):
+        '''Returns a future for the handled image of the exposure.'''
+        result = Future()
+
+        def done(exposure):
+            if exposure.cancelled():
+                result.cancel()
+                return
+            if exposure.exception() is not None:
+                result.set_exception(exposure.exception())
+                return
+            if progress is not None:
+                progress(index)
+            handled = pool.submit(self._handle, index, exposure.result())
+            handled.add_done_callback(lambda h: _copy_result(h, result))
+
+        exposure.add_done_callback(done)
+        return result
+
+    def stats(self):
+        '''Summary of the last run: tiles per minute and mean time per step in seconds.'''
+        timings = [t for t in self.timings if t is not None]
+        summary = {'tiles': len(timings), 'skipped': 0 if self.empty is None else int(sum(map(bool, self.empty))),
+                   'reexposed': sum(map(len, self.reexposed))}
+        if timings and self.total_time:
+            for key in timings[0]:
+                summary[key] = float(np.mean([t[key] for t in timings]))
+            summary['tiles_per_minute'] = 60 * len(timings) / self.total_time
+        return summary
+
+
+def _copy_result(source, target):
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _release(prepared, free_buffers):
+    '''Returns the pool buffer of a tile that is skipped instead of exposed.'''
+    try:
+        buffer, pooled, _ = prepared.result()
+    except BaseException:
+        return  # _prepare put the buffer back already
+    if pooled:
+        free_buffers.put(buffer)
@@ -0,0 +1,316 @@
+import time
+import threading
+from collections import defaultdict
+import cv2
+import numpy as np
+
+
+class _tagged_image:
+    def __init__(self, pix, height, width):
+        self.pix = pix
+        self.tags = {'Height': height, 'Width': width}
+
+
+class _point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def get_x(self):
+        return self.x
+
+    def get_y(self):
+        return self.y
+
+
+class simulated_core:
+    '''Stand-in for the pycromanager MMCore object, for running and benchmarking the manager
+    helpers without a microscope. Implements the subset of the core API that is used in this repo.
+    Every call sleeps for the latency configured for its kind of operation. Stage, focus and state
+    (filter wheel, turret) moves run in the background like on the real hardware: the call returns
+    immediately and the device is busy until wait_for_device.
+    The camera images the displayed dmd pattern through a known affine, so calibrations can be checked.
+    '''
+    #default latencies in seconds, per kind of call
+    default_latencies = {
+        'property': 0.002,
+        'stage': 0.05,
+        'focus': 0.01,
+        'snap': 0.01,
+        'slm_upload': 0.005,
+        'slm_display': 0.001,
+        'query': 0.001,
+        'state': 0.1,
+    }
+
+    def __init__(self, camera_shape=(1024, 1024), slm_shape=(600, 800), latencies=None, slm_sequence_max_length=0,
+                 affine=None, brightness=1000, background=100, noise=5, blur=2., focus_z=None, defocus=1., seed=None):
+        '''Args:
+            camera_shape: (height, width) of the simulated camera image
+            slm_shape: (height, width) of the simulated dmd
+            latencies: dict overriding entries of default_latencies
+            slm_sequence_max_length: longest hardware sequence the simulated dmd accepts, 0 for none
+            affine: dmd -> camera 2x3 affine of the synthetic camera. Defaults to the dmd scaled into the camera center.
+            brightness: camera counts of a dmd pixel that is on
+            background: camera counts of the dark background
+            noise: standard deviation of the camera noise
+            blur: sigma of the optical blur in camera pixels, 0 for none
+            focus_z: z at which the image is sharp, None for an image that doesn't depend on z
+            defocus: additional blur sigma in camera pixels per um away from focus_z
+            seed: seed of the camera noise
+        '''
+        self.latencies = dict(self.default_latencies)
+        if latencies is not None:
+            self.latencies.update(latencies)
+        self.camera_height, self.camera_width = camera_shape
+        self.slm_height, self.slm_width = slm_shape
+        self.slm_name = 'Mosaic3'
+        self.xy_stage_name = 'XYStage'
+        self.focus_name = 'ZDrive'
+        self.camera_name = 'Camera'
+        self.properties = {}
+        self.slm_exposure = 1
+        self.slm_image = np.zeros((self.slm_height, self.slm_width), dtype=np.uint8)
+        self.slm_displayed = self.slm_image.copy()
+        self.slm_sequence_max_length = slm_sequence_max_length
+        self.slm_sequence = []
+        self.exposure = 10
+        self.x = 0.
+        self.y = 0.
+        self.z = 0.
+        self.auto_focus_offset = 0.
+        self.continuous_focus = False
+        self.sequence_running = False
+        self.sequence_start = 0.  # time of the start of the sequence acquisition or the last clear_circular_buffer
+        self.call_count = 0
+        self.time_per_kind = defaultdict(float)  # simulated latency spent per kind of call
+        self.calls_per_kind = defaultdict(int)
+        if affine is None:
+            scale = 0.8 * min(camera_shape[0] / slm_shape[0], camera_shape[1] / slm_shape[1])
+            affine = [[scale, 0, (camera_shape[1] - scale * slm_shape[1]) / 2],
+                      [0, scale, (camera_shape[0] - scale * slm_shape[0]) / 2]]
+        self.affine = np.array(affine, dtype=np.float64)
+        self.brightness = brightness
+        self.background = background
+        self.noise = noise
+        self.blur = blur
+        self.focus_z = focus_z
+        self.defocus = defocus
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()  # the real bridge is not thread safe either
+        self.busy_until = defaultdict(float)  # device -> time.perf_counter() at which its move is done
+        self.image = np.zeros((self.camera_height, self.camera_width), dtype=np.uint16)
+
+    def _wait(self, kind):
+        latency = self.latencies[kind]
+        with self.lock:
+            self.call_count += 1
+            self.calls_per_kind[kind] += 1
+            self.time_per_kind[kind] += latency
+        if latency > 0:
+            time.sleep(latency)
+
+    def _start_move(self, kind, device):
+        '''Accounts the latency of kind like _wait, but the device moves in the background.'''
+        latency = self.latencies[kind]
+        with self.lock:
+            self.call_count += 1
+            self.calls_per_kind[kind] += 1
+            self.time_per_kind[kind] += latency
+            self.busy_until[device] = max(self.busy_until[device], time.perf_counter()) + latency
+
+    # camera
+    def snap_image(self):
+        self._wait('snap')
+        self.image = self.render_image()
+
+    def render_image(self):
+        '''Image of the currently displayed dmd pattern as seen by the camera.'''
+        pattern = (self.slm_displayed != 0).astype(np.float32) * self.brightness
+        img = cv2.warpAffine(pattern, self.affine, (self.camera_width, self.camera_height))
+        blur = self.blur
+        if self.focus_z is not None:
+            blur = np.hypot(blur, self.defocus * min(abs(self.z - self.focus_z), 50.))
+        if blur > 0:
+            img = cv2.GaussianBlur(img, (0, 0), blur)
+        img += self.background
+        if self.noise > 0:
+            img += self.rng.normal(0, self.noise, img.shape).astype(np.float32)
+        return np.clip(img, 0, 65535).astype(np.uint16)
+
+    def true_calibration(self):
+        '''The camera -> dmd affine a perfect calibration would find.'''
+        return cv2.invertAffineTransform(self.affine)
+
+    def reset_stats(self):
+        with self.lock:
+            self.call_count = 0
+            self.time_per_kind.clear()
+            self.calls_per_kind.clear()
+
+    def get_tagged_image(self):
+        self._wait('query')
+        return _tagged_image(self.image.ravel(), self.camera_height, self.camera_width)
+
+    def get_image(self):
+        self._wait('query')
+        return self.image.ravel()
+
+    def get_image_width(self):
+        return self.camera_width
+
+    def get_image_height(self):
+        return self.camera_height
+
+    def set_exposure(self, exposure):
+        self._wait('property')
+        self.exposure = exposure
+
+    def get_exposure(self):
+        return self.exposure
+
+    def get_camera_device(self):
+        return self.camera_name
+
+    def start_continuous_sequence_acquisition(self, interval):
+        self._wait('query')
+        self.sequence_running = True
+        self.sequence_start = time.perf_counter()
+
+    def stop_sequence_acquisition(self):
+        self._wait('query')
+        self.sequence_running = False
+
+    def is_sequence_running(self):
+        return self.sequence_running
+
+    def get_remaining_image_count(self):
+        '''Frames exposed since the start of the sequence or the last clear_circular_buffer.'''
+        if not self.sequence_running:
+            return 0
+        return int((time.perf_counter() - self.sequence_start) / max(self.exposure / 1000, 1e-3))
+
+    def clear_circular_buffer(self):
+        self._wait('query')
+        self.sequence_start = time.perf_counter()
+
+    def get_last_image(self):
+        self._wait('snap')
+        self.image = self.render_image()
+        return self.image.ravel()
+
+    # properties
+    def set_property(self, device, prop, value):
+        self._wait('property')
+        if prop == 'State' and self.properties.get((device, prop)) != value:
+            self._start_move('state', device)
+        self.properties[(device, prop)] = value
+
+    def get_property(self, device, prop):
+        self._wait('query')
+        return self.properties.get((device, prop))
+
+    def wait_for_device(self, device):
+        self._wait('query')
+        remaining = self.busy_until[device] - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def device_busy(self, device):
+        self._wait('query')
+        return time.perf_counter() < self.busy_until[device]
+
+    # stage
+    def get_xy_stage_device(self):
+        return self.xy_stage_name
+
+    def get_focus_device(self):
+        return self.focus_name
+
+    def set_xy_position(self, *args):
+        self._start_move('stage', self.xy_stage_name)
+        self.x, self.y = args[-2], args[-1]
+
+    def get_xy_stage_position(self, *args):
+        self._wait('query')
+        return _point(self.x, self.y)
+
+    def get_x_position(self, *args):
+        return self.x
+
+    def get_y_position(self, *args):
+        return self.y
+
+    def set_position(self, *args):
+        self._start_move('focus', self.focus_name)
+        if not self.continuous_focus:  # a locked PFS holds the focus
+            self.z = args[-1]
+
+    def get_position(self, *args):
+        return self.z
+
+    def is_continuous_focus_enabled(self):
+        self._wait('query')
+        return self.continuous_focus
+
+    def enable_continuous_focus(self, enable):
+        self._wait('property')
+        self.continuous_focus = bool(enable)
+
+    def get_auto_focus_offset(self):
+        self._wait('query')
+        return self.auto_focus_offset
+
+    def set_auto_focus_offset(self, offset):
+        self._start_move('focus', self.focus_name)
+        self.auto_focus_offset = offset
+
+    # slm
+    def get_slm_device(self):
+        return self.slm_name
+
+    def get_slm_height(self, name):
+        return self.slm_height
+
+    def get_slm_width(self, name):
+        return self.slm_width
+
+    def get_slm_bytes_per_pixel(self, name):
+        return 1
+
+    def get_slm_exposure(self, name):
+        return self.slm_exposure
+
+    def set_slm_exposure(self, name, exposure):
+        self._wait('property')
+        self.slm_exposure = exposure
+
+    def set_slm_image(self, name, image):
+        self._wait('slm_upload')
+        np.copyto(self.slm_image, np.asarray(image, dtype=np.uint8).reshape(self.slm_height, self.slm_width))
+
+    def set_slm_pixels_to(self, name, value):
+        self._wait('slm_upload')
+        self.slm_image[:] = value
+
+    def display_slm_image(self, name):
+        self._wait('slm_display')
+        self.slm_displayed = self.slm_image.copy()
+
+    def get_slm_sequence_max_length(self, name):
+        return self.slm_sequence_max_length
+
+    def load_slm_sequence(self, name, images):
+        if len(images) > self.slm_sequence_max_length:
+            raise RuntimeError('Sequence too long for the simulated slm.')
+        self._wait('slm_upload')
+        self.slm_sequence = [np.asarray(image, dtype=np.uint8).reshape(self.slm_height, self.slm_width)
+                             for image in images]
+
+    def start_slm_sequence(self, name):
+        self._wait('slm_display')
+        if self.slm_sequence:
+            self.slm_displayed = self.slm_sequence[-1].copy()
+
+    def stop_slm_sequence(self, name):
+        self._wait('query')
@@ -1,39 +1,268 @@
+import os
+import json
+import tempfile
+import numpy as np
+
+
 class stage_position:
     def __init__(self,x,y,z):
         self.x = x
         self.y = y
         self.z = z
-        
-
-def load_pos_file(filepath,studio,bridge):
-    java_file = bridge.construct_java_object('java.io.File', args=[filepath])
-    position_list_manager = studio.get_position_list_manager()
-    postition_list = position_list_manager.get_position_list()
-    postition_list.load(java_file)
-    nb_positions = postition_list.get_number_of_positions()
-    position_list = []
-    for i in range(nb_positions):
-        position = postition_list.get_position(i)
-        x = position.get_x()
-        y = position.get_y()
-        z = position.get_z()
-        pos = stage_position(x,y,z)
-        position_list.append(pos)
-    return position_list
 
 
-def get_pos_from_mm(studio):
-    position_list_manager = studio.get_position_list_manager()
-    postition_list = position_list_manager.get_position_list()
-    nb_positions = postition_list.get_number_of_positions()
-    position_list = []
-    for i in range(nb_positions):
-        position = postition_list.get_position(i)
-        x = position.get_x()
-        y = position.get_y()
-        z = position.get_z()
-        pos = stage_position(x,y,z)
-        position_list.append(pos)
-    return position_list
+def _focus_target(pos, focus):
+    '''The value of field focus of pos, None if there is none.'''
+    if focus is None:
+        return None
+    if focus not in ('z', 'pfs_offset'):
+        raise ValueError(f"focus must be None, 'z' or 'pfs_offset', not {focus!r}.")
+    value = getattr(pos, focus, None)
+    if value is None or np.isnan(value):
+        return None
+    return float(value)
+
+
+def pfs_off(core):
+    '''Switches the PFS (continuous focus) off if it is on. Returns whether it was on, e.g. to switch it
+    on again with core.enable_continuous_focus(True).'''
+    enabled = bool(core.is_continuous_focus_enabled())
+    if enabled:
+        core.enable_continuous_focus(False)
+    return enabled
+
+
+def move_to(core, pos, focus=None):
+    '''Move the X/Y stage to pos and wait until the stage and focus device are not busy anymore.
+    Args:
+        focus: None leaves the focus to the PFS, 'z' moves the focus drive to pos.z and 'pfs_offset' sets
+            the PFS offset to pos.pfs_offset, in the same move as the stage (e.g. positions from focus_map.apply).
+            With 'z' the PFS is switched off first (see pfs_off) and stays off: locked, it would hold the
+            focus against the drive, and switched on again it would return to its offset.
+    '''
+    xy_stage = core.get_xy_stage_device()
+    focus_device = core.get_focus_device()
+    target = _focus_target(pos, focus)
+    if target is not None and focus == 'z':
+        pfs_off(core)
+    core.set_xy_position(xy_stage, pos.x, pos.y)
+    if target is not None and focus == 'z':
+        core.set_position(focus_device, target)
+    elif target is not None:
+        core.set_auto_focus_offset(target)
+    core.wait_for_device(xy_stage)
+    core.wait_for_device(focus_device)
+
+
+#one row per position, nan where a value is unknown
+position_dtype = np.dtype([('x', 'f8'), ('y', 'f8'), ('z', 'f8'), ('pfs_offset', 'f8'), ('label', 'U32')])
+
+
+class position_table:
+    '''List of stage positions, stored in one structured numpy array.
+    Rows have the fields x, y, z, pfs_offset and label, and can be used wherever a stage_position is
+    expected (row.x, row.y, row.z), e.g. move_to(core, table[i]) or FOV(core, table[i], ...).
+    Transforms work on all positions at once and return a new table.
+    '''
+    def __init__(self, data=None):
+        '''Args:
+            data: structured array with position_dtype, or None for an empty table
+        '''
+        if data is None:
+            data = np.zeros(0, dtype=position_dtype)
+        self.buffer = np.asarray(data, dtype=position_dtype).view(np.recarray)
+        self.n = len(self.buffer)
+
+    @classmethod
+    def from_arrays(cls, x, y, z=None, pfs_offset=None, labels=None):
+        x = np.asarray(x, dtype=np.float64)
+        data = np.zeros(len(x), dtype=position_dtype)
+        data['x'] = x
+        data['y'] = y
+        data['z'] = np.nan if z is None else z
+        data['pfs_offset'] = np.nan if pfs_offset is None else pfs_offset
+        data['label'] = [f'Pos{i}' for i in range(len(x))] if labels is None else labels
+        return cls(data)
+
+    @classmethod
+    def from_positions(cls, positions):
+        '''Table from a list of stage_position.'''
+        z = [np.nan if p.z is None else p.z for p in positions]
+        return cls.from_arrays([p.x for p in positions], [p.y for p in positions], z)
+
+    @property
+    def data(self):
+        '''The positions as a record array (a view, not a copy).'''
+        return self.buffer[:self.n]
+
+    @property
+    def x(self):
+        return self.data.x
+
+    @property
+    def y(self):
+        return self.data.y
+
+    @property
+    def z(self):
+        return self.data.z
+
+    @property
+    def pfs_offset(self):
+        return self.data.pfs_offset
+
+    @property
+    def labels(self):
+        return self.data.label
 
+    @property
+    def xy(self):
+        '''(n, 2) array of the x/y coordinates.'''
+        return np.column_stack([self.data.x, self.data.y])
 
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if not -self.n <= index < self.n:
+                raise IndexError(f'Position {index} out of range for {self.n} positions.')
+            return self.data[index]
+        return position_table(self.data[index])
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __repr__(self):
+        return f'position_table({self.n} positions)'
+
+    def append(self, x, y, z=np.nan, pfs_offset=np.nan, label=None):
+        '''Adds a position at the end. The buffer grows by doubling, so appending is cheap.'''
+        if self.n == len(self.buffer):
+            grown = np.zeros(max(16, 2 * len(self.buffer)), dtype=position_dtype).view(np.recarray)
+            grown[:self.n] = self.buffer[:self.n]
+            self.buffer = grown
+        self.buffer[self.n] = (x, y, np.nan if z is None else z, np.nan if pfs_offset is None else pfs_offset,
+                               f'Pos{self.n}' if label is None else label)
+        self.n += 1
+
+    def _with_xy(self, xy):
+        data = self.data.copy()
+        data.x = xy[:, 0]
+        data.y = xy[:, 1]
+        return position_table(data)
+
+    def offset(self, dx=0., dy=0., dz=0.):
+        '''Table shifted by (dx, dy, dz) um.'''
+        data = self.data.copy()
+        data.x += dx
+        data.y += dy
+        data.z += dz
+        return position_table(data)
+
+    def transform(self, matrix):
+        '''Table with a 2x2 linear or 2x3 affine transformation applied to the x/y coordinates.'''
+        matrix = np.asarray(matrix, dtype=np.float64)
+        xy = self.xy @ matrix[:, :2].T
+        if matrix.shape == (2, 3):
+            xy += matrix[:, 2]
+        return self._with_xy(xy)
+
+    def _about(self, linear, center):
+        center = self.xy.mean(axis=0) if center is None else np.asarray(center, dtype=np.float64)
+        return self.transform(np.hstack([linear, (center - linear @ center)[:, None]]))
+
+    def scale(self, factor, center=None):
+        '''Table scaled by factor around center (default: the mean position),
+        e.g. factor = calibration_objective / current_objective.'''
+        return self._about(np.eye(2) * factor, center)
+
+    def rotate(self, angle, center=None):
+        '''Table rotated by angle degrees (counterclockwise) around center (default: the mean position).'''
+        a = np.deg2rad(angle)
+        return self._about(np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]]), center)
+
+    def to_stage_positions(self):
+        '''List of stage_position, z is None where it is unknown.'''
+        return [stage_position(float(p.x), float(p.y), None if np.isnan(p.z) else float(p.z)) for p in self.data]
+
+
+def parse_pos(text):
+    '''Parses the content of a micro-manager .pos file (version 1.4 or 2.0) into a position_table, without Java.'''
+    content = json.loads(text)
+    if 'map' in content:
+        entries = content['map']['StagePositions']['array']
+        xs, ys, zs, offsets, labels = [], [], [], [], []
+        for entry in entries:
+            default_z = entry.get('DefaultZStage', {}).get('scalar')
+            x = y = z = offset = np.nan
+            for device in entry.get('DevicePositions', {}).get('array', []):
+                name = device['Device']['scalar']
+                values = device['Position_um']['array']
+                if len(values) == 2:
+                    x, y = values
+                elif name == default_z:
+                    z = values[0]
+                elif 'pfs' in name.lower() or 'offset' in name.lower():
+                    offset = values[0]
+            xs.append(x)
+            ys.append(y)
+            zs.append(z)
+            offsets.append(offset)
+            labels.append(entry.get('Label', {}).get('scalar', f'Pos{len(labels)}'))
+        return position_table.from_arrays(xs, ys, zs, offsets, labels)
+    if 'POSITIONS' in content:
+        xs, ys, zs, offsets, labels = [], [], [], [], []
+        for entry in content['POSITIONS']:
+            default_z = entry.get('DEFAULT_Z_STAGE')
+            x = y = z = offset = np.nan
+            for device in entry.get('DEVICES', []):
+                if device.get('AXES') == 2:
+                    x, y = device['X'], device['Y']
+                elif device['DEVICE'] == default_z:
+                    z = device['X']
+                elif 'pfs' in device['DEVICE'].lower() or 'offset' in device['DEVICE'].lower():
+                    offset = device['X']
+            xs.append(x)
+            ys.append(y)
+            zs.append(z)
+            offsets.append(offset)
+            labels.append(entry.get('LABEL', f'Pos{len(labels)}'))
+        return position_table.from_arrays(xs, ys, zs, offsets, labels)
+    raise ValueError('Not a micro-manager position list.')
+
+
+def load_pos_file(filepath,studio=None,bridge=None):
+    '''Reads a micro-manager .pos file into a position_table. The file is parsed directly, not over the bridge.
+    Args:
+        studio, bridge: if given, the file is also loaded into the position list of micro-manager
+    '''
+    with open(filepath) as f:
+        table = parse_pos(f.read())
+    if studio is not None and bridge is not None:
+        java_file = bridge.construct_java_object('java.io.File', args=[filepath])
+        studio.get_position_list_manager().get_position_list().load(java_file)
+    return table
+
+
+def get_pos_from_mm(studio):
+    '''Returns the position list of micro-manager as a position_table.
+    The list is saved to a temporary file by micro-manager and parsed, a few bridge calls in total
+    instead of four per position. Falls back to reading position by position if saving fails.
+    '''
+    postition_list = studio.get_position_list_manager().get_position_list()
+    handle, path = tempfile.mkstemp(suffix='.pos')
+    os.close(handle)
+    try:
+        postition_list.save(path)
+        with open(path) as f:
+            return parse_pos(f.read())
+    except Exception:
+        nb_positions = postition_list.get_number_of_positions()
+        table = position_table()
+        for i in range(nb_positions):
+            position = postition_list.get_position(i)
+            table.append(position.get_x(), position.get_y(), position.get_z())
+        return table
+    finally:
+        os.remove(path)
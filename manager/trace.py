@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+
+class traced_core:
+    '''Wraps a micro-manager core and records every call to it: method, device, arguments and duration.
+    Use it in place of the core, everything built on top of it is traced:
+        core = traced_core(bridge.get_core())
+        DMD = dmd(core)
+    Records go into a fixed size ring buffer, the oldest records are overwritten.
+    Arrays in the arguments (e.g. slm images) are recorded by type and shape only.
+    Tracing costs about 4 us per call (bench_trace_overhead in manager.benchmark), small next to
+    the millisecond round trips to the hardware. Set enabled=False to skip it in tight loops.
+    '''
+    def __init__(self, core, capacity=100000, enabled=True):
+        '''Args:
+            core: micro-manager core (or simulated_core) to wrap
+            capacity: number of records kept
+            enabled: record calls, can be switched at any time
+        '''
+        self.wrapped = core
+        self.capacity = capacity
+        self.enabled = enabled
+        self.trace_lock = threading.Lock()
+        self.clear_trace()
+
+    def unwrap(self):
+        '''The core this wraps, see preset.unwrap_core.'''
+        return self.wrapped
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set yet: wrap the method once and keep the wrapper
+        if name == 'wrapped':
+            raise AttributeError(name)
+        attr = getattr(self.wrapped, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        traced = self._wrap(name, attr)
+        self.__dict__[name] = traced
+        return traced
+
+    def _wrap(self, name, fn):
+        def traced(*args, **kwargs):
+            if not self.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter_ns()
+            error = True
+            try:
+                result = fn(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                end = time.perf_counter_ns()
+                device = args[0] if args and isinstance(args[0], str) else None
+                self._record('core', name, device, args, start, end, error)
+        traced.__name__ = name
+        traced.__doc__ = fn.__doc__
+        return traced
+
+    def _record(self, category, name, device, args, start, end, error):
+        with self.trace_lock:
+            seq = self.written
+            self.written += 1
+        self.records_buffer[seq % self.capacity] = (
+            seq, category, name, device, _summarize(args), start, end - start, threading.get_ident(), error)
+
+    @contextmanager
+    def span(self, name, **args):
+        '''Records a named span around a block of calls, e.g. one tile of a print job.'''
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self._record('span', name, None, tuple(args.items()), start, time.perf_counter_ns(), error)
+
+    def trace_position(self):
+        '''Sequence number of the next record, to select the records of a job with since=.'''
+        return self.written
+
+    def clear_trace(self):
+        self.records_buffer = [None] * self.capacity
+        self.written = 0
+
+    def records(self, since=0, category=None):
+        '''Recorded calls in the order they started, as dicts with durations in ms.
+        Args:
+            since: only records from this trace_position on
+            category: 'core' for core calls, 'span' for spans, None for both
+        '''
+        rows = [r for r in self.records_buffer if r is not None and r[0] >= since
+                and (category is None or r[1] == category)]
+        rows.sort(key=lambda r: r[5])
+        return [{'category': r[1], 'method': r[2], 'device': r[3], 'args': r[4], 'start': r[5] / 1e6,
+                 'duration': r[6] / 1e6, 'thread': r[7], 'error': r[8]} for r in rows]
+
+    @property
+    def dropped(self):
+        '''Number of records that were overwritten.'''
+        return max(0, self.written - self.capacity)
+
+    def _durations(self, since):
+        groups = {}
+        for r in self.records_buffer:
+            if r is None or r[0] < since:
+                continue
+            key = r[2] if r[3] is None else f'{r[2]} {r[3]}'
+            groups.setdefault(key, []).append((r[6], r[8]))
+        return {key: (np.array([d for d, _ in v]) / 1e6, sum(e for _, e in v)) for key, v in groups.items()}
+
+    def summary(self, since=0):
+        '''Time per method and device in ms, sorted by total time. Spans are included under their name.'''
+        summary = {}
+        for key, (durations, errors) in self._durations(since).items():
+            summary[key] = {
+                'calls': len(durations),
+                'total': float(durations.sum()),
+                'mean': float(durations.mean()),
+                'p50': float(np.percentile(durations, 50)),
+                'p95': float(np.percentile(durations, 95)),
+                'max': float(durations.max()),
+                'errors': errors,
+            }
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['total']))
+
+    def histograms(self, since=0, bins=None):
+        '''Histogram of the durations per method and device. Returns {key: (counts, bin edges in ms)}.
+        Args:
+            bins: bin edges in ms, log spaced from 1 us to 10 s by default
+        '''
+        if bins is None:
+            bins = np.logspace(-3, 4, 29)
+        return {key: np.histogram(durations, bins=bins) for key, (durations, _) in self._durations(since).items()}
+
+    def chrome_trace(self, since=0):
+        '''Records in the chrome trace event format, open it in https://ui.perfetto.dev or chrome://tracing.'''
+        pid = os.getpid()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        events = []
+        for r in self.records(since):
+            args = dict(r['args']) if r['category'] == 'span' else {'args': list(r['args'])}
+            if r['device'] is not None:
+                args['device'] = r['device']
+            if r['error']:
+                args['error'] = True
+            events.append({'name': r['method'], 'cat': r['category'], 'ph': 'X', 'ts': r['start'] * 1000,
+                           'dur': r['duration'] * 1000, 'pid': pid, 'tid': r['thread'], 'args': args})
+        for tid in {e['tid'] for e in events}:
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': names.get(tid, str(tid))}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path, since=0):
+        '''Writes chrome_trace to a json file.'''
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(since), f, default=str)
+
+
+def _summarize(args):
+    return tuple(a if isinstance(a, (str, int, float, bool, type(None))) else _describe(a) for a in args)
+
+
+def _describe(value):
+    if isinstance(value, tuple) and len(value) == 2 and isinstance(value[0], str):
+        return (value[0], _summarize(value[1:])[0])  # keyword argument of a span
+    shape = getattr(value, 'shape', None)
+    if shape is not None:
+        return f'{type(value).__name__}{tuple(shape)}'
+    return type(value).__name__
+
+
+def span(core, name, **args):
+    '''core.span if the core is traced, otherwise a no-op context.'''
+    if isinstance(core, traced_core):
+        return core.span(name, **args)
+    return nullcontext()
+
+
+def trace_position(core):
+    '''core.trace_position() if the core is traced, otherwise None.'''
+    if isinstance(core, traced_core):
+        return core.trace_position()
+    return None
@@ -0,0 +1,231 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from .dmd import invert_transform
+from .warp import warp_map
+
+
+class print_verifier:
+    '''Checks every printed tile against the mask it should have printed, while the print continues.
+    The expected dmd mask is warped into camera space with the inverse calibration and compared with the
+    image captured during the exposure: normalized correlation, misregistration offset (phase correlation)
+    and the fractions of missing and extra area. Tiles are verified in batches on a thread pool, at a
+    reduced resolution, so the verification keeps up with the print. Failing tiles are flagged, print_job
+    re-exposes them (see print_job(verifier=...)).
+    '''
+    def __init__(self, affine, dmd_shape, camera_shape, scale=0.25, workers=2, batch_size=4, min_ncc=0.7,
+                 max_offset=5., max_missing=0.05, max_extra=0.05, tolerance=1, min_signal=100, dark=None):
+        '''Args:
+            affine: camera -> dmd calibration (2x3 affine or 3x3 homography)
+            dmd_shape: (height, width) of the dmd
+            camera_shape: (height, width) of the camera images
+            scale: resolution of the comparison relative to the camera
+            workers: number of threads that verify batches
+            batch_size: number of tiles verified together
+            min_ncc: tiles with a lower normalized correlation fail
+            max_offset: tiles misregistered by more camera pixels fail
+            max_missing: tiles with a larger fraction of the expected area not lit fail
+            max_extra: tiles with more lit area outside of the expected area (as a fraction of it) fail
+            tolerance: pixels at the comparison resolution by which edges may be off without counting as
+                missing or extra
+            min_signal: camera counts an exposed area is at least brighter than the background, so the
+                noise of a dark image is not stretched into a pattern
+            dark: optional camera image with the dmd off (print_job takes one before its first tile).
+                The background level of a tile is measured where its mask is dark; for tiles that are lit
+                everywhere it comes from this image, or else from the last tile with a dark area. Without
+                either, such a tile can't be checked: its metrics are nan and it is not flagged.
+        '''
+        self.scale = scale
+        self.dmd_shape = tuple(dmd_shape)
+        self.camera_shape = tuple(camera_shape)
+        self.shape = (max(1, round(camera_shape[0] * scale)), max(1, round(camera_shape[1] * scale)))
+        #dmd -> camera at the comparison resolution, as one table lookup
+        inverse = invert_transform(np.asarray(affine, dtype=np.float64))
+        matrix = np.vstack([inverse, [0, 0, 1]]) if inverse.shape == (2, 3) else inverse
+        #camera -> comparison pixels, pixel centers aligned like the INTER_AREA downsampling of the images
+        sx, sy = self.shape[1] / camera_shape[1], self.shape[0] / camera_shape[0]
+        matrix = np.array([[sx, 0, 0.5 * sx - 0.5], [0, sy, 0.5 * sy - 0.5], [0, 0, 1]]) @ matrix
+        self.to_camera = warp_map(matrix, *self.shape)
+        self.min_ncc = min_ncc
+        self.max_offset = max_offset
+        self.max_missing = max_missing
+        self.max_extra = max_extra
+        self.min_signal = min_signal
+        self.dark = None
+        if dark is not None:
+            self.set_dark(dark)
+        self.background = None  # background level of the last tile with a dark area
+        self.kernel = np.ones((2 * tolerance + 1, 2 * tolerance + 1), np.uint8) if tolerance > 0 else None
+        self.batch_size = max(1, batch_size)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='verify')
+        self.lock = threading.Lock()
+        self.batch = []
+        self.futures = []
+        self.results = {}  # tile index -> result of its latest verification
+
+    def expected(self, mask):
+        '''The mask in camera space at the comparison resolution, float32 0/1.'''
+        mask = np.asarray(mask)
+        mask = (mask.reshape(self.dmd_shape) >= 0.5).astype(np.uint8) if mask.dtype != np.bool_ else mask
+        return self.to_camera.warp_mask(mask, reuse=False).astype(np.float32)
+
+    def submit(self, index, mask, img):
+        '''Queues tile index for verification. Returns immediately.'''
+        with self.lock:
+            self.batch.append((index, mask, img))
+            if len(self.batch) >= self.batch_size:
+                self._submit_batch()
+
+    def _submit_batch(self):
+        # call with the lock held
+        if self.batch:
+            self.futures.append(self.pool.submit(self._verify_batch, self.batch))
+            self.batch = []
+
+    def set_dark(self, img):
+        '''Sets the dark reference, a camera image with the dmd off.'''
+        self.dark = self._resize(img)
+
+    def reset(self):
+        '''Waits for the pending verifications and forgets all results, e.g. before the next print job.'''
+        self.flush()
+        with self.lock:
+            self.results = {}
+            self.background = None
+
+    def flush(self):
+        '''Verifies the queued tiles and waits until all verifications are done.'''
+        with self.lock:
+            self._submit_batch()
+            futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def _verify_batch(self, batch):
+        expected = [self.expected(mask) for _, mask, _ in batch]
+        captured = [self._normalize(img, e) for (_, _, img), e in zip(batch, expected)]
+        checked = [i for i, c in enumerate(captured) if c is not None]
+        results = {}
+        if checked:
+            results = verify_batch(np.stack([expected[i] for i in checked]), np.stack([captured[i] for i in checked]),
+                                   self.kernel)
+        with self.lock:
+            for i, (index, _, _) in enumerate(batch):
+                if i in checked:
+                    j = checked.index(i)
+                    result = {key: float(value[j]) for key, value in results.items()}
+                    for key in ('offset', 'dx', 'dy'):
+                        result[key] = result[key] / self.scale  # camera pixels
+                else:
+                    result = {key: np.nan for key in ('ncc', 'offset', 'dx', 'dy', 'missing', 'extra')}
+                    result['expected_area'] = float((expected[i] > 0.5).sum())
+                result['ok'] = self._passes(result)
+                self.results[index] = result
+
+    def _resize(self, img):
+        img = np.asarray(img, dtype=np.float32).reshape(self.camera_shape)
+        return cv2.resize(img, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+
+    def _normalize(self, img, expected):
+        '''Captured image at the comparison resolution, background 0 and exposed areas 1, or None if the
+        background level is unknown. The levels are measured inside the dark and lit areas of the expected
+        mask, away from the edges.'''
+        img = self._resize(img)
+        inner, outer = _regions(expected[np.newaxis] > 0.5, self.kernel)
+        inner, outer = inner[0], outer[0]
+        if not outer.all():
+            low = float(np.median(img[~outer]))
+            self.background = low
+        elif self.dark is not None:
+            low = self.dark
+        elif self.background is not None:
+            low = self.background
+        else:
+            return None
+        high = float(np.median(img[inner] - (low[inner] if np.ndim(low) else low))) if inner.any() else 0.
+        return (img - low) / max(high, self.min_signal, 1e-6)
+
+    def _passes(self, result):
+        if np.isnan(result['missing']):
+            return True  # could not be checked, see dark
+        area_ok = result['missing'] <= self.max_missing and result['extra'] <= self.max_extra
+        if np.isnan(result['ncc']):
+            return area_ok  # uniform mask (nothing or everything lit), there is no pattern to align
+        return area_ok and result['ncc'] >= self.min_ncc and result['offset'] <= self.max_offset
+
+    @property
+    def failed(self):
+        '''Indices of the tiles whose latest verification failed.'''
+        with self.lock:
+            return sorted(index for index, result in self.results.items() if not result['ok'])
+
+    def close(self):
+        self.flush()
+        self.pool.shutdown()
+
+
+def verify_batch(expected, captured, kernel=None):
+    '''Compares a batch of expected masks with normalized captured images, all of shape (n, height, width).
+    Args:
+        expected: float 0/1 masks in camera space
+        captured: images scaled to background 0 and exposed 1
+        kernel: structuring element, edges may be off by its radius without counting as missing or extra
+    Returns:
+        dict of (n,) arrays: ncc (zero-mean normalized correlation), offset (misregistration in pixels),
+        dx, dy, missing and extra (area fractions relative to the expected area, or to the image for empty
+        masks) and expected_area (pixels). ncc, offset, dx and dy are nan for uniform masks.
+    '''
+    n = len(expected)
+    e = expected - expected.mean(axis=(1, 2), keepdims=True)
+    c = captured - captured.mean(axis=(1, 2), keepdims=True)
+    denominator = np.sqrt((e * e).sum(axis=(1, 2)) * (c * c).sum(axis=(1, 2)))
+    ncc = np.where(denominator > 0, (e * c).sum(axis=(1, 2)) / np.maximum(denominator, 1e-12), 0.)
+
+    # phase correlation of the whole batch at once
+    window = np.outer(np.hanning(expected.shape[1]), np.hanning(expected.shape[2])).astype(np.float32)
+    cross = np.fft.rfft2(c * window) * np.conj(np.fft.rfft2(e * window))
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    correlation = np.fft.irfft2(cross, s=expected.shape[1:])
+    peaks = correlation.reshape(n, -1).argmax(axis=1)
+    py, px = np.unravel_index(peaks, expected.shape[1:])
+    dy = np.where(py > expected.shape[1] // 2, py - expected.shape[1], py) + _subpixel(correlation, py, px, 1)
+    dx = np.where(px > expected.shape[2] // 2, px - expected.shape[2], px) + _subpixel(correlation, py, px, 2)
+
+    lit = captured > 0.5
+    target = expected > 0.5
+    inner, outer = _regions(target, kernel)
+    area = target.sum(axis=(1, 2)).astype(np.float64)
+    missing = (inner & ~lit).sum(axis=(1, 2)) / np.maximum(area, 1)
+    # relative to the expected area, or to the whole image for empty tiles
+    extra = (lit & ~outer).sum(axis=(1, 2)) / np.where(area > 0, area, target[0].size)
+    # a uniform mask has no pattern to correlate or align with
+    uniform = (e * e).sum(axis=(1, 2)) == 0
+    ncc = np.where(uniform, np.nan, ncc)
+    dx = np.where(uniform, np.nan, dx)
+    dy = np.where(uniform, np.nan, dy)
+    return {'ncc': ncc, 'offset': np.hypot(dx, dy), 'dx': dx, 'dy': dy, 'missing': missing, 'extra': extra,
+            'expected_area': area}
+
+
+def _subpixel(correlation, py, px, axis):
+    '''Offset of the correlation peaks along axis (1: y, 2: x) from a parabola through the peak and its neighbours.'''
+    if correlation.shape[axis] < 3:
+        return np.zeros(len(correlation))
+    step_y, step_x = int(axis == 1), int(axis == 2)
+    height, width = correlation.shape[1:]
+    rows = np.arange(len(correlation))
+    s0 = correlation[rows, (py - step_y) % height, (px - step_x) % width]
+    s1 = correlation[rows, py, px]
+    s2 = correlation[rows, (py + step_y) % height, (px + step_x) % width]
+    curvature = s0 - 2 * s1 + s2
+    return np.where(curvature < 0, 0.5 * (s0 - s2) / np.where(curvature < 0, curvature, -1.), 0.)
+
+
+def _regions(target, kernel):
+    '''Areas of a batch of bool masks that must be lit (eroded) and that may be lit (dilated).'''
+    if kernel is None:
+        return target, target
+    inner = np.stack([cv2.erode(t.view(np.uint8), kernel) for t in target]).astype(bool)
+    outer = np.stack([cv2.dilate(t.view(np.uint8), kernel) for t in target]).astype(bool)
+    return inner, outer
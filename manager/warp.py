@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+
+
+class warp_map:
+    '''Precomputed camera -> dmd mapping for a fixed calibration.
+    The remap tables are computed once, in OpenCV's compact fixed point format, so every warp
+    is a single table lookup with cv2.remap instead of a full cv2.warpAffine.
+    '''
+    def __init__(self, affine, height, width):
+        '''Args:
+            affine: camera -> dmd transformation, 2x3 affine or 3x3 homography (as used by cv2.warpAffine)
+            height, width: size of the dmd
+        '''
+        self.affine = np.array(affine, dtype=np.float64)
+        self.height = height
+        self.width = width
+
+        #for every dmd pixel, the camera pixel it samples from
+        matrix = np.vstack([self.affine, [0, 0, 1]]) if self.affine.shape == (2, 3) else self.affine
+        inverse = np.linalg.inv(matrix)
+        xs, ys = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        src = inverse @ np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)])
+        map_x = (src[0] / src[2]).reshape(height, width).astype(np.float32)
+        map_y = (src[1] / src[2]).reshape(height, width).astype(np.float32)
+
+        self.map1, self.map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        self.map_nearest, _ = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=True)
+        self.buffers = {}  # one reusable output buffer per dtype
+
+    def _out(self, dtype, out):
+        if out is not None:
+            return out
+        if dtype not in self.buffers:
+            self.buffers[dtype] = np.empty((self.height, self.width), dtype=dtype)
+        return self.buffers[dtype]
+
+    def warp(self, img, out=None, reuse=True):
+        '''Warps an image in camera space into dmd space, with bilinear interpolation.
+        Args:
+            img: image in camera space
+            out: array of shape (height, width) and dtype of img to write into
+            reuse: write into a buffer owned by the warp_map, which is overwritten by the next call.
+                If False and out is None, a new array is returned.
+        '''
+        if out is None and not reuse:
+            out = np.empty((self.height, self.width), dtype=img.dtype)
+        return cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR,
+                         dst=self._out(img.dtype, out), borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    def warp_mask(self, mask, out=None, reuse=True):
+        '''Warps a binary mask in camera space into dmd space, with nearest neighbour lookup.
+        Bool masks are read as uint8 without a copy. See warp for the arguments.
+        '''
+        if mask.dtype == np.bool_:
+            mask = mask.view(np.uint8)
+        if out is None and not reuse:
+            out = np.empty((self.height, self.width), dtype=mask.dtype)
+        return cv2.remap(mask, self.map_nearest, None, cv2.INTER_NEAREST,
+                         dst=self._out(mask.dtype, out), borderMode=cv2.BORDER_CONSTANT, borderValue=0)
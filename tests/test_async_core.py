@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from manager.acquisition import acq_mask
+from manager.async_core import acq_mask_async, apply_async, async_core, move_to_async
+from manager.benchmark import _setup
+from manager.preset import state_cache
+from manager.simulation import simulated_core
+from manager.stage import move_to, stage_position
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def _run(core, coroutine_fn, **kwargs):
+    async def main():
+        acore = async_core(core, poll_interval=0.001, **kwargs)
+        try:
+            return await coroutine_fn(acore)
+        finally:
+            acore.close()
+    return asyncio.run(main())
+
+
+def test_core_methods_are_coroutines():
+    core, _, _ = _setup(NO_LATENCY)
+    core.set_exposure(7)
+
+    async def read(acore):
+        return await acore.get_exposure(), await acore.call('get_slm_device')
+    assert _run(core, read) == (7, core.slm_name)
+
+
+def test_acq_mask_async_matches_the_blocking_helpers():
+    mask = np.zeros((600, 800), dtype=bool)
+    mask[200:400, 300:500] = True
+    pos = stage_position(150., -20., 3.)
+    expected_core, expected_device, expected_preset = _setup(NO_LATENCY, noise=0)
+    move_to(expected_core, pos)
+    expected = acq_mask(mask, expected_preset, expected_device)
+    core, device, channel = _setup(NO_LATENCY, noise=0)
+    img = _run(core, lambda acore: acq_mask_async(acore, mask, channel, device, pos))
+    np.testing.assert_array_equal(img, expected)
+    assert (core.x, core.y) == (150., -20.) and core.properties == expected_core.properties
+    assert not core.slm_displayed.any()
+
+
+def test_device_moves_overlap():
+    latencies = dict(NO_LATENCY, state=0.2, stage=0.2)
+    mask = np.ones((600, 800), dtype=bool)
+    pos = stage_position(1000., 0., None)
+    core, device, channel = _setup(latencies)
+    start = time.perf_counter()
+    move_to(core, pos)
+    acq_mask(mask, channel, device)  # filter wheel turns after the stage stopped
+    serial = time.perf_counter() - start
+    core, device, channel = _setup(latencies)
+    start = time.perf_counter()
+    _run(core, lambda acore: acq_mask_async(acore, mask, channel, device, pos))
+    concurrent = time.perf_counter() - start
+    assert serial > 0.39 and concurrent < 0.3
+
+
+def test_apply_async_skips_applied_properties_and_invalidates_on_errors():
+    core, _, channel = _setup(NO_LATENCY)
+    _run(core, lambda acore: apply_async(acore, channel))
+    assert state_cache(core).is_applied('Wheel-C', 'State', 1)
+    written = []
+    set_property = core.set_property
+    core.set_property = lambda *args: (written.append(args), set_property(*args))
+    _run(core, lambda acore: apply_async(acore, channel))
+    assert written == []
+    _run(core, lambda acore: apply_async(acore, channel, force=True))
+    assert len(written) == len(channel.settings)
+
+    def failing(*args):
+        raise RuntimeError('device not responding')
+    core.set_property = failing
+    with pytest.raises(RuntimeError):
+        _run(core, lambda acore: apply_async(acore, channel, force=True))
+    assert not state_cache(core).is_applied('Wheel-C', 'State', 1)
+
+
+def test_move_to_async_switches_the_pfs_off_for_z_moves():
+    core, _, _ = _setup(NO_LATENCY)
+    core.enable_continuous_focus(True)
+    _run(core, lambda acore: move_to_async(acore, stage_position(0., 0., 5.), focus=None))
+    assert core.is_continuous_focus_enabled()
+    _run(core, lambda acore: move_to_async(acore, stage_position(0., 0., 5.), focus='z'))
+    assert not core.is_continuous_focus_enabled() and core.z == 5.
+
+
+def test_core_factory_gives_every_worker_its_own_core():
+    cores = []
+
+    def factory():
+        cores.append(simulated_core(latencies=NO_LATENCY))
+        return cores[-1]
+
+    async def many(acore):
+        return await asyncio.gather(*(acore.get_exposure() for _ in range(20)))
+    assert _run(simulated_core(latencies=NO_LATENCY), many, max_workers=3, core_factory=factory) == [10] * 20
+    assert 1 <= len(cores) <= 3
@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+
+from manager.benchmark import _setup
+from manager.calibration_store import calibration_store
+from manager.dmd import apply_transform
+from manager.simulation import simulated_core
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def _assert_close_to_truth(affine, core):
+    corners = np.array([(0, 0), (core.camera_width, core.camera_height)], dtype=np.float32)
+    assert np.abs(apply_transform(affine, corners) - apply_transform(core.true_calibration(), corners)).max() < 1.
+
+
+def test_entries_round_trip(tmp_path):
+    path = tmp_path / 'calibrations.json'
+    store = calibration_store(path)
+    affine = np.array([[0.5, 0.01, 3.], [-0.02, 0.5, 7.]])
+    store.put('key', {'objective': '20x'}, affine, {'rms': 0.1, 'max': 0.3})
+    assert json.loads(path.read_text())['key']['rms'] == 0.1
+    loaded, entry = calibration_store(path).get('key')
+    np.testing.assert_array_equal(loaded, affine)
+    assert entry['config'] == {'objective': '20x'} and entry['max'] == 0.3
+    assert calibration_store(path).get('missing') == (None, None)
+    store.remove('key')
+    assert calibration_store(path).entries == {}
+
+
+def test_key_depends_on_the_optical_configuration(tmp_path):
+    _, device, channel = _setup(NO_LATENCY)
+    store = calibration_store(tmp_path / 'calibrations.json')
+    key, config = store.key(channel, device, '20x')
+    assert store.key(channel, device, '20x')[0] == key and config['dmd'] == [device.height, device.width]
+    assert store.key(channel, device, '10x')[0] != key
+    channel.settings = [s if s[1] != 'Violet_Level' else [s[0], s[1], 50] for s in channel.settings]
+    assert store.key(channel, device, '20x')[0] == key  # light source levels don't move the image
+    channel.settings = [s if s[1] != 'State' else [s[0], s[1], '2'] for s in channel.settings]
+    assert store.key(channel, device, '20x')[0] != key
+
+
+def test_calibrate_reuses_verified_entries(tmp_path):
+    path = tmp_path / 'calibrations.json'
+    core, device, channel = _setup(NO_LATENCY)
+    assert calibration_store(path).calibrate(channel, device) == 'calibrated'
+    stored = channel.affine
+    _assert_close_to_truth(stored, core)
+
+    channel.affine = None
+    store = calibration_store(path)  # after a restart
+    assert store.calibrate(channel, device) == 'verified'
+    np.testing.assert_array_equal(channel.affine, stored)
+    assert 'verified' in next(iter(store.entries.values()))
+
+    core.affine[:, 2] += 15  # the image moved on the camera
+    assert calibration_store(path).calibrate(channel, device) == 'recalibrated'
+    _assert_close_to_truth(channel.affine, core)
+
+    stale = calibration_store(path, max_age=-1)
+    assert stale.calibrate(channel, device) == 'recalibrated'
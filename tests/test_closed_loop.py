@@ -0,0 +1,94 @@
+import queue
+from types import SimpleNamespace
+
+import numpy as np
+
+from manager.benchmark import _setup
+from manager.closed_loop import closed_loop, segment_nuclei
+from manager.simulation import simulated_core
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+SHAPE = (256, 256)
+CENTERS = [(50, 50), (100, 180), (200, 90)]
+
+
+def _nuclei(rng, amplitude=30., noise=5.):
+    yy, xx = np.mgrid[:SHAPE[0], :SHAPE[1]]
+    img = 100 + rng.normal(0, noise, SHAPE)
+    for cy, cx in CENTERS:
+        img[(yy - cy) ** 2 + (xx - cx) ** 2 < 100] += amplitude
+    return img
+
+
+class _linker:
+    '''Minimal stand-in for trackpy's Linker: every object keeps the index it has in the first frame.'''
+    def init_level(self, coords, t):
+        self.particle_ids = list(range(len(coords)))
+
+    def next_level(self, coords, t):
+        self.init_level(coords, t)
+
+
+def _fov(percentage=100.):
+    return SimpleNamespace(index=0, linker=_linker(), percentage=percentage, cells_to_stim=[],
+                           last_frame_time=None, tracks_queue=queue.Queue(1), light_mask_queue=queue.Queue(1))
+
+
+def test_segments_nuclei():
+    coords, areas, labels = segment_nuclei(_nuclei(np.random.default_rng(0)))
+    assert len(coords) == len(CENTERS)
+    found = sorted(map(tuple, np.round(coords).astype(int)))
+    assert all(abs(y - cy) <= 1 and abs(x - cx) <= 1 for (y, x), (cy, cx) in zip(found, sorted(CENTERS)))
+    assert labels.max() == len(CENTERS) and (areas > 200).all()
+
+
+def test_flat_and_noise_frames_have_no_objects():
+    rng = np.random.default_rng(0)
+    for img in (np.zeros(SHAPE), np.full(SHAPE, 1000.), 100 + rng.normal(0, 5, SHAPE)):
+        coords, areas, labels = segment_nuclei(img)
+        assert len(coords) == 0 and len(areas) == 0 and not labels.any()
+
+
+def test_objects_larger_than_max_area_are_dropped():
+    img = np.zeros(SHAPE)
+    img[:, :200] = 1000.  # e.g. an out of focus blob, not a nucleus
+    img[220:230, 220:230] = 1000.
+    coords, areas, _ = segment_nuclei(img, threshold=500., blur=0)
+    assert len(coords) == 1 and areas[0] == 100
+
+
+def test_light_mask_of_the_selected_cells():
+    _, device, _ = _setup(NO_LATENCY)
+    loop = closed_loop(device, np.float64([[1, 0, 0], [0, 1, 0]]), radius=5, workers=0)
+    light_mask, tracks, _ = loop.process(_fov(), _nuclei(np.random.default_rng(0)), 0.)
+    assert tracks['stim'].all()
+    for y, x in zip(tracks['y'], tracks['x']):
+        assert light_mask[int(y), int(x)]
+    assert 0 < light_mask.sum() <= len(CENTERS) * np.pi * 6 ** 2
+
+
+def test_no_selected_cells_clear_the_light_mask():
+    _, device, _ = _setup(NO_LATENCY)
+    rng = np.random.default_rng(0)
+    for render in ('disk', 'cell'):
+        loop = closed_loop(device, np.float64([[1, 0, 0], [0, 1, 0]]), render=render, workers=0)
+        light_mask, tracks, _ = loop.process(_fov(percentage=0.), _nuclei(rng), 0.)
+        assert len(tracks['particle']) == len(CENTERS) and not tracks['stim'].any()
+        assert light_mask.shape == (device.height, device.width) and not light_mask.any()
+        light_mask, tracks, _ = loop.process(_fov(), np.zeros(SHAPE), 0.)  # blank frame, no cells
+        assert len(tracks['particle']) == 0 and not light_mask.any()
+
+
+def test_workers_push_an_empty_mask():
+    _, device, _ = _setup(NO_LATENCY)
+    loop = closed_loop(device, np.float64([[1, 0, 0], [0, 1, 0]]))
+    fov = _fov()
+    fov.light_mask_queue.put(np.ones((device.height, device.width), dtype=np.uint8))  # the previous mask
+    loop.submit(fov, np.zeros(SHAPE))
+    light_mask = None
+    for _ in range(100):
+        light_mask = fov.light_mask_queue.get(timeout=5)
+        if not light_mask.any():
+            break
+    loop.close()
+    assert light_mask is not None and not light_mask.any()
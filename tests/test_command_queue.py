@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+from manager.command_queue import command_queue
+
+
+def test_commands_run_on_the_owner_thread_in_order():
+    commands = command_queue()
+    threads, order = [], []
+
+    def record(i):
+        threads.append(threading.current_thread())
+        order.append(i)
+        return i * i
+
+    futures = [commands.submit(record, i) for i in range(20)]
+    assert [f.result() for f in futures] == [i * i for i in range(20)]
+    assert order == list(range(20)) and set(threads) == {commands.thread}
+    commands.close()
+
+
+def test_priority_runs_first():
+    commands = command_queue()
+    release = threading.Event()
+    commands.submit(release.wait)  # keeps the owner thread busy while the rest is queued
+    order = []
+    futures = [commands.submit(order.append, name, priority=priority)
+               for name, priority in [('low', 1), ('first', 0), ('urgent', -1), ('second', 0)]]
+    release.set()
+    for future in futures:
+        future.result()
+    assert order == ['urgent', 'first', 'second', 'low']
+    commands.close()
+
+
+def test_errors_go_to_the_caller_and_the_thread_keeps_running():
+    commands = command_queue()
+    with pytest.raises(ZeroDivisionError):
+        commands.call(lambda: 1 / 0)
+    assert commands.call(max, 3, 4) == 4
+    commands.close()
+
+
+def test_nested_calls_do_not_dead_lock():
+    commands = command_queue()
+    assert commands.call(lambda: commands.call(lambda: threading.current_thread())) is commands.thread
+    commands.close()
+
+
+def test_cancelled_commands_do_not_run_and_close_finishes_the_queue():
+    commands = command_queue()
+    release = threading.Event()
+    commands.submit(release.wait)
+    ran = []
+    cancelled = commands.submit(ran.append, 'cancelled')
+    last = commands.submit(ran.append, 'last')
+    assert cancelled.cancel()
+    release.set()
+    commands.close()
+    assert ran == ['last'] and last.done() and not commands.thread.is_alive()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from manager.benchmark import _setup
+from manager.dmd import apply_transform, detect_spots, fit_transform, grid_points, invert_transform
+from manager.simulation import simulated_core
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def _masks(device, n_frames):
+    masks = np.zeros((n_frames, device.height, device.width), dtype=bool)
+    for frame in range(n_frames):
+        masks[frame, :, 100 * frame:100 * (frame + 1)] = True
+    return masks
+
+
+def test_play_sequence_in_hardware():
+    core, device, _ = _setup(NO_LATENCY, slm_sequence_max_length=16)
+    masks = _masks(device, 3)
+    timing, imgs = device.play_sequence(masks, 5.)
+    assert timing['mode'] == 'hardware' and len(timing['frames']) == 3 and imgs == []
+    assert len(core.slm_sequence) == 3 and core.slm_exposure == 5.
+    np.testing.assert_array_equal(core.slm_displayed, masks[-1])
+
+
+def test_play_sequence_with_a_dose_ramp_in_hardware():
+    core, device, _ = _setup(NO_LATENCY, slm_sequence_max_length=16)
+    masks = _masks(device, 3)
+    timing, imgs = device.play_sequence(masks, [10., 20., 30.])
+    assert timing['mode'] == 'hardware' and imgs == []
+    assert core.slm_exposure == 10. and device.exposure_time == 10.
+    played = [int(np.flatnonzero(frame[0])[0]) // 100 for frame in core.slm_sequence]
+    assert played == [0, 1, 1, 2, 2, 2]
+    assert np.allclose(np.array(timing['frames']) / timing['total'], [1 / 6, 2 / 6, 3 / 6])
+
+
+def test_play_sequence_falls_back_to_a_loop():
+    for max_length, exposure_times, snap in [(0, 5., False), (16, [1., 20., 30.], False), (16, 5., True)]:
+        core, device, _ = _setup(NO_LATENCY, slm_sequence_max_length=max_length)
+        masks = _masks(device, 3)
+        set_exposure = core.set_slm_exposure
+        exposures = []
+        core.set_slm_exposure = lambda name, exposure: (exposures.append(exposure), set_exposure(name, exposure))
+        timing, imgs = device.play_sequence(masks, exposure_times, snap=snap)
+        assert timing['mode'] == 'loop' and len(timing['frames']) == 3
+        assert core.slm_sequence == []
+        assert exposures == sorted(set(np.broadcast_to(exposure_times, (3,))))  # set only when it changes
+        np.testing.assert_array_equal(core.slm_displayed, masks[-1])
+        assert len(imgs) == (3 if snap else 0)
+        if snap:
+            assert all(img.shape == (core.camera_height, core.camera_width) for img in imgs)
+
+
+def test_detect_spots_finds_subpixel_centroids():
+    frames = np.zeros((2, 64, 64), dtype=np.float32)
+    frames[0, 10:13, 20:22] = 100  # centre (20.5, 11)
+    frames[1, 40:44, 30:33] = 100  # centre (31, 41.5)
+    frames[1, 10:13, 20:22] = 50
+    centroids, intensities = detect_spots(frames, blur=1, min_area=4)
+    np.testing.assert_allclose(centroids, [(20.5, 11.), (31., 41.5)], atol=1e-4)
+    np.testing.assert_allclose(intensities, [[600., 300.], [0., 1200.]])
+
+
+def test_fit_transform_rejects_an_outlier():
+    truth = np.array([[0.5, 0.1, 20.], [-0.05, 0.6, 10.]])
+    camera = grid_points(1000, 1000, 3, 4)
+    points = apply_transform(truth, camera)
+    points[5] += (40., -30.)  # misdetected spot
+    matrix, report = fit_transform(camera, points)
+    np.testing.assert_allclose(matrix, truth, atol=1e-3)
+    assert not report['inliers'][5] and report['n_inliers'] == 11 and report['rms'] < 1e-3
+    np.testing.assert_allclose(apply_transform(invert_transform(matrix), points[:5]), camera[:5], atol=1e-2)
+
+
+@pytest.mark.parametrize('initial', [False, True])
+def test_calibrate_grid_recovers_the_simulated_affine(initial):
+    affine = [[1.1, 0.05, 40.], [-0.04, 1.05, 150.]]
+    core, device, _ = _setup(NO_LATENCY, affine=affine)
+    truth = core.true_calibration()
+    initial_affine = truth + [[0.01, 0, 3.], [0, -0.01, -2.]] if initial else None
+    warp_mat, report = device.calibrate_grid(initial_affine=initial_affine)
+    assert report['n_frames'] == (1 if initial else 4) and report['n_detected'] == 12
+    assert report['rms'] < 0.5
+    corners = np.array([(0, 0), (core.camera_width, core.camera_height)], dtype=np.float32)
+    assert np.abs(apply_transform(warp_mat, corners) - apply_transform(truth, corners)).max() < 1.
+    assert not core.slm_displayed.any()
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from manager.benchmark import _setup
+from manager.dose_calibration import analyse_images, dose_calibration, test_pattern as grating_pattern
+from manager.simulation import simulated_core
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def test_pattern_has_whole_periods_of_every_width():
+    mask, layout = grating_pattern(600, 800, widths=(2, 4, 8))
+    assert layout['widths'] == (2, 4, 8) and (layout['x1'] - layout['x0']) % 16 == 0
+    for (y0, y1), width in zip(layout['bands'], layout['widths']):
+        row = mask[(y0 + y1) // 2, layout['x0']:layout['x1']]
+        assert row.mean() == 0.5 and np.all(row[:width]) and not np.any(row[width:2 * width])
+    assert not mask[:40].any() and not mask[:, :40].any()
+    with pytest.raises(ValueError):
+        grating_pattern(600, 100, widths=(32,))
+
+
+def test_analyse_images_measures_the_gratings():
+    core = simulated_core(latencies=NO_LATENCY, blur=0., noise=0, seed=0)
+    mask, layout = grating_pattern(core.slm_height, core.slm_width)
+    core.slm_displayed = mask
+    sharp = core.render_image()
+    core.blur = 3.
+    blurred = core.render_image()
+    metrics = analyse_images(np.stack([sharp, blurred]), core.true_calibration(), core.slm_height, core.slm_width,
+                             layout)
+    assert metrics['width'].shape == (2, len(layout['widths']))
+    assert np.abs(metrics['width_error'][0]).max() <= 1. and (metrics['contrast'][0] > 0.5).all()
+    # blurring washes out the narrow bars first
+    assert metrics['contrast'][1, 0] < 0.2 < metrics['contrast'][1, -1]
+    resolved = metrics['contrast'][1] > 0.2  # the edges of bars without contrast have no meaningful slope
+    assert (metrics['sharpness'][1, resolved] < metrics['sharpness'][0, resolved]).all()
+
+
+def _calibration(**kwargs):
+    core, device, channel = _setup(NO_LATENCY, **kwargs)
+    channel.affine = core.true_calibration()
+    return core, dose_calibration(device, channel, led_powers=[20, 40, 80], exposure_times=[50, 100],
+                                  x_offset=1000., y_offset=800., processes=1)
+
+
+def test_fit_recovers_the_working_curve():
+    _, calibration = _calibration()
+    widths = np.array(calibration.layout['widths'])
+    for row, exposure_time in enumerate(calibration.exposure_times):
+        for col, power in enumerate(calibration.led_powers):
+            dose = float(power * exposure_time)
+            contrast = 0.1 * np.log(dose / 500.)
+            calibration.results.append({
+                'row': row, 'col': col, 'power': float(power), 'exposure_time': float(exposure_time), 'dose': dose,
+                'width_error': np.full(len(widths), -3.5 + 0.5 * np.log(dose)),
+                'contrast': np.full(len(widths), contrast), 'sharpness': np.full(len(widths), 0.5)})
+    model = calibration.fit()
+    assert model['b'] == pytest.approx(0.5) and model['a'] == pytest.approx(-3.5)
+    assert model['target_dose'] == pytest.approx(np.exp(7)) and model['threshold_dose'] == pytest.approx(500.)
+    recommendation = calibration.recommend()
+    assert recommendation['cell'] == (0, 0)  # 20 * 50 is closest to the target dose of 1097
+    assert recommendation['power'] == 20. and recommendation['exposure_time'] == pytest.approx(np.exp(7) / 20)
+    assert calibration.maps()['resolution'][1, 2] == widths.min()
+
+
+def test_fit_needs_different_doses():
+    _, calibration = _calibration()
+    assert calibration.fit() is None and calibration.recommend() is None
+
+
+def test_run_prints_and_analyses_every_cell():
+    core, calibration = _calibration(camera_shape=(512, 512))
+    core.x, core.y = 100., 200.
+    seen, printed = [], []
+    results = calibration.run(on_result=seen.append, progress=printed.append)
+    assert [(r['row'], r['col']) for r in results] == [(row, col) for row in range(2) for col in range(3)]
+    assert len(seen) == 6 and sorted(printed) == list(range(6))
+    # the 512 px camera images the 2 and 4 px bars with 1.3 and 2.6 px, too small to resolve
+    assert (np.abs(np.array([r['width_error'] for r in results])[:, 2:]) <= 1.).all()
+    assert (core.x, core.y) == (100., 200.)  # back at the start
+    assert calibration.preset.settings[-1][2] == 100 and calibration.preset.camera_exposure_time == 10
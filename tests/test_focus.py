@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+import pytest
+
+from manager.benchmark import _setup
+from manager.dmd import checker_board_pattern
+from manager.focus import _peak, autofocus, focus_score
+from manager.simulation import simulated_core
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def test_peak_of_a_parabola():
+    zs = np.linspace(-4, 4, 9)
+    assert _peak(zs, -(zs - 1.3) ** 2) == pytest.approx(1.3)
+    assert _peak(zs, zs) == 4.  # maximum at the border, no refinement
+    assert _peak(zs, np.ones(9)) == -4.
+
+
+@pytest.mark.parametrize('metric', ['laplacian', 'brenner'])
+def test_focus_score_prefers_sharp_images(metric):
+    sharp = checker_board_pattern(256, 256, 8).astype(np.float32) * 1000
+    scores = [focus_score(cv2.GaussianBlur(sharp, (0, 0), sigma), metric) if sigma else focus_score(sharp, metric)
+              for sigma in (0, 1, 2, 4)]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_focus_score_rejects_unknown_metrics():
+    with pytest.raises(ValueError):
+        focus_score(np.zeros((8, 8)), 'variance')
+
+
+def test_autofocus_finds_the_focus():
+    core, device, _ = _setup(NO_LATENCY, camera_shape=(256, 256), focus_z=3.7)
+    core.set_exposure(2)
+    core.z = -4.
+    z, samples = autofocus(core, device)
+    assert abs(z - 3.7) < 0.5 and core.z == z
+    assert len(samples) == 27 and samples[:, 0].min() < -13 and samples[:, 0].max() > 5
+    assert not core.is_sequence_running()
+    assert not core.slm_displayed.any()  # the checkerboard is not left on
+
+
+def test_autofocus_switches_the_dmd_off_after_a_failure():
+    core, device, _ = _setup(NO_LATENCY, camera_shape=(256, 256), focus_z=0.)
+    core.set_exposure(2)
+
+    def failing_move(*args):
+        raise RuntimeError('focus drive failed')
+
+    core.set_position = failing_move
+    with pytest.raises(RuntimeError):
+        autofocus(core, device)
+    assert not core.slm_displayed.any() and not core.is_sequence_running()
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from manager.focus_map import focus_map
+
+
+def _surface(x, y):
+    return 100 + 0.002 * x - 0.001 * y + 2 * np.sin(x / 3000)
+
+
+@pytest.mark.parametrize('method', ['plane', 'tps'])
+def test_predicts_a_tilted_slide(method):
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(0, 10000, 12), rng.uniform(0, 8000, 12)
+    fmap = focus_map(x, y, _surface(x, y), method=method)
+    gx, gy = np.meshgrid(np.linspace(0, 10000, 20), np.linspace(0, 8000, 20))
+    assert np.abs(fmap.predict(gx, gy) - _surface(gx, gy)).max() < (2 if method == 'plane' else 0.5)
+
+
+@pytest.mark.parametrize('method', ['auto', 'plane', 'tps'])
+def test_collinear_measurements(method):
+    x = np.linspace(0, 9000, 10)
+    fmap = focus_map(x, np.full(10, 500.), 100 + 0.001 * x, method=method)
+    # along the line the focus is interpolated, across it it stays constant
+    assert fmap.predict(4500., 500.) == pytest.approx(104.5)
+    assert fmap.predict(4500., 3000.) == pytest.approx(104.5)
+
+
+def test_single_position_raises():
+    with pytest.raises(ValueError):
+        focus_map([10., 10., 10.], [5., 5., 5.], [1., 2., 3.])
+
+
+def test_noisy_measurements_are_smoothed():
+    rng = np.random.default_rng(0)
+    gx, gy = np.meshgrid(np.linspace(0, 10000, 4), np.linspace(0, 8000, 4))
+    x, y = gx.ravel(), gy.ravel()
+    z = _surface(x, y) + rng.normal(0, 0.3, x.size)
+    tx, ty = np.meshgrid(np.linspace(0, 10000, 30), np.linspace(0, 8000, 30))
+    errors = {}
+    for smoothing in (0., 0.01):
+        fmap = focus_map(x, y, z, method='tps', smoothing=smoothing)
+        errors[smoothing] = np.sqrt(np.mean((fmap.predict(tx, ty) - _surface(tx, ty)) ** 2))
+    assert np.abs(focus_map(x, y, z, method='tps', smoothing=0.).residuals()).max() < 1e-6
+    assert errors[0.01] < errors[0.]
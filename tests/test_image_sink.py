@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+import pytest
+import tifffile
+import zarr
+
+from manager.benchmark import _setup
+from manager.path_planner import plan_path
+from manager.print_job import print_job
+from manager.simulation import simulated_core
+from manager.stage import stage_position
+from utils.image_sink import ImageSink
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def _frame(row, col, channel, shape=(64, 96)):
+    return np.full(shape, 1000 * row + 100 * col + channel, dtype=np.uint16)
+
+
+def test_zarr(tmp_path):
+    path = tmp_path / 'chip.zarr'
+    with ImageSink(str(path), (64, 96), grid_shape=(2, 3), channels=2) as sink:
+        assert sink.format == 'zarr'
+        for row in range(2):
+            for col in range(3):
+                for channel in range(2):
+                    sink.put(_frame(row, col, channel).ravel(), row, col, channel,  # flat, as from the camera
+                             stage_position(10. * col, 20. * row, None))
+    assert sink.written == 12 and sink.stats()['mb_written'] == pytest.approx(12 * 64 * 96 * 2 / 2 ** 20)
+    group = zarr.open_group(str(path), mode='r')
+    images = group['images'][:]
+    assert images.shape == (2, 3, 2, 64, 96) and images.dtype == np.uint16
+    for row, col, channel in np.ndindex(2, 3, 2):
+        np.testing.assert_array_equal(images[row, col, channel], _frame(row, col, channel))
+    np.testing.assert_array_equal(group['positions'][1, 2], (20., 20., np.nan))
+
+
+def test_ome_tiff(tmp_path):
+    path = tmp_path / 'chip.ome.tif'
+    with ImageSink(str(path), (300, 200), grid_shape=(1, 2), tile=(64, 64)) as sink:
+        assert sink.format == 'ome-tiff'
+        sink.put(_frame(0, 1, 0, (300, 200)), 0, 1, position=stage_position(1.5, -2., 30.))
+        sink.put(_frame(0, 0, 0, (300, 200)), 0, 0)
+    with tifffile.TiffFile(str(path)) as tif:
+        assert tif.is_ome and len(tif.series) == 2
+        np.testing.assert_array_equal(tif.series[0].asarray(), _frame(0, 1, 0, (300, 200)))
+        np.testing.assert_array_equal(tif.series[1].asarray(), _frame(0, 0, 0, (300, 200)))
+        assert tif.pages[0].is_tiled and tif.pages[0].compression == tifffile.COMPRESSION.ADOBE_DEFLATE
+        ome = tifffile.xml2dict(tif.ome_metadata)['OME']['Image']
+    assert [image['Name'] for image in ome] == ['r0_c1_ch0', 'r0_c0_ch0']
+    plane = ome[0]['Pixels']['Plane']
+    assert (plane['PositionX'], plane['PositionY'], plane['PositionZ']) == (1.5, -2., 30.)
+
+
+def test_put_blocks_while_the_writer_is_behind(tmp_path):
+    sink = ImageSink(str(tmp_path / 'chip.zarr'), (8, 8), grid_shape=(1, 10), max_in_flight=2)
+    release = threading.Event()
+    write = sink._write
+    sink._write = lambda *args: (release.wait(), write(*args))
+    for col in range(3):  # one in the writer, two in the queue
+        sink.put(_frame(0, col, 0, (8, 8)), 0, col)
+    with pytest.raises(Exception):  # queue.Full
+        sink.put(_frame(0, 3, 0, (8, 8)), 0, 3, timeout=0.05)
+    release.set()
+    sink.close()
+    assert sink.written == 3
+
+
+def test_errors_reach_the_caller(tmp_path):
+    sink = ImageSink(str(tmp_path / 'chip.zarr'), (8, 8), grid_shape=(1, 2))
+    with pytest.raises(IndexError):
+        sink.put(np.zeros((8, 8)), 0, 2)
+    sink._write = lambda *args: 1 / 0
+    sink.put(np.zeros((8, 8)), 0, 0)
+    with pytest.raises(RuntimeError):
+        sink.close()
+    with pytest.raises(RuntimeError):
+        sink.put(np.zeros((8, 8)), 0, 1)
+    with pytest.raises(ValueError):
+        ImageSink(str(tmp_path / 'chip.h5'), (8, 8), format='hdf5')
+
+
+def test_print_job_streams_into_the_sink(tmp_path):
+    core, device, channel = _setup(NO_LATENCY, camera_shape=(128, 128), noise=0)
+    tiles = [[np.zeros((device.height, device.width), dtype=bool) for _ in range(3)] for _ in range(2)]
+    for row, col in [(0, 0), (0, 2), (1, 1)]:
+        tiles[row][col][100 * row:100 * row + 100, 200 * col:200 * col + 200] = True
+    plan = plan_path(tiles, 1000., 800.)
+    path = tmp_path / 'chip.zarr'
+    with ImageSink(str(path), (128, 128), grid_shape=(2, 3)) as sink:
+        images = print_job(device, channel, plan.select(tiles), plan.positions,
+                           on_image=sink.on_image(plan.tile_indices, plan.positions)).run()
+    assert images == [None] * 3 and sink.written == 3
+    group = zarr.open_group(str(path), mode='r')
+    stored = group['images'][:, :, 0]
+    assert stored[0, 1].max() == 0 and stored[0, 2].max() > 0  # empty tile (0, 1) is not printed
+    centres = [np.argwhere(stored[row, col] > 500).mean(axis=0) for row, col in [(0, 0), (0, 2), (1, 1)]]
+    assert centres[0][1] < centres[2][1] < centres[1][1] and centres[2][0] > centres[0][0]  # each tile its mask
+    np.testing.assert_array_equal(group['positions'][1, 1], (1000., 800., np.nan))
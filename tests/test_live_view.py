@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import pytest
+
+from utils.live_view import FrameRingBuffer
+
+
+def test_latest_frame_wins_and_skipped_frames_count_as_dropped():
+    buffer = FrameRingBuffer(4, 6, slots=3)
+    assert buffer.latest() is None
+    for value in range(1, 6):
+        buffer.put(np.full(24, value, dtype=np.uint16))  # flat, as from the camera
+    frame = buffer.latest()
+    assert frame.shape == (4, 6) and (frame == 5).all()
+    assert buffer.dropped == 4 and buffer.latest() is None
+    buffer.put(np.full((4, 6), 6))
+    assert (buffer.latest() == 6).all() and buffer.dropped == 4
+
+
+def test_latest_is_a_downsampled_copy():
+    buffer = FrameRingBuffer(8, 10, slots=2, downsample=3)
+    frame = np.arange(80, dtype=np.uint16).reshape(8, 10)
+    buffer.put(frame)
+    latest = buffer.latest()
+    np.testing.assert_array_equal(latest, frame[::3, ::3])
+    buffer.put(np.zeros_like(frame))
+    buffer.put(np.zeros_like(frame))  # overwrites the slot the copy came from
+    np.testing.assert_array_equal(latest, frame[::3, ::3])
+
+
+def test_wrong_frame_sizes_and_slots_raise():
+    with pytest.raises(ValueError):
+        FrameRingBuffer(4, 4, slots=1)
+    with pytest.raises(ValueError):
+        FrameRingBuffer(4, 4).put(np.zeros(15))
+
+
+def test_concurrent_writer_and_reader():
+    buffer = FrameRingBuffer(16, 16, slots=4)
+    n_frames = 2000
+    shown = []
+
+    def write():
+        for value in range(1, n_frames + 1):
+            buffer.put(np.full((16, 16), value, dtype=np.uint16))
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    while writer.is_alive() or not shown or shown[-1] != n_frames:
+        frame = buffer.latest()
+        if frame is not None:
+            shown.append(int(frame[0, 0]))
+    writer.join()
+    assert shown == sorted(shown) and len(set(shown)) == len(shown)  # never goes back in time
+    assert buffer.dropped == n_frames - len(shown)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import tifffile
+
+from utils.mask_handler import LazyMask, tile_array
+
+
+def _design(height=1000, width=1700):
+    design = np.zeros((height, width), dtype=np.uint8)
+    design[100:300, 200:900] = 255
+    design[700:, 1650:] = 255  # in the partial tiles at the right and bottom edge
+    return design
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_tiles_match_tile_array(tmp_path, compression):
+    design = _design()
+    path = tmp_path / 'design.tif'
+    tifffile.imwrite(path, design, compression=compression, tile=(256, 256) if compression else None)
+    mask = LazyMask(str(path), tile_width=800, tile_height=600)
+    assert (mask.grid_height, mask.grid_width) == (2, 3)
+    expected, grid_width, grid_height = tile_array(design, 800, 600, pad=True)
+    assert (grid_height, grid_width) == (2, 3)
+    tiles = mask.tiles()
+    for row in range(2):
+        for col in range(3):
+            np.testing.assert_array_equal(tiles[row][col], expected[row][col])
+
+
+def test_summary_counts_the_pixels_the_dmd_switches_on(tmp_path):
+    design = _design().astype(np.float32) / 255
+    design[0:10, 1000:1100] = 0.3  # below the upload threshold, the tile prints nothing
+    path = tmp_path / 'design.tif'
+    tifffile.imwrite(path, design)
+    mask = LazyMask(str(path), tile_width=800, tile_height=600)
+    counts = mask.pixel_counts()
+    assert counts[0, 0] == 200 * 600 and counts[0, 1] == 200 * 100
+    assert counts[1, 2] == 300 * 50 and counts.sum() == (design >= 0.5).sum()
+    empty = {(s.row, s.col) for s in mask.iter_summary() if s.empty}
+    assert empty == {(0, 2), (1, 0), (1, 1)}
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from manager.stage import position_table
+from utils.mosaic import MosaicBuilder
+
+
+def test_pyramid_levels():
+    mosaic = MosaicBuilder((0., 0., 8000., 3000.), pixel_size=0.5, downsample=2)
+    assert mosaic.pyramid[0].shape == (3000, 8000)
+    assert [level.shape for level in mosaic.pyramid[1:]] == [(1500, 4000), (750, 2000), (375, 1000)]
+    assert mosaic.scales == [1., 2., 4., 8.]
+    assert len(MosaicBuilder((0., 0., 100., 100.), 1., levels=2).pyramid) == 2
+    with pytest.raises(ValueError):
+        MosaicBuilder((0., 0., 0., 100.), 1.)
+
+
+def test_tiles_land_at_their_stage_positions():
+    positions = position_table.from_arrays([0., 256., 0.], [0., 0., 128.])
+    mosaic = MosaicBuilder.from_positions(positions, (128, 256), pixel_size=1., downsample=2, levels=3)
+    assert mosaic.extent == (-128., -64., 384., 192.)
+    add = mosaic.on_image(positions)
+    for index in range(3):
+        assert add(index, np.full((128, 256), index + 1, dtype=np.uint16)) is None
+    assert mosaic.tiles == 3 and mosaic.version == 3
+    expected = np.zeros((128, 256), dtype=np.uint16)
+    expected[:64, :128], expected[:64, 128:], expected[64:, :128] = 1, 2, 3
+    np.testing.assert_array_equal(mosaic.pyramid[0], expected)
+    np.testing.assert_array_equal(mosaic.pyramid[2], expected[::4, ::4])
+
+
+def test_tiles_are_downsampled_by_area():
+    mosaic = MosaicBuilder((0., 0., 64., 64.), pixel_size=1., downsample=4, levels=2)
+    frame = np.zeros((64, 64), dtype=np.uint16)
+    frame[::2] = 1000  # striped, every other row
+    mosaic.add(frame, 32., 32.)
+    assert (mosaic.pyramid[0] == 500).all() and (mosaic.pyramid[1] == 500).all()
+
+
+def test_flips_and_clipping():
+    frame = np.zeros((10, 20), dtype=np.uint16)
+    frame[0, 0] = 7
+    mosaic = MosaicBuilder((0., 0., 20., 10.), pixel_size=1., downsample=1, levels=1, flip_x=True, flip_y=True)
+    mosaic.add(frame, 10., 5.)
+    assert mosaic.pyramid[0][-1, -1] == 7 and mosaic.pyramid[0].sum() == 7
+    mosaic = MosaicBuilder((0., 0., 20., 10.), pixel_size=1., downsample=1, levels=1)
+    mosaic.add(np.ones((10, 20), dtype=np.uint16), 25., 5.)  # half outside
+    assert mosaic.pyramid[0][:, :15].sum() == 0 and (mosaic.pyramid[0][:, 15:] == 1).all()
+
+
+def test_on_image_passes_images_on():
+    positions = position_table.from_arrays([0.], [0.])
+    mosaic = MosaicBuilder.from_positions(positions, (8, 8), pixel_size=1., downsample=1)
+    seen = []
+    add = mosaic.on_image(positions, then=lambda index, img: seen.append(index) or 'written')
+    assert add(0, np.ones((8, 8), dtype=np.uint16)) == 'written' and seen == [0]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from utils.overlap_tiler import OverlapTiler, bayer_matrix
+
+
+def _exposures(tiler):
+    """How often every design pixel is exposed (or its summed dose), from all tiles placed at their offsets."""
+    height = (tiler.grid_height - 1) * tiler.step[1] + tiler.tile_height
+    width = (tiler.grid_width - 1) * tiler.step[0] + tiler.tile_width
+    total = np.zeros((height, width))
+    indices = [(row, col) for row in range(tiler.grid_height) for col in range(tiler.grid_width)]
+    for (row, col), tile in zip(indices, tiler.tiles_batch(indices)):
+        top, left = row * tiler.step[1], col * tiler.step[0]
+        total[top:top + tiler.tile_height, left:left + tiler.tile_width] += tile
+    return total[:tiler.height, :tiler.width]
+
+
+def test_bayer_matrix_has_every_threshold_once():
+    matrix = bayer_matrix(3)
+    assert matrix.shape == (8, 8)
+    np.testing.assert_allclose(np.sort(matrix.ravel()), (np.arange(64) + 0.5) / 64)
+
+
+def test_grid_covers_the_design():
+    tiler = OverlapTiler(np.ones((1000, 1700)), 800, 600, overlap=(40, 30), pixel_size=2.)
+    assert (tiler.grid_height, tiler.grid_width) == (2, 3)
+    assert tiler.stage_offsets == (1520., 1140.)
+
+
+@pytest.mark.parametrize('overlap', [(40, 30), (37, 0), (0, 0)])
+def test_dithering_exposes_every_pixel_exactly_once(overlap):
+    tiler = OverlapTiler(np.ones((1000, 1700), dtype=np.uint8), 200, 150, overlap=overlap)
+    assert tiler.grid_height * tiler.grid_width > 4
+    np.testing.assert_array_equal(_exposures(tiler), 1)
+
+
+def test_dithering_keeps_the_design():
+    rng = np.random.default_rng(0)
+    design = rng.random((500, 700)) < 0.3
+    tiler = OverlapTiler(design, 200, 150, overlap=(40, 30))
+    np.testing.assert_array_equal(_exposures(tiler), design)
+
+
+def test_weights_sum_to_one_and_no_blending_exposes_overlaps_twice():
+    design = np.ones((500, 700), dtype=np.uint8)
+    np.testing.assert_allclose(_exposures(OverlapTiler(design, 200, 150, overlap=(40, 30), blend='weights')), 1)
+    doubled = _exposures(OverlapTiler(design, 200, 150, overlap=(40, 30), blend='none'))
+    assert doubled[:, 160:200].min() == 2 and doubled[140:150, 160:200].max() == 4
+
+
+def test_stage_correction_rotates_the_tiles():
+    design = np.zeros((600, 800), dtype=np.uint8)
+    design[:, 390:410] = 1  # vertical bar through the tile center
+    aligned = OverlapTiler(design, 800, 600, overlap=(0, 0), pixel_size=1., stage_to_dmd=np.eye(2))
+    assert aligned.correction is None
+    angle = np.deg2rad(5)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    tile = OverlapTiler(design, 800, 600, overlap=(0, 0), pixel_size=1., stage_to_dmd=rotation).tile(0, 0)
+    centre_top, centre_bottom = (np.flatnonzero(tile[y]).mean() for y in (100, 500))
+    assert abs(centre_top - centre_bottom - 400 * np.tan(angle)) < 3
+    assert tile[300, 395:405].all()  # the center stays in place
+
+
+def test_invalid_arguments_raise():
+    with pytest.raises(ValueError):
+        OverlapTiler(np.ones((10, 10)), 100, 100, overlap=(60, 0))
+    with pytest.raises(ValueError):
+        OverlapTiler(np.ones((10, 10)), blend='average')
+    with pytest.raises(ValueError):
+        OverlapTiler(np.ones((10, 10)), stage_to_dmd=np.eye(2))
+    with pytest.raises(IndexError):
+        OverlapTiler(np.ones((10, 10))).tile(1, 0)
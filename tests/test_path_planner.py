@@ -0,0 +1,73 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from manager.path_planner import _step_lengths, plan_path, serpentine_order, tile_coordinates, two_opt
+
+
+def _grid(grid_height, grid_width, filled=None):
+    tiles = [[np.zeros((4, 4), dtype=bool) for _ in range(grid_width)] for _ in range(grid_height)]
+    for row, col in (filled if filled is not None else itertools.product(range(grid_height), range(grid_width))):
+        tiles[row][col][0, 0] = True
+    return tiles
+
+
+def _length(xy, order, start):
+    return _step_lengths(np.vstack([start, xy[order]])).sum()
+
+
+def test_tile_coordinates_skip_empty_tiles():
+    tiles = _grid(2, 3, filled=[(0, 0), (1, 2)])
+    indices, xy = tile_coordinates(tiles, 100., 50., x_start=10., y_start=20.)
+    np.testing.assert_array_equal(indices, [(0, 0), (1, 2)])
+    np.testing.assert_array_equal(xy, [(10., 20.), (210., 70.)])
+    assert len(tile_coordinates(tiles, 100., 50., skip_empty=False)[0]) == 6
+
+
+def test_serpentine_walks_every_second_column_backwards():
+    indices, _ = tile_coordinates(_grid(3, 3), 1., 1.)
+    order = serpentine_order(indices)
+    assert [tuple(indices[i]) for i in order] == [(0, 0), (1, 0), (2, 0), (2, 1), (1, 1), (0, 1),
+                                                 (0, 2), (1, 2), (2, 2)]
+
+
+def test_two_opt_removes_back_and_forth_moves():
+    xy = np.array([(0., 0.), (30., 0.), (10., 0.), (20., 0.)])
+    start = np.array([0., 0.])
+    crossing = np.array([0, 1, 2, 3])
+    order = two_opt(xy, crossing, start)
+    assert sorted(order) == [0, 1, 2, 3]
+    best = min(_length(xy, list(p), start) for p in itertools.permutations(range(4)))
+    assert _length(xy, order, start) == best < _length(xy, crossing, start)
+
+
+def test_two_opt_is_optimal_on_small_random_sets():
+    rng = np.random.default_rng(0)
+    start = np.zeros(2)
+    for _ in range(5):
+        xy = rng.uniform(0, 1000, size=(6, 2))
+        order = two_opt(xy, np.arange(6), start)
+        best = min(_length(xy, list(p), start) for p in itertools.permutations(range(6)))
+        assert _length(xy, order, start) <= 1.2 * best
+
+
+def test_plan_path_visits_every_filled_tile_once():
+    rng = np.random.default_rng(1)
+    filled = [(row, col) for row in range(8) for col in range(8) if rng.random() < 0.3]
+    tiles = _grid(8, 8, filled)
+    for method in ('serpentine', 'nearest', 'auto'):
+        plan = plan_path(tiles, 800., 600., x_start=-100., y_start=50., z=12., method=method)
+        assert sorted(plan.tile_indices) == sorted(filled) and len(plan) == len(filled)
+        for (row, col), position in zip(plan.tile_indices, plan.positions):
+            assert (position.x, position.y, position.z) == (-100. + col * 800., 50. + row * 600., 12.)
+        assert plan.select(tiles)[0] is tiles[plan.tile_indices[0][0]][plan.tile_indices[0][1]]
+    serpentine = plan_path(tiles, 800., 600., method='serpentine')
+    auto = plan_path(tiles, 800., 600., method='auto')
+    assert auto.distance <= serpentine.distance
+    assert auto.time == pytest.approx(auto.distance / 5000. + 0.1 * len(auto))
+
+
+def test_plan_path_rejects_unknown_methods():
+    with pytest.raises(ValueError):
+        plan_path(_grid(2, 2), 1., 1., method='random')
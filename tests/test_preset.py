@@ -0,0 +1,75 @@
+import gc
+import weakref
+
+from manager.dmd import dmd
+from manager.preset import preset, set_property, state_cache, unwrap_core
+from manager.simulation import simulated_core
+from manager.trace import traced_core
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def test_traced_core_shares_the_state_cache():
+    core = simulated_core(latencies=NO_LATENCY)
+    traced = traced_core(core)
+    assert unwrap_core(traced_core(traced)) is core
+    assert state_cache(traced) is state_cache(core)
+
+    set_property(core, 'Wheel-C', 'State', 1)
+    set_property(traced, 'Wheel-C', 'State', 2)  # must not leave the raw core's cache stale
+    channel = preset(core, [['Wheel-C', 'State', 1]], skip_applied=True)
+    channel.apply()
+    assert core.get_property('Wheel-C', 'State') == 1
+
+
+def test_unwrap_does_not_follow_forwarded_attributes():
+    class forwarding:
+        def __init__(self, core):
+            self.core = core
+
+        def __getattr__(self, name):
+            return getattr(self.core, name)
+
+    core = simulated_core(latencies=NO_LATENCY)
+    core.wrapped = 'not a core'
+    wrapper = forwarding(core)
+    assert unwrap_core(core) is core and unwrap_core(wrapper) is wrapper
+
+
+def test_state_cache_does_not_keep_the_core_alive():
+    core = simulated_core(latencies=NO_LATENCY)
+    state_cache(core).update('Wheel-C', 'State', 1)
+    ref = weakref.ref(core)
+    del core
+    gc.collect()
+    assert ref() is None
+
+
+def test_writes_are_not_skipped_by_default():
+    core = simulated_core(latencies=NO_LATENCY)
+    channel = preset(core, [['Wheel-C', 'State', 1]])
+    channel.apply()
+    core.set_property('Wheel-C', 'State', 3)  # e.g. from the micro-manager GUI, the cache doesn't see it
+    channel.apply()
+    assert core.get_property('Wheel-C', 'State') == 1
+
+
+def test_skip_applied():
+    core = simulated_core(latencies=NO_LATENCY)
+    channel = preset(core, [['Wheel-C', 'State', 1], ['Spectra RIGHT', 'Violet_Level', 100]], skip_applied=True)
+    channel.apply()
+    core.reset_stats()
+    channel.apply()
+    assert core.call_count == 0
+    channel.apply(force=True)
+    assert core.call_count > 0
+
+
+def test_dmd_writes_go_through_the_state_cache():
+    core = simulated_core(latencies=NO_LATENCY)
+    device = dmd(core)
+    overlap = preset(core, [[device.name, 'OverlapMode', 'On']], skip_applied=True)
+    overlap.apply()
+    device.all_off()
+    overlap.apply()
+    assert core.get_property(device.name, 'OverlapMode') == 'On'
@@ -0,0 +1,176 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from manager.benchmark import _setup
+from manager.print_job import print_job
+from manager.simulation import simulated_core
+from manager.stage import stage_position
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def _job(n_tiles, **kwargs):
+    core, device, channel = _setup(NO_LATENCY)
+    tiles = [np.ones((device.height, device.width), dtype=bool) for _ in range(n_tiles)]
+    positions = [stage_position(100. * i, 0., None) for i in range(n_tiles)]
+    return core, print_job(device, channel, tiles, positions, **kwargs)
+
+
+def _run_bounded(job, timeout=10.):
+    '''Runs the job on a thread, returns its result or the exception it raised. Fails if it doesn't finish.'''
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = job.run()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'print_job.run() did not finish'
+    return outcome
+
+
+def test_core_failure_raises_instead_of_hanging():
+    core, job = _job(10)
+
+    def failing_snap():
+        time.sleep(0.05)  # the next tiles take the released upload buffer meanwhile
+        raise RuntimeError('camera failed')
+
+    core.snap_image = failing_snap
+    outcome = _run_bounded(job)
+    assert isinstance(outcome.get('error'), RuntimeError)
+    assert 'camera failed' in str(outcome['error'])
+
+
+def _pattern_tiles(device, n_tiles, seed=0):
+    rng = np.random.default_rng(seed)
+    tiles = []
+    for _ in range(n_tiles):
+        tile = np.zeros((device.height, device.width), dtype=bool)
+        top, left = rng.integers(50, device.height - 250), rng.integers(50, device.width - 250)
+        tile[top:top + 200, left:left + 200] = True
+        tiles.append(tile)
+    return tiles
+
+
+def test_prints_all_tiles_in_order():
+    core, device, channel = _setup(NO_LATENCY)
+    tiles = _pattern_tiles(device, 6)
+    positions = [stage_position(100. * i, 10. * i, None) for i in range(6)]
+    visited = []
+    move = core.set_xy_position
+    core.set_xy_position = lambda *args: (visited.append(args[-2:]), move(*args))
+    done = []
+    results = print_job(device, channel, tiles, positions, on_image=lambda i, img: (i, img.max())).run(done.append)
+    assert [index for index, _ in results] == list(range(6))
+    assert all(peak > core.background + core.brightness / 2 for _, peak in results)
+    assert visited == [(p.x, p.y) for p in positions]
+    assert sorted(done) == list(range(6))
+
+
+def test_empty_tiles_are_skipped():
+    core, device, channel = _setup(NO_LATENCY)
+    tiles = _pattern_tiles(device, 5)
+    empty = [False, True, False, True, False]
+    job = print_job(device, channel, tiles, [stage_position(i, 0., None) for i in range(5)], empty=empty)
+    results = job.run()
+    assert [r is None for r in results] == empty
+    stats = job.stats()
+    assert stats['tiles'] == 3 and stats['skipped'] == 2 and stats['reexposed'] == 0
+    assert stats['tiles_per_minute'] > 0
+    assert {'prepare', 'move', 'expose'} <= set(stats)
+
+
+def test_tiles_from_a_tile_store():
+    from utils.tile_store import TileStore
+    core, device, channel = _setup(NO_LATENCY)
+    pattern = _pattern_tiles(device, 2)
+    grid = [[pattern[0], pattern[1], pattern[0]], [np.zeros_like(pattern[0]), pattern[1], pattern[0]]]
+    store = TileStore.from_tiles(grid, cache_size=2)
+    tiles, keys, empty = store.select([(row, col) for row in range(2) for col in range(3)])
+    results = print_job(device, channel, tiles, [stage_position(i, 0., None) for i in range(6)],
+                        keys=keys, empty=empty).run()
+    assert [r is None for r in results] == empty
+    assert len(store._cache) <= 2
+
+
+def test_focus_moves_with_the_stage():
+    core, device, channel = _setup(NO_LATENCY)
+    positions = [stage_position(100. * i, 0., 5. + i) for i in range(3)]
+    focus = []
+    set_position = core.set_position
+    core.set_position = lambda *args: (focus.append(args[-1]), set_position(*args))
+    print_job(device, channel, _pattern_tiles(device, 3), positions, focus='z').run()
+    assert focus == [5., 6., 7.]
+
+
+def test_failed_tiles_are_reexposed():
+    from manager.verification import print_verifier
+    core, device, channel = _setup(NO_LATENCY)
+    tiles = _pattern_tiles(device, 6)
+    displayed = []
+    display = device.display_buffer
+
+    def corrupt_second_tile(buffer):
+        displayed.append(buffer)
+        if len(displayed) == 2:
+            buffer = np.zeros_like(buffer)  # nothing printed
+        return display(buffer)
+
+    device.display_buffer = corrupt_second_tile
+    verifier = print_verifier(core.true_calibration(), (device.height, device.width),
+                              (core.camera_height, core.camera_width))
+    job = print_job(device, channel, tiles, [stage_position(i, 0., None) for i in range(6)],
+                    on_image=lambda i, img: None, verifier=verifier)
+    job.run()
+    assert job.reexposed == [[1]]
+    assert verifier.failed == []
+    assert job.stats()['reexposed'] == 1
+    verifier.close()
+
+
+def test_verifier_is_reset_between_jobs():
+    from manager.verification import print_verifier
+    core, device, channel = _setup(NO_LATENCY)
+    verifier = print_verifier(core.true_calibration(), (device.height, device.width),
+                              (core.camera_height, core.camera_width))
+    verifier.results[7] = {'ok': False}  # from an earlier, longer job
+    job = print_job(device, channel, _pattern_tiles(device, 3), [stage_position(i, 0., None) for i in range(3)],
+                    verifier=verifier)
+    job.run()
+    assert job.reexposed == []
+    verifier.close()
+
+
+def test_run_pass_without_run():
+    core, device, channel = _setup(NO_LATENCY)
+    job = print_job(device, channel, _pattern_tiles(device, 2), [stage_position(i, 0., None) for i in range(2)])
+    job.timings = [None] * 2
+    results = job._run_pass([0, 1], None)
+    assert len(results) == 2 and all(img.shape == (core.camera_height, core.camera_width) for img in results)
+
+
+def test_image_handling_overlaps_the_hardware():
+    n_tiles = 6
+    handling = 0.05
+
+    def save(index, img):
+        time.sleep(handling)  # e.g. writing the image to disk
+        return index
+
+    total = {}
+    for name, on_image in (('hardware', None), ('saving', save)):
+        core, device, channel = _setup(dict(NO_LATENCY, snap=0.05))
+        job = print_job(device, channel, _pattern_tiles(device, n_tiles),
+                        [stage_position(i, 0., None) for i in range(n_tiles)], on_image=on_image)
+        job.run()
+        total[name] = job.total_time
+    # serially, saving would add n_tiles * handling
+    assert total['saving'] < total['hardware'] + 0.5 * n_tiles * handling
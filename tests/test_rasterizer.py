@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from utils.rasterizer import Shape, VectorMask, _path_rings, read_svg
+
+
+def _rect(x, y, w, h):
+    return Shape("polygon", [np.array([(x, y), (x + w, y), (x + w, y + h), (x, y + h)], dtype=float)])
+
+
+def _mosaic(mask):
+    return np.block([[mask.tile(row, col) for col in range(mask.grid_width)] for row in range(mask.grid_height)])
+
+
+def test_rectangle_size():
+    mask = VectorMask([_rect(0, 0, 1000, 500)], pixel_size=1.0, tile_width=1200, tile_height=600)
+    tile = mask.tile(0, 0)
+    assert (mask.width, mask.height) == (1000, 500)
+    assert tile.sum() == 1000 * 500 and tile[:500, :1000].all()
+
+
+def test_touching_shapes_do_not_overlap():
+    shapes = [_rect(0, 0, 100, 100), _rect(100, 0, 100, 100), _rect(0, 100, 200, 50)]
+    mask = VectorMask(shapes, pixel_size=2.0, tile_width=64, tile_height=32)  # shapes cross tile borders
+    tiles = _mosaic(mask)
+    counts = [_mosaic(VectorMask([shape], 2.0, 64, 32, origin=mask.origin))[:100, :100].sum() for shape in shapes]
+    assert counts == [50 * 50, 50 * 50, 100 * 25]
+    assert tiles.sum() == sum(counts)
+
+
+def test_holes_and_circles():
+    outer = np.array([(0, 0), (40, 0), (40, 40), (0, 40)], dtype=float)
+    inner = np.array([(10, 10), (30, 10), (30, 30), (10, 30)], dtype=float)
+    tile = VectorMask([Shape("polygon", [outer, inner])], 1.0, 64, 64).tile(0, 0)
+    assert tile.sum() == 40 * 40 - 20 * 20 and not tile[10:30, 10:30].any()
+    circle = Shape("circle", [np.array([[50., 50.]])], radius=20.)
+    tile = VectorMask([circle], 1.0, 128, 128, origin=(0., 0.)).tile(0, 0)
+    assert abs(tile.sum() - np.pi * 20 ** 2) < 40
+    assert tile[50, 31] and not tile[50, 29]
+
+
+def test_svg_fill_none_is_an_outline(tmp_path):
+    path = tmp_path / "design.svg"
+    path.write_text(
+        '<svg xmlns="http://www.w3.org/2000/svg">'
+        '<rect x="0" y="0" width="100" height="100"/>'
+        '<rect x="200" y="0" width="100" height="100" style="fill:none;stroke:black;stroke-width:2"/>'
+        '<g fill="none" stroke-width="4"><circle cx="450" cy="50" r="40"/></g>'
+        '<rect x="600" y="0" width="100" height="100" style="fill: none; stroke: none"/>'
+        '</svg>')
+    shapes = read_svg(str(path))
+    assert [shape.kind for shape in shapes] == ["polygon", "path", "path"]
+    assert shapes[1].width == 2 and shapes[2].width == 4
+    np.testing.assert_array_equal(shapes[1].rings[0][0], shapes[1].rings[0][-1])  # closed outline
+    mask = VectorMask(shapes, 1.0, 512, 128, origin=(0., 0.))
+    tile = mask.tile(0, 0)
+    assert tile[50, 50] and not tile[50, 250] and tile[0, 250] and not tile[50, 450]
+
+
+def test_svg_smooth_curves_and_arcs():
+    (cubic,), _ = _path_rings("M0 0 C0 10 10 10 10 0 S 20 -10 20 0")
+    (explicit,), _ = _path_rings("M0 0 C0 10 10 10 10 0 C 10 -10 20 -10 20 0")
+    np.testing.assert_allclose(cubic, explicit)
+    (quadratic,), _ = _path_rings("M0 0 Q5 10 10 0 T20 0")
+    (explicit,), _ = _path_rings("M0 0 Q5 10 10 0 Q15 -10 20 0")
+    np.testing.assert_allclose(quadratic, explicit)
+
+    (arc,), _ = _path_rings("M0 0 A10 10 0 0 1 20 0")
+    np.testing.assert_allclose(arc[-1], (20, 0))
+    np.testing.assert_allclose(np.hypot(arc[:, 0] - 10, arc[:, 1]), 10, atol=1e-9)
+    assert arc[:, 1].min() < -9.9  # sweep 1 goes through negative y
+    (large,), _ = _path_rings("m0 0 a15 15 0 1 0 0 20")
+    (small,), _ = _path_rings("m0 0 a15 15 0 0 0 0 20")
+    assert np.ptp(large[:, 0]) > 25 and np.ptp(small[:, 0]) < 5
+
+
+def test_svg_bad_arc_flags_raise():
+    with pytest.raises(ValueError):
+        _path_rings("M0 0 A10 10 0 2 1 20 0")
+    with pytest.raises(ValueError):
+        _path_rings("M0 0 A10 10 0 1")
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from manager.benchmark import _setup
+from manager.print_job import print_job
+from manager.simulation import simulated_core
+from manager.stage import load_pos_file, move_to, parse_pos, position_table, stage_position
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def test_z_moves_switch_the_pfs_off():
+    core = simulated_core(latencies=NO_LATENCY)
+    core.enable_continuous_focus(True)
+    move_to(core, stage_position(10., 20., 5.))  # focus left to the PFS
+    assert core.is_continuous_focus_enabled() and core.z != 5.
+    move_to(core, stage_position(10., 20., 5.), focus='z')
+    assert not core.is_continuous_focus_enabled() and core.z == 5.
+
+
+def test_print_job_restores_the_pfs():
+    core, device, channel = _setup(NO_LATENCY)
+    core.enable_continuous_focus(True)
+    tiles = [device.prepare_mask(device.mask_buffer).reshape(device.height, device.width)] * 2
+    positions = [stage_position(0., 0., 3.), stage_position(100., 0., 4.)]
+    print_job(device, channel, tiles, positions, focus='z').run()
+    assert core.z == 4. and core.is_continuous_focus_enabled()
+
+
+MM14_POS = '''{"VERSION": 3, "ID": "Micro-Manager XY-position list", "POSITIONS": [
+ {"GRID_COLUMN": 0, "DEVICES": [
+   {"DEVICE": "TIZDrive", "AXES": 1, "Y": 0, "X": 1502.5, "Z": 0},
+   {"DEVICE": "TIPFSOffset", "AXES": 1, "Y": 0, "X": 120.0, "Z": 0},
+   {"DEVICE": "XYStage", "AXES": 2, "Y": 678.0, "X": -1234.5, "Z": 0}],
+  "PROPERTIES": {}, "DEFAULT_Z_STAGE": "TIZDrive", "LABEL": "Pos0", "GRID_ROW": 0, "DEFAULT_XY_STAGE": "XYStage"},
+ {"GRID_COLUMN": 0, "DEVICES": [
+   {"DEVICE": "XYStage", "AXES": 2, "Y": 700.0, "X": -1000.0, "Z": 0}],
+  "PROPERTIES": {}, "DEFAULT_Z_STAGE": "TIZDrive", "LABEL": "well B2", "GRID_ROW": 0, "DEFAULT_XY_STAGE": "XYStage"}]}
+'''
+
+MM20_POS = '''{"encoding": "UTF-8", "format": "Micro-Manager Property Map", "major_version": 2, "minor_version": 0,
+ "map": {"StagePositions": {"type": "PROPERTY_MAP", "array": [
+  {"DefaultXYStage": {"type": "STRING", "scalar": "XYStage"},
+   "DefaultZStage": {"type": "STRING", "scalar": "TIZDrive"},
+   "DevicePositions": {"type": "PROPERTY_MAP", "array": [
+     {"Device": {"type": "STRING", "scalar": "TIZDrive"}, "Position_um": {"type": "DOUBLE", "array": [1502.5]}},
+     {"Device": {"type": "STRING", "scalar": "TIPFSOffset"}, "Position_um": {"type": "DOUBLE", "array": [120.0]}},
+     {"Device": {"type": "STRING", "scalar": "XYStage"}, "Position_um": {"type": "DOUBLE", "array": [-1234.5, 678.0]}}]},
+   "GridCol": {"type": "INTEGER", "scalar": 0}, "GridRow": {"type": "INTEGER", "scalar": 0},
+   "Label": {"type": "STRING", "scalar": "Pos0"}},
+  {"DefaultXYStage": {"type": "STRING", "scalar": "XYStage"},
+   "DefaultZStage": {"type": "STRING", "scalar": "TIZDrive"},
+   "DevicePositions": {"type": "PROPERTY_MAP", "array": [
+     {"Device": {"type": "STRING", "scalar": "XYStage"}, "Position_um": {"type": "DOUBLE", "array": [-1000.0, 700.0]}}]},
+   "GridCol": {"type": "INTEGER", "scalar": 0}, "GridRow": {"type": "INTEGER", "scalar": 0},
+   "Label": {"type": "STRING", "scalar": "well B2"}}]}}}
+'''
+
+
+@pytest.mark.parametrize('text', [MM14_POS, MM20_POS], ids=['1.4', '2.0'])
+def test_parse_pos(tmp_path, text):
+    table = parse_pos(text)
+    assert len(table) == 2 and list(table.labels) == ['Pos0', 'well B2']
+    np.testing.assert_array_equal(table.xy, [(-1234.5, 678.), (-1000., 700.)])
+    assert table.z[0] == 1502.5 and table.pfs_offset[0] == 120. and np.isnan(table.z[1])
+    path = tmp_path / 'positions.pos'
+    path.write_text(text)
+    loaded = load_pos_file(str(path))
+    for field in ('xy', 'z', 'pfs_offset', 'labels'):
+        np.testing.assert_array_equal(getattr(loaded, field), getattr(table, field))
+    first, second = table.to_stage_positions()
+    assert (first.x, first.y, first.z) == (-1234.5, 678., 1502.5) and second.z is None
+
+
+def test_parse_pos_rejects_other_json():
+    with pytest.raises(ValueError):
+        parse_pos('{"positions": []}')
+
+
+def test_position_table_append_and_index():
+    table = position_table()
+    for i in range(40):  # grows the buffer twice
+        table.append(i, -i, z=None if i % 2 else 0.5 * i)
+    assert len(table) == 40 and table[3].x == 3. and np.isnan(table[3].z) and table[-1].label == 'Pos39'
+    assert len(table[10:20]) == 10 and list(table[10:20].x) == list(range(10, 20))
+    with pytest.raises(IndexError):
+        table[40]
+    core = simulated_core(latencies=NO_LATENCY)
+    move_to(core, table[4], focus='z')
+    assert (core.x, core.y, core.z) == (4., -4., 2.)
+    assert [p.x for p in table][:3] == [0., 1., 2.]
+
+
+def test_position_table_transforms():
+    table = position_table.from_arrays([0., 10., 10., 0.], [0., 0., 10., 10.], z=1.)
+    np.testing.assert_allclose(table.offset(5., -5., 1.).xy, table.xy + (5., -5.))
+    assert (table.offset(dz=1.).z == 2.).all() and (table.z == 1.).all()  # new table, unchanged original
+    np.testing.assert_allclose(table.scale(2.).xy, [(-5., -5.), (15., -5.), (15., 15.), (-5., 15.)])
+    np.testing.assert_allclose(table.rotate(90., center=(0., 0.)).xy, [(0., 0.), (0., 10.), (-10., 10.), (-10., 0.)],
+                               atol=1e-12)
+    np.testing.assert_allclose(table.transform([[1., 0., 3.], [0., 1., 4.]]).xy, table.xy + (3., 4.))
+    assert list(table.rotate(30.).labels) == list(table.labels)
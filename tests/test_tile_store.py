@@ -0,0 +1,48 @@
+import numpy as np
+
+from utils.tile_store import TileStore
+
+
+def _store(cache_size=2):
+    rng = np.random.default_rng(0)
+    tiles = [[(rng.random((8, 16)) > 0.5).astype(np.uint8) for _ in range(4)] for _ in range(3)]
+    tiles[1][1] = tiles[0][0].copy()
+    tiles[2][3] = np.zeros((8, 16), dtype=np.uint8)
+    return tiles, TileStore.from_tiles(tiles, cache_size=cache_size)
+
+
+def test_select_unpacks_lazily():
+    tiles, store = _store()
+    indices = [(row, col) for row in range(3) for col in range(4)]
+    selected, keys, empty = store.select(indices)
+    assert len(store._cache) == 0
+    assert len(selected) == len(indices)
+    for i, (row, col) in enumerate(indices):
+        np.testing.assert_array_equal(selected[i], tiles[row][col])
+        assert len(store._cache) <= store.cache_size
+    assert keys[0] == keys[5]
+    assert empty == [i == 11 for i in range(12)]
+
+
+def test_save_load_without_suffix(tmp_path):
+    tiles, store = _store()
+    store.save(tmp_path / 'design')
+    loaded = TileStore.load(tmp_path / 'design')
+    assert (tmp_path / 'design.npz').exists()
+    np.testing.assert_array_equal(loaded.index, store.index)
+    np.testing.assert_array_equal(loaded.tile(2, 1), tiles[2][1])
+    loaded = TileStore.load(str(tmp_path / 'design.npz'))
+    np.testing.assert_array_equal(loaded.packed, store.packed)
+
+
+def test_tiles_are_binarised_like_the_upload():
+    from manager.benchmark import _setup
+    from manager.simulation import simulated_core
+    _, device, _ = _setup({kind: 0 for kind in simulated_core.default_latencies})
+    dim = np.full((device.height, device.width), 0.3)  # uploads dark
+    half = dim.copy()
+    half[:, :400] = 0.7
+    store = TileStore.from_tiles([[dim, half, np.zeros_like(dim)]])
+    assert store.is_empty(0, 0) and store.index[0, 0] == store.index[0, 2]
+    for col, tile in enumerate((dim, half)):
+        np.testing.assert_array_equal(store.tile(0, col), device.prepare_mask(tile).reshape(tile.shape))
@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+import pytest
+
+from manager.dmd import dmd
+from manager.simulation import simulated_core
+from manager.trace import span, trace_position, traced_core
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+
+
+def test_records_calls_and_spans():
+    core = traced_core(simulated_core(latencies=NO_LATENCY))
+    core.set_exposure(5)
+    with span(core, 'tile', row=1, col=2):
+        core.set_slm_image(core.get_slm_device(), np.zeros((core.slm_height, core.slm_width), dtype=np.uint8))
+    records = core.records()
+    assert [r['method'] for r in records] == ['set_exposure', 'tile', 'get_slm_device', 'set_slm_image']
+    assert records[3]['device'] == core.get_slm_device()
+    assert records[3]['args'][1] == f'ndarray({core.slm_height}, {core.slm_width})'  # arrays by shape only
+    assert records[1]['args'] == (('row', 1), ('col', 2)) and records[1]['category'] == 'span'
+    assert core.records(category='span') == [records[1]]
+
+
+def test_errors_and_since():
+    core = traced_core(simulated_core(latencies=NO_LATENCY))
+    core.set_exposure(5)
+    since = trace_position(core)
+    with pytest.raises(ValueError):
+        core.set_slm_image(core.slm_name, np.zeros((2, 2), dtype=np.uint8))  # wrong size
+    records = core.records(since)
+    assert len(records) == 1 and records[0]['error']
+    assert core.summary(since)[f'set_slm_image {core.slm_name}']['errors'] == 1
+    assert trace_position(simulated_core(latencies=NO_LATENCY)) is None
+
+
+def test_ring_buffer_overwrites_the_oldest_records():
+    core = traced_core(simulated_core(latencies=NO_LATENCY), capacity=4)
+    for exposure in range(10):
+        core.set_exposure(exposure)
+    assert core.dropped == 6 and len(core.records()) == 4
+    assert core.summary()['set_exposure']['calls'] == 4
+    assert len(core.histograms()['set_exposure'][1]) == 29
+    counts, _ = core.histograms(bins=[0, 1e4])['set_exposure']  # calls without latency are below the default bins
+    assert counts.sum() == 4
+
+
+def test_chrome_trace_export(tmp_path):
+    core = traced_core(simulated_core(latencies=NO_LATENCY))
+    device = dmd(core)
+    since = trace_position(core)
+    with span(core, 'tile', row=0, col=0):
+        device.all_on()
+    path = tmp_path / 'trace.json'
+    core.save_trace(str(path), since=since)
+    trace = json.loads(path.read_text())
+    events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    tile = next(e for e in events if e['name'] == 'tile')
+    assert tile['cat'] == 'span' and tile['args'] == {'row': 0, 'col': 0}
+    calls = [e for e in events if e['cat'] == 'core']
+    assert calls and all(tile['ts'] <= e['ts'] and e['ts'] + e['dur'] <= tile['ts'] + tile['dur'] for e in calls)
+    assert any(e['ph'] == 'M' and e['name'] == 'thread_name' for e in trace['traceEvents'])
@@ -0,0 +1,70 @@
+import numpy as np
+
+from manager.verification import print_verifier
+
+SHAPE = (256, 256)
+IDENTITY = np.float64([[1, 0, 0], [0, 1, 0]])
+
+
+def _image(mask, rng, lit=1100., background=100., noise=5.):
+    return np.where(mask, lit, background) + rng.normal(0, noise, SHAPE)
+
+
+def _verify(pairs, dark=True):
+    rng = np.random.default_rng(1)
+    dark = _image(np.zeros(SHAPE, dtype=bool), rng) if dark else None
+    verifier = print_verifier(IDENTITY, SHAPE, SHAPE, scale=0.5, batch_size=2, dark=dark)
+    for index, (mask, img) in enumerate(pairs):
+        verifier.submit(index, mask, img)
+    verifier.close()
+    return verifier.results
+
+
+def test_fully_lit_tile_passes():
+    rng = np.random.default_rng(0)
+    full = np.ones(SHAPE, dtype=bool)
+    results = _verify([(full, _image(full, rng))])
+    assert results[0]['ok']
+    assert results[0]['missing'] == 0
+
+
+def test_fully_lit_tile_with_missing_area_fails():
+    rng = np.random.default_rng(0)
+    full = np.ones(SHAPE, dtype=bool)
+    half = np.zeros(SHAPE, dtype=bool)
+    half[:, :128] = True
+    results = _verify([(half, _image(half, rng)), (full, _image(half, rng)), (full, _image(~full, rng))])
+    assert results[0]['ok']
+    assert not results[1]['ok'] and abs(results[1]['missing'] - 0.5) < 0.05
+    assert not results[2]['ok'] and results[2]['missing'] == 1
+
+
+def test_fully_lit_tile_without_background_is_not_flagged():
+    rng = np.random.default_rng(0)
+    full = np.ones(SHAPE, dtype=bool)
+    results = _verify([(full, _image(~full, rng))], dark=False)
+    assert np.isnan(results[0]['missing'])
+    assert results[0]['ok']
+
+
+def test_empty_tile():
+    rng = np.random.default_rng(0)
+    empty = np.zeros(SHAPE, dtype=bool)
+    stale = empty.copy()
+    stale[64:192, 64:192] = True  # e.g. the pattern of the previous tile still displayed
+    results = _verify([(empty, _image(empty, rng)), (empty, _image(stale, rng))])
+    assert results[0]['ok']
+    assert not results[1]['ok']
+
+
+def test_reset_forgets_earlier_failures():
+    rng = np.random.default_rng(0)
+    half = np.zeros(SHAPE, dtype=bool)
+    half[:, :128] = True
+    verifier = print_verifier(IDENTITY, SHAPE, SHAPE, scale=0.5)
+    verifier.submit(3, half, _image(~half, rng))
+    verifier.flush()
+    assert verifier.failed == [3]
+    verifier.reset()
+    assert verifier.failed == [] and verifier.results == {}
+    verifier.close()
@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+import pytest
+
+from manager.benchmark import _setup
+from manager.simulation import simulated_core
+from manager.warp import warp_map
+
+NO_LATENCY = {kind: 0 for kind in simulated_core.default_latencies}
+AFFINE = np.array([[0.55, 0.08, -30.], [-0.06, 0.6, 12.5]])
+HOMOGRAPHY = np.array([[0.55, 0.08, -30.], [-0.06, 0.6, 12.5], [2e-5, -1e-5, 1.]])
+
+
+def _inside(matrix, img, height=600, width=800):
+    '''dmd pixels that sample the camera image at least one pixel away from its border.'''
+    matrix = np.vstack([matrix, [0, 0, 1]]) if matrix.shape == (2, 3) else matrix
+    xs, ys = np.meshgrid(np.arange(width), np.arange(height))
+    src = np.linalg.inv(matrix) @ np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)])
+    x, y = (src[:2] / src[2]).reshape(2, height, width)
+    return (x >= 1) & (x <= img.shape[1] - 2) & (y >= 1) & (y <= img.shape[0] - 2)
+
+
+def _camera_image(dtype=np.uint16):
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.uniform(0, 4000, (1024, 1024)).astype(np.float32), (0, 0), 4)
+    return img.astype(dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.float32])
+def test_warp_matches_warp_affine(dtype):
+    img = _camera_image(dtype)
+    warped = warp_map(AFFINE, 600, 800).warp(img)
+    expected = cv2.warpAffine(img, AFFINE, (800, 600))
+    assert warped.shape == (600, 800) and warped.dtype == dtype
+    inside = _inside(AFFINE, img)
+    assert inside.mean() > 0.5 and not warped[~cv2.dilate(inside.astype(np.uint8), np.ones((5, 5)))
+                                              .astype(bool)].any()  # outside the camera image
+    # the remap tables are fixed point with 1/32 px, which changes the interpolated values slightly
+    assert np.abs(warped[inside].astype(float) - expected[inside]).max() < 0.01 * np.ptp(img)
+
+
+def test_warp_matches_warp_perspective():
+    img = _camera_image(np.float32)
+    warped = warp_map(HOMOGRAPHY, 600, 800).warp(img)
+    expected = cv2.warpPerspective(img, HOMOGRAPHY, (800, 600))
+    inside = _inside(HOMOGRAPHY, img)
+    assert inside.mean() > 0.5
+    assert np.abs(warped[inside] - expected[inside]).max() < 0.01 * np.ptp(img)
+
+
+def test_warp_mask_matches_nearest_warp_affine():
+    mask = np.zeros((1024, 1024), dtype=bool)
+    cv2.circle(mask.view(np.uint8), (500, 400), 150, 1, -1)
+    mask[700:900:4, 100:900] = True  # thin lines break with interpolation, not with nearest neighbour lookup
+    warped = warp_map(AFFINE, 600, 800).warp_mask(mask)
+    expected = cv2.warpAffine(mask.view(np.uint8), AFFINE, (800, 600), flags=cv2.INTER_NEAREST)
+    assert warped.dtype == np.uint8 and set(np.unique(warped)) == {0, 1}
+    assert np.count_nonzero(warped != expected) < 1e-3 * warped.size  # ties at half pixels may round differently
+
+
+def test_buffers_are_reused_unless_asked_not_to():
+    img = _camera_image()
+    warp = warp_map(AFFINE, 600, 800)
+    first = warp.warp(img)
+    assert warp.warp(img) is first
+    assert warp.warp(img, reuse=False) is not first
+    out = np.empty((600, 800), dtype=img.dtype)
+    assert warp.warp(img, out=out) is out
+
+
+def test_dmd_caches_warp_maps():
+    _, device, _ = _setup(NO_LATENCY)
+    img = _camera_image()
+    assert device.get_warp_map(AFFINE) is device.get_warp_map(AFFINE.copy())
+    transformed = device.transform_img(img, AFFINE)
+    assert transformed is not device.transform_img(img, AFFINE)  # callers may keep the result
+    for shift in range(10):
+        device.get_warp_map(AFFINE + [[0, 0, shift + 1], [0, 0, 0]])
+    assert len(device.warp_maps) == 8
@@ -1,72 +1,93 @@
-import numpy as np
 import napari
 from magicgui import magicgui
 from napari.qt import thread_worker
-import math
 import time
-from queue import Queue
-from dataclasses import dataclass
-from typing import List
-from threading import Lock
 from magicgui.widgets import Container
 
+from manager.command_queue import command_queue
+from manager.dmd import checker_board_pattern
+from manager.focus import autofocus, focus_score
+from manager.stage import position_table
+from .live_view import FrameRingBuffer
 
-@dataclass
-class StagePosition:
-    x: float
-    y: float
-    pfs_offset: float
+# priorities of commands on the hardware broker, lower runs first
+PRIORITY_USER = 0  # button presses and widget changes
+PRIORITY_FRAME = 10  # fetching live view frames
 
 
 class FabscopeUI:
-    def __init__(self, core, dmd, channels, sleep_time=0.1, clim=(0, 255)):
+    def __init__(self, core, dmd, channels, sleep_time=0.1, clim=(0, 255), downsample=1, buffer_slots=4,
+                 focus_metric="laplacian"):
         self.core = core
         self.dmd = dmd
         self.channels = channels
         self.sleep_time = sleep_time
         self.clim = clim
+        self.downsample = max(1, int(downsample))  # the live view shows every n-th camera pixel
+        self.buffer_slots = buffer_slots
 
-        self.zmq_lock = Lock()
+        # single owner thread for the core, all hardware access goes through it
+        self.broker = command_queue(name="hardware_broker")
         self.acq_running = False
-        self.img_queue = Queue()
-        self.position_list: List[StagePosition] = []
+        self.frames = None  # FrameRingBuffer, sized from the camera in start_acq
+        self.position_list = position_table()  # stored positions, with their pfs offsets
         self.threshold = 100
+        self.focus_metric = focus_metric  # 'laplacian' or 'brenner', see manager.focus.focus_score
+        self.focus = None  # focus score of the displayed frame
+        self.focus_max = None  # highest focus score since the acquisition started
 
         # Initialize viewer and data
-        self.checker_board = np.kron([[1, 0] * 20, [0, 1] * 20] * 20, np.ones((20, 20)))
+        self.checker_board = checker_board_pattern(800, 800)
         self.startup_screen = self.checker_board * 100
         self.data = self.startup_screen
         self.viewer = None
         self.layers = None
 
+    def _grab_frame(self):
+        """Runs on the broker thread: fetch the newest camera frame, or None"""
+        if self.core.get_remaining_image_count() < 1:
+            return None
+        return self.core.get_last_image()
+
     def acquire_data(self):
         """Acquire data from microscope"""
-        self.zmq_lock.acquire()
-        remaining_image_count = self.core.get_remaining_image_count()
-        if remaining_image_count < 1:
-            self.zmq_lock.release()
-            print("Warning: No image in uManager queue.")
-            time.sleep(0.5)
-            return
-
         try:
-            array = self.core.get_last_image()
+            array = self.broker.call(self._grab_frame, priority=PRIORITY_FRAME)
         except Exception as e:
-            self.zmq_lock.release()
             print("ERROR: No image in uManager queue.")
             time.sleep(0.5)
             return
 
-        self.zmq_lock.release()
-        img_width = int(math.sqrt(len(array)))
-        img = np.reshape(array, (img_width, img_width))
-        img = img[::]
-        self.img_queue.put(img)
+        if array is None:
+            print("Warning: No image in uManager queue.")
+            time.sleep(0.5)
+            return
+
+        if array.size != self.frames.height * self.frames.width:
+            # camera size changed, e.g. different binning
+            self.allocate_frames()
+        self.frames.put(array)
+
+    def _image_size(self):
+        return self.core.get_image_height(), self.core.get_image_width()
+
+    def allocate_frames(self):
+        """(Re)allocate the live view ring buffer for the current camera image size"""
+        height, width = self.broker.call(self._image_size, priority=PRIORITY_USER)
+        self.frames = FrameRingBuffer(height, width, slots=self.buffer_slots, downsample=self.downsample)
 
     def display_napari(self, image):
         """Update napari display with new image"""
         self.layers[0].data = image
-        self.img_queue.task_done()
+        text = self.frames.stats()
+        if self.focus is not None:
+            text += f"\nfocus {self.focus:.1f} (max {self.focus_max:.1f})"
+        self.viewer.text_overlay.text = text
+
+    def _update_focus(self, img):
+        """Focus score of a live view frame, computed on the display worker, not on the GUI thread"""
+        self.focus = focus_score(img, self.focus_metric)
+        self.focus_max = self.focus if self.focus_max is None else max(self.focus_max, self.focus)
 
     @thread_worker
     def append_img(self):
@@ -81,20 +102,25 @@ class FabscopeUI:
         """Worker thread for displaying images"""
         print("Worker started: yield_img")
         while self.acq_running:
-            while self.img_queue.qsize() > 0:
-                yield self.img_queue.get(block=False)
+            # only the newest frame is shown, older ones are dropped if display falls behind
+            img = self.frames.latest()
+            if img is not None:
+                self._update_focus(img)
+                yield img
             time.sleep(self.sleep_time)
 
-        while self.img_queue.qsize() > 0:
-            yield self.img_queue.get(block=False)
+        img = self.frames.latest()
+        if img is not None:
+            yield img
         print("acquisition done")
 
     def start_acq(self):
         print("starting threads...")
         if not self.acq_running:
             self.acq_running = True
-            with self.zmq_lock:
-                self.core.start_continuous_sequence_acquisition(0)
+            self.focus_max = None
+            self.allocate_frames()
+            self.broker.call(self.core.start_continuous_sequence_acquisition, 0, priority=PRIORITY_USER)
             worker1 = self.append_img()
             worker2 = self.yield_img()
 
@@ -110,37 +136,98 @@ class FabscopeUI:
     def stop_acq(self):
         """Stop acquisition"""
         print("stopping threads")
-        self.zmq_lock.acquire()
-        self.core.stop_sequence_acquisition()
-        self.zmq_lock.release()
+        self.broker.call(self.core.stop_sequence_acquisition, priority=PRIORITY_USER)
         self.acq_running = False
 
-    def store_pos(self):
-        """Store current stage position"""
-        restart = False
-        if self.acq_running:
-            self.stop_acq()
-            restart = True
+    def add_mosaic_layer(self, mosaic, refresh_interval=1.0):
+        """Show a MosaicBuilder as a multiscale layer in stage coordinates (um),
+        redrawn whenever tiles were added, until mosaic.finish() is called"""
+        scale = mosaic.scales[0]
+        layer = self.viewer.add_image(
+            mosaic.pyramid,
+            multiscale=True,
+            name="mosaic",
+            colormap="gray",
+            contrast_limits=self.clim,
+            scale=(scale, scale),
+            translate=(mosaic.extent[1] + scale / 2, mosaic.extent[0] + scale / 2),
+        )
+        worker = self.watch_mosaic(mosaic, refresh_interval)
+        worker.yielded.connect(lambda _: layer.refresh())
+        worker.start()
+        return layer
 
-        self.zmq_lock.acquire()
+    @thread_worker
+    def watch_mosaic(self, mosaic, refresh_interval):
+        """Worker thread that yields whenever tiles were added to the mosaic"""
+        version = mosaic.version
+        while not mosaic.finished:
+            time.sleep(refresh_interval)
+            if mosaic.version != version:
+                version = mosaic.version
+                yield version
+        yield mosaic.version
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn on the broker thread between two frames, without stopping the acquisition.
+        Returns a Future; errors are printed instead of being lost in the future."""
+        future = self.broker.submit(fn, *args, priority=PRIORITY_USER, **kwargs)
+        future.add_done_callback(_print_exception)
+        return future
+
+    def _read_pos(self):
         point = self.core.get_xy_stage_position()
         pfs_offset = self.core.get_auto_focus_offset()
-        x = point.get_x()
-        y = point.get_y()
-        self.zmq_lock.release()
+        return point.get_x(), point.get_y(), pfs_offset
 
-        self.position_list.append(StagePosition(x, y, pfs_offset))
+    def store_pos(self):
+        """Store current stage position"""
+        def append(future):
+            if not future.cancelled() and future.exception() is None:
+                x, y, pfs_offset = future.result()
+                self.position_list.append(x, y, pfs_offset=pfs_offset)
 
-        if restart:
-            self.start_acq()
+        self.submit(self._read_pos).add_done_callback(append)
 
     def set_dmd_checkerboard(self):
         """Set DMD to checkerboard pattern"""
-        self.stop_acq()
-        self.zmq_lock.acquire()
-        self.dmd.checker_board()
-        self.zmq_lock.release()
-        self.start_acq()
+        self.submit(self.dmd.checker_board)
+
+    def run_autofocus(self, z_range: float = 20.0):
+        """Software autofocus on the projected checkerboard. Every step of the sweep is a separate
+        broker command, so the live view keeps updating during the sweep"""
+        def report(result):
+            z, samples = result
+            print(f"autofocus: z = {z:.2f} um, {len(samples)} positions sampled")
+
+        worker = self.autofocus_worker(z_range)
+        worker.returned.connect(report)
+        worker.errored.connect(lambda e: print(f"ERROR: autofocus failed: {e}"))
+        worker.start()
+
+    @thread_worker
+    def autofocus_worker(self, z_range):
+        """Worker thread for the autofocus sweep, the frames are scored here and not on the broker"""
+        return autofocus(self.core, self.dmd, z_range=z_range, metric=self.focus_metric, call=self._call)
+
+    def _call(self, fn, *args, **kwargs):
+        """Run fn on the broker thread between two frames and wait for its result"""
+        return self.broker.call(fn, *args, priority=PRIORITY_USER, **kwargs)
+
+    def _apply_channel(self, channel):
+        """Runs on the broker thread: apply a channel between two frames.
+        Only a change of the camera exposure needs the sequence acquisition to restart."""
+        restart = (
+            self.acq_running
+            and channel.camera_exposure_time is not None
+            and self.core.get_exposure() != channel.camera_exposure_time
+        )
+        if restart:
+            self.core.stop_sequence_acquisition()
+        channel.apply()
+        self.dmd.all_on()
+        if restart:
+            self.core.start_continuous_sequence_acquisition(0)
 
     def create_channel_widget(self, channel):
         """Create widget for a single channel"""
@@ -154,14 +241,9 @@ class FabscopeUI:
             layout="horizontal",
         )
         def channel_widget(label, power: int = channel.settings[-1][2], exposure=channel.camera_exposure_time):
-            self.stop_acq()
             channel.camera_exposure_time = exposure
             channel.set_power(power)
-            self.zmq_lock.acquire()
-            channel.apply()
-            self.dmd.all_on()
-            self.zmq_lock.release()
-            self.start_acq()
+            self.submit(self._apply_channel, channel)
 
         return channel_widget
 
@@ -185,6 +267,7 @@ class FabscopeUI:
                 blending="additive",
                 rendering="attenuated_mip",
                 contrast_limits=self.clim,
+                scale=(self.downsample, self.downsample),  # in camera pixels, like the full frames
             )
         ]
 
@@ -201,7 +284,13 @@ class FabscopeUI:
         self.viewer.window.add_dock_widget(
             magicgui(self.set_dmd_checkerboard, call_button="DMD Checkerboard pattern"), area="left"
         )
+        self.viewer.window.add_dock_widget(magicgui(self.run_autofocus, call_button="Autofocus"), area="left")
         self.viewer.window.add_dock_widget(magicgui(self.store_pos, call_button="Store position"), area="left")
 
         self.viewer.text_overlay.visible = True
         return self.viewer
+
+
+def _print_exception(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"ERROR: {future.exception()}")
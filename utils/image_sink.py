@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import logging
+import numpy as np
+
+try:
+    import zarr
+except ImportError:  # only needed for format='zarr'
+    zarr = None
+
+try:
+    import tifffile
+except ImportError:  # only needed for format='ome-tiff'
+    tifffile = None
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ImageSink:
+    """
+    Streams captured frames to disk on a background writer thread, instead of collecting them in a list.
+
+    Frames are handed over through a bounded queue: at most max_in_flight frames wait for the writer, and
+    put blocks when the queue is full (backpressure), so memory stays flat however large the chip is, and
+    the disk writes overlap with the exposure of the next tile.
+
+    Zarr stores a group with an 'images' array of shape (rows, cols, channels, height, width), chunked and
+    compressed per frame, and a 'positions' array (rows, cols, 3) with the stage x, y, z of every tile.
+    OME-TIFF stores one compressed, tiled image per frame, named r<row>_c<col>_ch<channel>, with the stage
+    position in its plane metadata.
+    """
+
+    def __init__(self, path: str, frame_shape: Tuple[int, int], grid_shape: Tuple[int, int] = (1, 1),
+                 channels: int = 1, dtype=np.uint16, format: Optional[str] = None, max_in_flight: int = 8,
+                 tile: Tuple[int, int] = (256, 256)):
+        """
+        Args:
+            path: Output path, a .zarr directory or a .ome.tif file
+            frame_shape: (height, width) of the camera frames
+            grid_shape: (rows, cols) of the tile grid
+            channels: Number of channels per tile
+            dtype: Pixel type of the camera frames
+            format: 'zarr' or 'ome-tiff', guessed from the suffix of path if None
+            max_in_flight: Max number of frames waiting for the writer
+            tile: Tile size of the OME-TIFF pages
+
+        Raises:
+            ValueError: If the format is unknown
+            ImportError: If the library for the format is not installed
+        """
+        self.path = Path(path)
+        if format is None:
+            format = "ome-tiff" if self.path.name.lower().endswith((".tif", ".tiff")) else "zarr"
+        if format not in ("zarr", "ome-tiff"):
+            raise ValueError(f"format must be 'zarr' or 'ome-tiff', not {format!r}")
+        if format == "zarr" and zarr is None:
+            raise ImportError("format='zarr' needs the zarr package")
+        if format == "ome-tiff" and tifffile is None:
+            raise ImportError("format='ome-tiff' needs the tifffile package")
+        self.format = format
+        self.frame_shape = tuple(frame_shape)
+        self.grid_shape = tuple(grid_shape)
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.tile = tile
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max(1, max_in_flight))
+        self.index: List[Tuple[int, int, int, float, float, float]] = []  # (row, col, channel, x, y, z) written
+        self.error: Optional[BaseException] = None
+        self.written = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+        self.blocked_time = 0.0  # time put waited for the writer
+        self._open()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="image_sink", daemon=True)
+        self._thread.start()
+
+    def _open(self) -> None:
+        rows, cols = self.grid_shape
+        if self.format == "zarr":
+            self._group = zarr.open_group(str(self.path), mode="w")
+            self._images = self._group.zeros(name="images", shape=(rows, cols, self.channels) + self.frame_shape,
+                                             chunks=(1, 1, 1) + self.frame_shape, dtype=self.dtype)
+            self._positions = self._group.full(name="positions", shape=(rows, cols, 3), fill_value=np.nan,
+                                               chunks=(rows, cols, 3), dtype=np.float64)
+            self._group.attrs["axes"] = ["row", "col", "channel", "y", "x"]
+            self._tiff = None
+        else:
+            self._tiff = tifffile.TiffWriter(str(self.path), bigtiff=True, ome=True)
+
+    def put(self, img: np.ndarray, row: int = 0, col: int = 0, channel: int = 0, position=None,
+            timeout: Optional[float] = None) -> None:
+        """
+        Hand a frame to the writer. Blocks while max_in_flight frames are waiting.
+        The frame must not be modified afterwards (the frames of acq are new arrays, so this holds).
+
+        Args:
+            img: Camera frame (flat or 2D)
+            row, col: Tile of the frame
+            channel: Channel of the frame
+            position: Stage position of the tile (anything with x, y, z), optional
+
+        Raises:
+            RuntimeError: If the sink is closed or the writer failed
+            IndexError: If row, col or channel are outside of the grid
+            queue.Full: If timeout is given and the writer didn't catch up in time
+        """
+        if self.error is not None:
+            raise RuntimeError("Image writer failed") from self.error
+        if self._closed:
+            raise RuntimeError("ImageSink is closed")
+        if not (0 <= row < self.grid_shape[0] and 0 <= col < self.grid_shape[1] and 0 <= channel < self.channels):
+            raise IndexError(f"Frame {row},{col},{channel} outside of grid {self.grid_shape} x {self.channels} channels")
+        xyz = (np.nan, np.nan, np.nan)
+        if position is not None:
+            xyz = tuple(np.nan if v is None else float(v) for v in (position.x, position.y, position.z))
+        start = time.perf_counter()
+        self.queue.put((np.reshape(img, self.frame_shape), row, col, channel, xyz), timeout=timeout)
+        self.blocked_time += time.perf_counter() - start
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            if self.error is not None:
+                continue  # drain the queue so put doesn't block forever
+            img, row, col, channel, xyz = item
+            start = time.perf_counter()
+            try:
+                self._write(img, row, col, channel, xyz)
+            except BaseException as e:
+                logger.error(f"Writing frame {row},{col},{channel} failed: {e!r}")
+                self.error = e
+                continue
+            self.write_time += time.perf_counter() - start
+            self.written += 1
+            self.bytes_written += img.nbytes
+            self.index.append((row, col, channel) + xyz)
+
+    def _write(self, img: np.ndarray, row: int, col: int, channel: int, xyz: Tuple[float, float, float]) -> None:
+        if self.format == "zarr":
+            self._images[row, col, channel] = img
+            if not np.all(np.isnan(xyz)):
+                self._positions[row, col] = xyz
+        else:
+            plane = {f"Position{axis}": [v] for axis, v in zip("XYZ", xyz) if not np.isnan(v)}
+            metadata: Dict = {"Name": f"r{row}_c{col}_ch{channel}", "axes": "YX"}
+            if plane:
+                metadata["Plane"] = plane
+            self._tiff.write(np.asarray(img, dtype=self.dtype), compression="zlib", tile=self.tile,
+                             metadata=metadata)
+
+    def on_image(self, tile_indices: Sequence[Tuple[int, int]], positions=None, channel: int = 0) -> Callable:
+        """
+        Callback for print_job(on_image=...): writes the image of tile i to tile_indices[i] and returns None,
+        so print_job doesn't keep the images in memory.
+
+        Args:
+            tile_indices: (row, col) of every printed tile, e.g. path_plan.tile_indices
+            positions: Stage position of every printed tile, e.g. path_plan.positions
+            channel: Channel the images are written to
+        """
+        def write(index: int, img: np.ndarray) -> None:
+            row, col = tile_indices[index]
+            self.put(img, row, col, channel, None if positions is None else positions[index])
+        return write
+
+    def stats(self) -> Dict[str, float]:
+        """Writer statistics: frames and MB written, write throughput, time put was blocked, frames in flight."""
+        return {
+            "written": self.written,
+            "mb_written": self.bytes_written / 2 ** 20,
+            "mb_per_s": self.bytes_written / 2 ** 20 / self.write_time if self.write_time else 0.0,
+            "blocked_s": self.blocked_time,
+            "in_flight": self.queue.qsize(),
+        }
+
+    def close(self) -> None:
+        """
+        Write all frames in flight and close the file.
+
+        Raises:
+            RuntimeError: If the writer failed
+        """
+        if not self._closed:
+            self._closed = True
+            self.queue.put(_STOP)
+            self._thread.join()
+            if self._tiff is not None:
+                self._tiff.close()
+        if self.error is not None:
+            raise RuntimeError("Image writer failed") from self.error
+
+    def __enter__(self) -> "ImageSink":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
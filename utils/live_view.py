@@ -0,0 +1,85 @@
+import time
+from threading import Lock
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    Fixed-size ring buffer of preallocated frames for the live view.
+
+    The acquisition thread writes every frame into the next slot; the display thread only ever
+    reads the newest one (latest-frame-wins), so display never lags behind acquisition and memory
+    stays constant. Frames that are overwritten before they were displayed count as dropped.
+    """
+
+    def __init__(self, height: int, width: int, dtype=np.uint16, slots: int = 4, downsample: int = 1):
+        """
+        Args:
+            height: Frame height in pixels
+            width: Frame width in pixels
+            dtype: Pixel type of the camera frames
+            slots: Number of preallocated frames
+            downsample: Take every n-th pixel for display
+        """
+        if slots < 2:
+            raise ValueError("FrameRingBuffer needs at least 2 slots")
+        self.height = height
+        self.width = width
+        self.downsample = max(1, int(downsample))
+        self.frames = np.zeros((slots, height, width), dtype=dtype)
+        self.timestamps = np.zeros(slots)
+        self._lock = Lock()
+        self._written = 0  # total number of frames written
+        self._read = 0  # number of the last frame handed out, 1-based
+        self.dropped = 0
+        self.fps = 0.0
+        self.latency = 0.0
+        self._last_put = None
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    def put(self, array: np.ndarray) -> None:
+        """
+        Copy a (flat or 2D) camera frame into the next slot.
+
+        Raises:
+            ValueError: If the frame doesn't have height*width pixels
+        """
+        if array.size != self.height * self.width:
+            raise ValueError(f"Frame with {array.size} pixels doesn't fit buffer of shape {self.shape}")
+        now = time.perf_counter()
+        # only the acquisition thread writes, and the slot is published after the copy is complete
+        slot = self._written % len(self.frames)
+        np.copyto(self.frames[slot], np.reshape(array, self.shape), casting="unsafe")
+        self.timestamps[slot] = now
+        with self._lock:
+            self._written += 1
+        if self._last_put is not None:
+            interval = now - self._last_put
+            if interval > 0:
+                # exponential moving average to smooth out jitter of the acquisition thread
+                self.fps = 0.9 * self.fps + 0.1 / interval if self.fps else 1 / interval
+        self._last_put = now
+
+    def latest(self) -> Optional[np.ndarray]:
+        """
+        Return a (downsampled) copy of the newest frame, or None if there is no new frame since the last call.
+        """
+        with self._lock:
+            if self._written == self._read:
+                return None
+            # every frame between the last one shown and the newest one is skipped
+            self.dropped += self._written - self._read - 1
+            self._read = self._written
+            slot = (self._written - 1) % len(self.frames)
+        frame = self.frames[slot, ::self.downsample, ::self.downsample].copy()
+        self.latency = time.perf_counter() - self.timestamps[slot]
+        return frame
+
+    def stats(self) -> str:
+        """Counters for display in the viewer."""
+        return f"{self.fps:.1f} fps | dropped {self.dropped} | latency {self.latency * 1000:.0f} ms"
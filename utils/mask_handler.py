@@ -2,12 +2,25 @@ from pathlib import Path
 import numpy as np
 from skimage import io
 import matplotlib.pyplot as plt
-from typing import Tuple, List
+from dataclasses import dataclass
+from typing import Tuple, List, Iterator
 import logging
 
+from manager.dmd import binarize_mask
+
+try:
+    import tifffile
+except ImportError:  # only needed for memory-mapped / chunked TIFF reading
+    tifffile = None
+
+try:
+    import zarr
+except ImportError:  # only needed for chunked reading of compressed TIFFs
+    zarr = None
+
 logger = logging.getLogger(__name__)
 
-def load_mask(base_path: str, name: str, invert: bool = False) -> np.ndarray:
+def load_mask(base_path: str, name: str, invert: bool = False, show: bool = True) -> np.ndarray:
     """
     Load and process a mask from file
     
@@ -15,6 +28,7 @@ def load_mask(base_path: str, name: str, invert: bool = False) -> np.ndarray:
         base_path: Directory path where masks are stored
         name: Filename of the mask
         invert: Whether to invert the mask values
+        show: Plot the loaded mask. Set to False for headless use.
         
     Returns:
         Processed mask as numpy array
@@ -39,17 +53,18 @@ def load_mask(base_path: str, name: str, invert: bool = False) -> np.ndarray:
             mask = (mask >= 128).astype(np.uint8)
         
         # Validate mask
-        unique_values = np.unique(mask)
+        unique_values = _unique_values(mask)
         logger.info(f"Mask unique values: {unique_values}")
         if not np.all(np.isin(unique_values, [0, 1, 255])):
             logger.warning("Mask contains unexpected values")
         
         # Optional visualization
-        plt.figure(figsize=(8, 8))
-        plt.imshow(mask, cmap='gray')
-        plt.title(f"Loaded mask: {name}")
-        plt.colorbar()
-        plt.show()
+        if show:
+            plt.figure(figsize=(8, 8))
+            plt.imshow(mask, cmap='gray')
+            plt.title(f"Loaded mask: {name}")
+            plt.colorbar()
+            plt.show()
         
         return mask
         
@@ -58,10 +73,167 @@ def load_mask(base_path: str, name: str, invert: bool = False) -> np.ndarray:
         raise
 
 
+def _unique_values(mask: np.ndarray) -> np.ndarray:
+    """Unique values of a mask; a linear-time histogram for 8 bit masks instead of a full sort."""
+    if mask.dtype == np.uint8:
+        return np.flatnonzero(np.bincount(mask.ravel(), minlength=256)).astype(np.uint8)
+    return np.unique(mask)
+
+
+@dataclass
+class TileSummary:
+    """Compact description of one tile of a mask."""
+    row: int
+    col: int
+    pixel_count: int
+    empty: bool
+
+
+class LazyMask:
+    """
+    Mask that is read tile by tile instead of being loaded into RAM as a whole.
+
+    Uncompressed TIFFs are memory-mapped, compressed TIFFs are read chunk-wise through zarr.
+    Other formats (e.g. PNG) can't be read partially and are loaded once with skimage.
+    Partial tiles at the right and bottom edge are padded with zeros to the full tile size.
+    """
+
+    def __init__(self, path: str, tile_width: int = 800, tile_height: int = 600, invert: bool = False):
+        """
+        Args:
+            path: Path to the mask file
+            tile_width: Width of each tile
+            tile_height: Height of each tile
+            invert: Whether to invert the mask values, as in load_mask
+
+        Raises:
+            FileNotFoundError: If mask file doesn't exist
+        """
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"Mask file not found: {self.path}")
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.invert = invert
+        self.data = self._open()
+        self.height, self.width = self.data.shape[:2]
+        self.grid_height = -(-self.height // tile_height)
+        self.grid_width = -(-self.width // tile_width)
+
+    def _open(self):
+        suffix = self.path.suffix.lower()
+        if suffix in ('.tif', '.tiff') and tifffile is not None:
+            try:
+                return tifffile.memmap(str(self.path), mode='r')
+            except ValueError:
+                # compressed or not contiguous: read chunk-wise if zarr is available
+                if zarr is not None:
+                    return zarr.open(tifffile.imread(str(self.path), aszarr=True), mode='r')
+                logger.warning(f"{self.path.name} is not memory-mappable and zarr is missing, loading it into RAM")
+                return tifffile.imread(str(self.path))
+        logger.info(f"{self.path.name} can't be read partially, loading it into RAM")
+        return io.imread(str(self.path))
+
+    def _read(self, row_start: int, row_stop: int, col_start: int, col_stop: int) -> np.ndarray:
+        region = np.asarray(self.data[row_start:row_stop, col_start:col_stop])
+        if region.ndim == 3:
+            region = region[:, :, 0]
+        if self.invert:
+            region = (~region >= 128).astype(np.uint8)
+        return region
+
+    def tile(self, row: int, col: int) -> np.ndarray:
+        """
+        Read one tile, zero-padded to tile_height x tile_width.
+
+        Raises:
+            IndexError: If the tile is outside of the grid
+        """
+        if not (0 <= row < self.grid_height and 0 <= col < self.grid_width):
+            raise IndexError(f"Tile {row},{col} outside of grid {self.grid_height}x{self.grid_width}")
+        row_start, col_start = row * self.tile_height, col * self.tile_width
+        region = self._read(row_start, row_start + self.tile_height, col_start, col_start + self.tile_width)
+        if region.shape == (self.tile_height, self.tile_width):
+            return region
+        tile = np.zeros((self.tile_height, self.tile_width), dtype=region.dtype)
+        tile[:region.shape[0], :region.shape[1]] = region
+        return tile
+
+    def tiles(self) -> "LazyTileGrid":
+        """Tiles as a grid that can be indexed like the output of tile_array, tiles[row][col]."""
+        return LazyTileGrid(self)
+
+    def iter_tiles(self) -> Iterator[Tuple[int, int, np.ndarray]]:
+        """Yield (row, col, tile) for all tiles, row by row."""
+        for row in range(self.grid_height):
+            for col in range(self.grid_width):
+                yield row, col, self.tile(row, col)
+
+    def iter_summary(self) -> Iterator[TileSummary]:
+        """
+        Yield a TileSummary for every tile without materializing the mask.
+        Reads one strip of tile_height rows at a time and counts the pixels of all its tiles at once.
+        """
+        padded_width = self.grid_width * self.tile_width
+        for row in range(self.grid_height):
+            row_start = row * self.tile_height
+            strip = binarize_mask(self._read(row_start, row_start + self.tile_height, 0, self.width))
+            if strip.shape[1] != padded_width:
+                strip = np.pad(strip, ((0, 0), (0, padded_width - strip.shape[1])))
+            counts = strip.reshape(strip.shape[0], self.grid_width, self.tile_width).sum(axis=(0, 2))
+            for col, count in enumerate(counts.tolist()):
+                yield TileSummary(row, col, count, count == 0)
+
+    def pixel_counts(self) -> np.ndarray:
+        """Number of pixels that are on per tile, shape [grid_height][grid_width]."""
+        counts = np.zeros((self.grid_height, self.grid_width), dtype=np.int64)
+        for summary in self.iter_summary():
+            counts[summary.row, summary.col] = summary.pixel_count
+        return counts
+
+
+class LazyTileGrid:
+    """Row-major grid view of a LazyMask: grid[row][col] reads the tile on access."""
+
+    def __init__(self, mask: LazyMask):
+        self.mask = mask
+
+    def __len__(self) -> int:
+        return self.mask.grid_height
+
+    def __getitem__(self, row: int) -> "_LazyTileRow":
+        if not 0 <= row < self.mask.grid_height:
+            raise IndexError(row)
+        return _LazyTileRow(self.mask, row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class _LazyTileRow:
+    def __init__(self, mask: LazyMask, row: int):
+        self.mask = mask
+        self.row = row
+
+    def __len__(self) -> int:
+        return self.mask.grid_width
+
+    def __getitem__(self, col: int) -> np.ndarray:
+        if not 0 <= col < self.mask.grid_width:
+            raise IndexError(col)
+        return self.mask.tile(self.row, col)
+
+    def __iter__(self):
+        for col in range(len(self)):
+            yield self[col]
+
+
 
 def tile_array(array: np.ndarray, 
                tile_width: int = 800,
-               tile_height: int = 600
+               tile_height: int = 600,
+               pad: bool = False
                ) -> Tuple[List[List[np.ndarray]], int, int]:
     """
     Split array into tiles of specified size and arrange them in a 2D list (row-major).
@@ -70,6 +242,7 @@ def tile_array(array: np.ndarray,
         array: Input array to tile
         tile_width: Width of each tile
         tile_height: Height of each tile
+        pad: Zero-pad the array to a multiple of the tile size instead of raising
         
     Returns:
         A tuple containing:
@@ -81,6 +254,13 @@ def tile_array(array: np.ndarray,
         ValueError: If array dimensions don't match tile size
     """
     height, width = array.shape[:2]
+
+    if pad:
+        pad_height = -height % tile_height
+        pad_width = -width % tile_width
+        if pad_height or pad_width:
+            array = np.pad(array, ((0, pad_height), (0, pad_width)) + ((0, 0),) * (array.ndim - 2))
+            height, width = array.shape[:2]
     
     # Validate dimensions
     if (height % tile_height != 0) or (width % tile_width != 0):
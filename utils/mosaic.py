@@ -0,0 +1,127 @@
+import threading
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class MosaicBuilder:
+    """
+    Incremental multiscale mosaic of a print.
+
+    Every captured tile is placed into a global canvas by its stage position and the camera pixel size,
+    directly at pyramid resolution: the tile is downsampled once per level (each level from the previous
+    one) and pasted, so the full resolution mosaic is never built. The levels can be shown as a napari
+    multiscale layer that refreshes while the print runs (see FabscopeUI.add_mosaic_layer).
+    """
+
+    def __init__(self, extent: Tuple[float, float, float, float], pixel_size: float, downsample: int = 4,
+                 levels: Optional[int] = None, dtype=np.uint16, flip_x: bool = False, flip_y: bool = False):
+        """
+        Args:
+            extent: (x_min, y_min, x_max, y_max) of the mosaic in stage um
+            pixel_size: Camera pixel size in um (in the sample plane)
+            downsample: Downsampling of the finest level relative to the camera
+            levels: Number of pyramid levels, each half the size of the previous one.
+                By default, levels are added until the coarsest one fits into 1024 pixels.
+            dtype: Pixel type of the mosaic
+            flip_x, flip_y: Whether the image axes point against the stage axes
+
+        Raises:
+            ValueError: If the extent is empty
+        """
+        x_min, y_min, x_max, y_max = extent
+        if x_max <= x_min or y_max <= y_min:
+            raise ValueError(f"Empty mosaic extent {extent}")
+        self.extent = tuple(extent)
+        self.pixel_size = pixel_size
+        self.downsample = max(1, int(downsample))
+        self.flip_x = flip_x
+        self.flip_y = flip_y
+        height = int(np.ceil((y_max - y_min) / pixel_size / self.downsample))
+        width = int(np.ceil((x_max - x_min) / pixel_size / self.downsample))
+        if levels is None:
+            levels = 1
+            while max(height, width) >> (levels - 1) > 1024:
+                levels += 1
+        self.pyramid: List[np.ndarray] = [np.zeros((max(1, height >> i), max(1, width >> i)), dtype=dtype)
+                                          for i in range(levels)]
+        self.version = 0  # increases with every added tile, to detect changes
+        self.tiles = 0
+        self.finished = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_positions(cls, positions, frame_shape: Tuple[int, int], pixel_size: float, **kwargs) -> "MosaicBuilder":
+        """
+        Mosaic that fits all frames, for stage positions at the frame centers (as in micro-manager).
+
+        Args:
+            positions: Stage positions of the tiles (position_table or anything with x and y), e.g. path_plan.positions
+            frame_shape: (height, width) of the camera frames
+            pixel_size: Camera pixel size in um
+        """
+        xs = np.array([p.x for p in positions], dtype=np.float64)
+        ys = np.array([p.y for p in positions], dtype=np.float64)
+        half_w = frame_shape[1] * pixel_size / 2
+        half_h = frame_shape[0] * pixel_size / 2
+        return cls((xs.min() - half_w, ys.min() - half_h, xs.max() + half_w, ys.max() + half_h), pixel_size, **kwargs)
+
+    @property
+    def scales(self) -> List[float]:
+        """Size of a pixel of every level in um, e.g. for the scale of a napari layer."""
+        return [self.pixel_size * self.downsample * 2 ** i for i in range(len(self.pyramid))]
+
+    def add(self, img: np.ndarray, x: float, y: float) -> None:
+        """
+        Place a camera frame centered at stage position (x, y) into all levels.
+
+        Args:
+            img: 2D camera frame
+            x, y: Stage position of the frame center in um
+        """
+        img = np.asarray(img)
+        if self.flip_x:
+            img = img[:, ::-1]
+        if self.flip_y:
+            img = img[::-1, :]
+        x_min, y_min = self.extent[0], self.extent[1]
+        # top left corner of the frame, in camera pixels of the mosaic
+        top = (y - y_min) / self.pixel_size - img.shape[0] / 2
+        left = (x - x_min) / self.pixel_size - img.shape[1] / 2
+        tile = np.ascontiguousarray(img)
+        factor = 1
+        with self._lock:
+            for level, canvas in enumerate(self.pyramid):
+                step = self.downsample if level == 0 else 2
+                factor *= step
+                size = (max(1, round(tile.shape[1] / step)), max(1, round(tile.shape[0] / step)))
+                tile = cv2.resize(tile, size, interpolation=cv2.INTER_AREA)
+                self._paste(canvas, tile, int(round(top / factor)), int(round(left / factor)))
+            self.tiles += 1
+            self.version += 1
+
+    @staticmethod
+    def _paste(canvas: np.ndarray, tile: np.ndarray, top: int, left: int) -> None:
+        y0, x0 = max(top, 0), max(left, 0)
+        y1, x1 = min(top + tile.shape[0], canvas.shape[0]), min(left + tile.shape[1], canvas.shape[1])
+        if y1 > y0 and x1 > x0:
+            canvas[y0:y1, x0:x1] = tile[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    def on_image(self, positions, then: Optional[Callable] = None) -> Callable:
+        """
+        Callback for print_job(on_image=...) that adds the image of tile i at positions[i].
+
+        Args:
+            positions: Stage position of every printed tile, e.g. path_plan.positions
+            then: Optional on_image callback to pass the image on to, e.g. ImageSink.on_image(...).
+                Its result is returned. Without it, None is returned, so print_job doesn't keep the images.
+        """
+        def add(index: int, img: np.ndarray):
+            self.add(img, positions[index].x, positions[index].y)
+            return None if then is None else then(index, img)
+        return add
+
+    def finish(self) -> None:
+        """Mark the mosaic as complete, viewers stop watching it for changes."""
+        self.finished = True
@@ -0,0 +1,176 @@
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .mask_handler import LazyTileGrid
+
+
+def bayer_matrix(order: int = 3) -> np.ndarray:
+    """Ordered dithering thresholds in [0, 1), shape (2**order, 2**order)."""
+    matrix = np.zeros((1, 1))
+    for _ in range(order):
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size
+
+
+class OverlapTiler:
+    """
+    Cuts a design into overlapping dmd tiles, with dose blending in the overlaps and an optional
+    per-tile affine correction for the rotation/scale between stage and dmd.
+
+    In an overlap, the dose ramps down linearly in one tile and up in its neighbour, so every design
+    pixel gets the dose of one exposure and small stage errors don't leave a seam. As the dmd is binary,
+    the ramps are applied with ordered dithering anchored in design coordinates: the patterns of two
+    neighbouring tiles are complementary, every pixel is switched on in exactly one of them.
+    """
+
+    def __init__(self, design: np.ndarray, tile_width: int = 800, tile_height: int = 600,
+                 overlap: Tuple[int, int] = (40, 30), pixel_size: Optional[float] = None,
+                 stage_to_dmd: Optional[np.ndarray] = None, blend: str = "dither"):
+        """
+        Args:
+            design: Mask in design pixels (one design pixel = one nominal dmd pixel). Any array-like that
+                supports 2D slicing, e.g. a memory-mapped TIFF.
+            tile_width: Width of each tile in dmd pixels
+            tile_height: Height of each tile in dmd pixels
+            overlap: (x, y) overlap between neighbouring tiles in dmd pixels
+            pixel_size: Nominal size of a design pixel in um, used for the stage offsets
+            stage_to_dmd: Measured 2x2 matrix from stage um to dmd pixels (stage -> camera -> dmd calibration).
+                If given, every tile is warped so the design lands at the right place despite rotation/scale.
+            blend: 'dither' (binary, complementary patterns), 'weights' (float dose per pixel) or 'none'
+
+        Raises:
+            ValueError: If the overlap is more than half the tile or blend is unknown
+        """
+        if not (0 <= 2 * overlap[0] <= tile_width and 0 <= 2 * overlap[1] <= tile_height):
+            raise ValueError(f"Overlap {overlap} must be at most half the tile ({tile_width}x{tile_height})")
+        if blend not in ("dither", "weights", "none"):
+            raise ValueError(f"blend must be 'dither', 'weights' or 'none', not {blend!r}")
+        if stage_to_dmd is not None and pixel_size is None:
+            raise ValueError("stage_to_dmd needs the pixel_size of the design")
+        self.design = design
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.overlap = tuple(overlap)
+        self.step = (tile_width - overlap[0], tile_height - overlap[1])
+        self.pixel_size = pixel_size
+        self.blend = blend
+        self.height, self.width = design.shape[:2]
+        self.grid_width = max(1, -(-(self.width - overlap[0]) // self.step[0]))
+        self.grid_height = max(1, -(-(self.height - overlap[1]) // self.step[1]))
+        self.thresholds = bayer_matrix()
+
+        # linear part of the design pixel -> tile pixel mapping, identity if the stage is perfectly aligned
+        self.correction = None
+        if stage_to_dmd is not None:
+            linear = np.asarray(stage_to_dmd, dtype=np.float64) * pixel_size
+            if not np.allclose(linear, np.eye(2)):
+                self.correction = linear
+
+    @property
+    def stage_offsets(self) -> Tuple[float, float]:
+        """(x_offset, y_offset) stage step in um between neighbouring tiles, for plan_path."""
+        if self.pixel_size is None:
+            raise ValueError("stage_offsets needs the pixel_size of the design")
+        return self.step[0] * self.pixel_size, self.step[1] * self.pixel_size
+
+    def _ramps(self, indices: np.ndarray, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Dose ramp along one axis for a batch of tiles, shape (n, size). Outer edges of the grid keep full dose.
+        Also returns the summed ramps of the preceding neighbour at every pixel, which is where the share
+        of this tile starts for the complementary dithering.
+        """
+        size = self.tile_width if axis == 0 else self.tile_height
+        overlap = self.overlap[axis]
+        last = (self.grid_width if axis == 0 else self.grid_height) - 1
+        ramp = np.ones((len(indices), size))
+        start = np.zeros((len(indices), size))
+        if overlap == 0:
+            return ramp, start
+        rising = (np.arange(overlap) + 0.5) / overlap
+        ramp[indices > 0, :overlap] = rising
+        start[indices > 0, :overlap] = 1 - rising
+        ramp[indices < last, size - overlap:] = rising[::-1]
+        return ramp, start
+
+    def weights(self, indices: Sequence[Tuple[int, int]]) -> np.ndarray:
+        """Dose weights in [0, 1] for a batch of tiles, shape (n, tile_height, tile_width)."""
+        indices = np.asarray(indices, dtype=int).reshape(-1, 2)
+        wy, _ = self._ramps(indices[:, 0], axis=1)
+        wx, _ = self._ramps(indices[:, 1], axis=0)
+        return wy[:, :, None] * wx[:, None, :]
+
+    def _crop(self, top: int, left: int, height: int, width: int) -> np.ndarray:
+        """Region of the design, zero-padded where it extends past the border."""
+        region = np.zeros((height, width), dtype=np.float32)
+        y0, x0 = max(top, 0), max(left, 0)
+        y1, x1 = min(top + height, self.height), min(left + width, self.width)
+        if y1 > y0 and x1 > x0:
+            data = np.asarray(self.design[y0:y1, x0:x1])
+            if data.ndim == 3:
+                data = data[:, :, 0]
+            region[y0 - top:y1 - top, x0 - left:x1 - left] = data != 0
+        return region
+
+    def tiles_batch(self, indices: Sequence[Tuple[int, int]]) -> np.ndarray:
+        """
+        Generate a batch of tiles at once. The blending is vectorized over the whole batch.
+
+        Args:
+            indices: (row, col) of the tiles, e.g. path_plan.tile_indices
+        Returns:
+            (n, tile_height, tile_width) array, uint8 0/1 or float32 dose for blend='weights'
+        """
+        indices = np.asarray(indices, dtype=int).reshape(-1, 2)
+        tops = indices[:, 0] * self.step[1]
+        lefts = indices[:, 1] * self.step[0]
+        h, w = self.tile_height, self.tile_width
+        if self.correction is None:
+            dose = np.stack([self._crop(top, left, h, w) for top, left in zip(tops, lefts)])
+        else:
+            dose = np.stack([self._corrected(top, left) for top, left in zip(tops, lefts)])
+        if self.blend == "none":
+            return (dose > 0.5).astype(np.uint8)
+        if self.blend == "weights":
+            return dose * self.weights(indices)
+
+        # every design pixel is given to exactly one of the tiles that overlap it, independently per axis:
+        # along x, a tile takes the pixels whose threshold falls into its share [start, start + ramp).
+        # The thresholds are anchored in design coordinates, so all tiles see the same value at a pixel.
+        wy, start_y = self._ramps(indices[:, 0], axis=1)
+        wx, start_x = self._ramps(indices[:, 1], axis=0)
+        n = len(self.thresholds)
+        ys = tops[:, None] + np.arange(h)[None, :]
+        xs = lefts[:, None] + np.arange(w)[None, :]
+        tx = self.thresholds[(ys % n)[:, :, None], (xs % n)[:, None, :]]
+        ty = self.thresholds[((xs + n // 2) % n)[:, None, :], ((ys + n // 2) % n)[:, :, None]]
+        take_x = (start_x[:, None, :] <= tx) & (tx < (start_x + wx)[:, None, :])
+        take_y = (start_y[:, :, None] <= ty) & (ty < (start_y + wy)[:, :, None])
+        return ((dose > 0.5) & take_x & take_y).astype(np.uint8)
+
+    def _corrected(self, top: int, left: int) -> np.ndarray:
+        """Design region of a tile, warped with the stage -> dmd correction around the tile center."""
+        h, w = self.tile_height, self.tile_width
+        margin = int(np.ceil(0.5 * max(h, w) * np.abs(self.correction - np.eye(2)).sum())) + 2
+        region = self._crop(top - margin, left - margin, h + 2 * margin, w + 2 * margin)
+        # tile center maps onto the center of the design region
+        center_tile = np.array([(w - 1) / 2, (h - 1) / 2])
+        center_region = center_tile + margin
+        affine = np.hstack([self.correction, (center_tile - self.correction @ center_region)[:, None]])
+        return cv2.warpAffine(region, affine, (w, h), flags=cv2.INTER_LINEAR)
+
+    def tile(self, row: int, col: int) -> np.ndarray:
+        """
+        Generate one tile.
+
+        Raises:
+            IndexError: If the tile is outside of the grid
+        """
+        if not (0 <= row < self.grid_height and 0 <= col < self.grid_width):
+            raise IndexError(f"Tile {row},{col} outside of grid {self.grid_height}x{self.grid_width}")
+        return self.tiles_batch([(row, col)])[0]
+
+    def tiles(self) -> LazyTileGrid:
+        """Tiles as a grid that can be indexed like the output of tile_array, tiles[row][col]."""
+        return LazyTileGrid(self)
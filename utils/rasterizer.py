@@ -0,0 +1,546 @@
+import math
+import re
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .mask_handler import LazyTileGrid
+
+try:
+    import ezdxf
+except ImportError:  # only needed for DXF files
+    ezdxf = None
+
+try:
+    import gdstk
+except ImportError:  # only needed for GDS files
+    gdstk = None
+
+# fixed point bits for subpixel accurate drawing with OpenCV
+SHIFT = 4
+
+
+@dataclass
+class Shape:
+    """
+    One vector shape in design coordinates (um).
+
+    kind is 'polygon' (filled, several rings make holes), 'circle' (rings holds the center,
+    radius the radius) or 'path' (open polyline drawn with width).
+    """
+    kind: str
+    rings: List[np.ndarray]
+    radius: float = 0.0
+    width: float = 0.0
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        points = np.concatenate(self.rings)
+        pad = self.radius + self.width / 2
+        return (points[:, 0].min() - pad, points[:, 1].min() - pad,
+                points[:, 0].max() + pad, points[:, 1].max() + pad)
+
+
+class VectorMask:
+    """
+    Mask defined by vector shapes, rasterized tile by tile directly in dmd pixel space.
+
+    A uniform grid spatial index over the shapes bounding boxes finds the shapes that intersect a
+    tile, so only those are drawn and memory stays proportional to one tile. Tiles can be rendered
+    in parallel in a process pool with render_tiles.
+    """
+
+    def __init__(self, shapes: Sequence[Shape], pixel_size: float, tile_width: int = 800,
+                 tile_height: int = 600, origin: Optional[Tuple[float, float]] = None):
+        """
+        Args:
+            shapes: Shapes in design coordinates (um)
+            pixel_size: Size of a dmd pixel in the sample plane (um), from the calibration
+            tile_width: Width of each tile in dmd pixels
+            tile_height: Height of each tile in dmd pixels
+            origin: Design coordinate of the top left corner of tile 0,0. Defaults to the top left of all shapes.
+
+        Raises:
+            ValueError: If there are no shapes
+        """
+        if len(shapes) == 0:
+            raise ValueError("VectorMask needs at least one shape")
+        self.shapes = list(shapes)
+        self.pixel_size = pixel_size
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.bboxes = np.array([shape.bbox for shape in self.shapes])
+        if origin is None:
+            origin = (self.bboxes[:, 0].min(), self.bboxes[:, 1].min())
+        self.origin = origin
+        self.width = int(math.ceil((self.bboxes[:, 2].max() - origin[0]) / pixel_size))
+        self.height = int(math.ceil((self.bboxes[:, 3].max() - origin[1]) / pixel_size))
+        self.grid_width = max(1, -(-self.width // tile_width))
+        self.grid_height = max(1, -(-self.height // tile_height))
+        self._index = self._build_index()
+
+    def _tile_span(self, x0, y0, x1, y1):
+        """Range of tiles (inclusive) covered by a box in design coordinates."""
+        tile_w = self.tile_width * self.pixel_size
+        tile_h = self.tile_height * self.pixel_size
+        col0 = max(0, int((x0 - self.origin[0]) // tile_w))
+        row0 = max(0, int((y0 - self.origin[1]) // tile_h))
+        col1 = min(self.grid_width - 1, int((x1 - self.origin[0]) // tile_w))
+        row1 = min(self.grid_height - 1, int((y1 - self.origin[1]) // tile_h))
+        return row0, col0, row1, col1
+
+    def _build_index(self) -> Dict[Tuple[int, int], List[int]]:
+        index: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for i, bbox in enumerate(self.bboxes):
+            row0, col0, row1, col1 = self._tile_span(*bbox)
+            for row in range(row0, row1 + 1):
+                for col in range(col0, col1 + 1):
+                    index[(row, col)].append(i)
+        return index
+
+    def shapes_in_tile(self, row: int, col: int) -> List[int]:
+        """Ids of the shapes whose bounding box intersects the tile."""
+        return self._index.get((row, col), [])
+
+    def is_empty(self, row: int, col: int) -> bool:
+        return len(self.shapes_in_tile(row, col)) == 0
+
+    def tile(self, row: int, col: int) -> np.ndarray:
+        """
+        Rasterize one tile (uint8, 0/1).
+
+        Raises:
+            IndexError: If the tile is outside of the grid
+        """
+        if not (0 <= row < self.grid_height and 0 <= col < self.grid_width):
+            raise IndexError(f"Tile {row},{col} outside of grid {self.grid_height}x{self.grid_width}")
+        tile = np.zeros((self.tile_height, self.tile_width), dtype=np.uint8)
+        # design coordinate of the center of the tile's top left pixel. A pixel is on if its center is
+        # inside a shape, edges are half-open, so shapes that touch don't overlap and a 1000 um
+        # rectangle at 1 um per pixel is 1000 pixels wide.
+        x0 = self.origin[0] + (col * self.tile_width + 0.5) * self.pixel_size
+        y0 = self.origin[1] + (row * self.tile_height + 0.5) * self.pixel_size
+        for i in self.shapes_in_tile(row, col):
+            shape = self.shapes[i]
+            rings = [(ring - (x0, y0)) / self.pixel_size for ring in shape.rings]
+            if shape.kind == "polygon":
+                _fill_polygon(tile, rings)
+            elif shape.kind == "circle":
+                _fill_circle(tile, rings[0][0], shape.radius / self.pixel_size)
+            elif shape.kind == "path":
+                thickness = max(1, int(round(shape.width / self.pixel_size)))
+                fixed = [np.round(ring * (1 << SHIFT)).astype(np.int32) for ring in rings]
+                cv2.polylines(tile, fixed, False, 1, thickness=thickness, shift=SHIFT)
+        return tile
+
+    def tiles(self) -> LazyTileGrid:
+        """Tiles as a grid that can be indexed like the output of tile_array, tiles[row][col]."""
+        return LazyTileGrid(self)
+
+    def render_tiles(self, indices: Optional[Sequence[Tuple[int, int]]] = None,
+                     processes: Optional[int] = None) -> Iterator[Tuple[int, int, np.ndarray]]:
+        """
+        Rasterize tiles in a process pool. Yields (row, col, tile) in the order of indices.
+
+        Args:
+            indices: (row, col) of the tiles to render, e.g. path_plan.tile_indices. Defaults to all tiles.
+            processes: Number of worker processes, defaults to the number of CPUs
+        """
+        if indices is None:
+            indices = [(row, col) for row in range(self.grid_height) for col in range(self.grid_width)]
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(self,)) as pool:
+            for (row, col), tile in zip(indices, pool.map(_render_tile, indices, chunksize=4)):
+                yield row, col, tile
+
+    @classmethod
+    def from_svg(cls, path: str, pixel_size: float, scale: float = 1.0, **kwargs) -> "VectorMask":
+        """
+        Load polygons, rects, circles, ellipses, polylines and paths from an SVG file.
+        Shapes with fill none (attribute, style or inherited) are drawn as outlines with their stroke width.
+
+        Args:
+            path: SVG file
+            pixel_size: Size of a dmd pixel in um
+            scale: um per SVG user unit
+            kwargs: Passed on to VectorMask
+        """
+        return cls(read_svg(path, scale), pixel_size, **kwargs)
+
+    @classmethod
+    def from_dxf(cls, path: str, pixel_size: float, scale: float = 1.0, **kwargs) -> "VectorMask":
+        """Load closed polylines, circles and open polylines (as paths) from a DXF file. Needs ezdxf."""
+        return cls(read_dxf(path, scale), pixel_size, **kwargs)
+
+    @classmethod
+    def from_gds(cls, path: str, pixel_size: float, layer: Optional[int] = None, **kwargs) -> "VectorMask":
+        """Load the polygons of the top cell of a GDS file. Needs gdstk."""
+        return cls(read_gds(path, layer), pixel_size, **kwargs)
+
+
+_worker_mask: Optional[VectorMask] = None
+
+
+def _init_worker(mask: VectorMask) -> None:
+    global _worker_mask
+    _worker_mask = mask
+
+
+def _render_tile(index: Tuple[int, int]) -> np.ndarray:
+    return _worker_mask.tile(*index)
+
+
+def _fill_polygon(tile: np.ndarray, rings: List[np.ndarray]) -> None:
+    """
+    Switch on the pixels whose center is inside the rings (even-odd rule, so inner rings are holes).
+    Coordinates are in pixels with the pixel centers on integers. Scanline fill: every edge crosses
+    the pixel rows from ceil(y_min) to ceil(y_max) - 1, a pixel is inside if an odd number of
+    crossings lie at or left of its center.
+    """
+    points = [np.asarray(ring, dtype=np.float64) for ring in rings if len(ring) > 2]
+    if not points:
+        return
+    start = np.concatenate(points)
+    end = np.concatenate([np.roll(ring, -1, axis=0) for ring in points])
+    # only the window of the tile covered by the shape: columns left of it can't be inside
+    top = max(0, int(np.ceil(start[:, 1].min())))
+    bottom = min(tile.shape[0], int(np.ceil(start[:, 1].max())))
+    left = max(0, int(np.ceil(start[:, 0].min())))
+    right = min(tile.shape[1], int(np.ceil(start[:, 0].max())))
+    if bottom <= top or right <= left:
+        return
+    height, width = bottom - top, right - left
+    low = np.minimum(start[:, 1], end[:, 1])
+    high = np.maximum(start[:, 1], end[:, 1])
+    first = np.clip(np.ceil(low), top, bottom).astype(np.int64)
+    n_rows = np.clip(np.ceil(high), top, bottom).astype(np.int64) - first
+    edges = np.repeat(np.arange(len(start)), n_rows)
+    if len(edges) == 0:
+        return
+    rows = first[edges] + np.arange(len(edges)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    x0, y0 = start[edges, 0], start[edges, 1]
+    slope = (end[edges, 0] - x0) / (end[edges, 1] - y0)
+    cols = np.clip(np.ceil(x0 + (rows - y0) * slope) - left, 0, width).astype(np.int64)
+    crossings = np.bincount((rows - top) * (width + 1) + cols, minlength=height * (width + 1))
+    inside = np.cumsum(crossings.reshape(height, width + 1)[:, :width], axis=1) & 1
+    tile[top:bottom, left:right] |= inside.astype(np.uint8)
+
+
+def _fill_circle(tile: np.ndarray, center: np.ndarray, radius: float) -> None:
+    """Switch on the pixels whose center is inside the circle, coordinates as in _fill_polygon."""
+    cx, cy = center
+    x0, x1 = max(0, int(np.ceil(cx - radius))), min(tile.shape[1], int(np.floor(cx + radius)) + 1)
+    y0, y1 = max(0, int(np.ceil(cy - radius))), min(tile.shape[0], int(np.floor(cy + radius)) + 1)
+    if x1 <= x0 or y1 <= y0:
+        return
+    ys, xs = np.ogrid[y0:y1, x0:x1]
+    tile[y0:y1, x0:x1] |= ((xs - cx) ** 2 + (ys - cy) ** 2 < radius ** 2).astype(np.uint8)
+
+
+def _flip_y(shapes: List[Shape]) -> List[Shape]:
+    """CAD formats have y pointing up, images down."""
+    for shape in shapes:
+        shape.rings = [ring * (1, -1) for ring in shape.rings]
+    return shapes
+
+
+# --- SVG ---
+
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_BEZIER_STEPS = 16
+
+
+def _numbers(text: str) -> List[float]:
+    return [float(v) for v in re.findall(_NUMBER, text or "")]
+
+
+def _parse_transform(text: Optional[str]) -> np.ndarray:
+    matrix = np.eye(3)
+    for name, args in re.findall(r"(\w+)\s*\(([^)]*)\)", text or ""):
+        v = _numbers(args)
+        if name == "matrix":
+            m = np.array([[v[0], v[2], v[4]], [v[1], v[3], v[5]], [0, 0, 1]])
+        elif name == "translate":
+            m = np.array([[1, 0, v[0]], [0, 1, v[1] if len(v) > 1 else 0], [0, 0, 1]])
+        elif name == "scale":
+            m = np.diag([v[0], v[1] if len(v) > 1 else v[0], 1])
+        elif name == "rotate":
+            a = math.radians(v[0])
+            m = np.array([[math.cos(a), -math.sin(a), 0], [math.sin(a), math.cos(a), 0], [0, 0, 1]])
+            if len(v) == 3:
+                m = _parse_transform(f"translate({v[1]},{v[2]})") @ m @ _parse_transform(f"translate({-v[1]},{-v[2]})")
+        else:
+            continue
+        matrix = matrix @ m
+    return matrix
+
+
+def _arc(x1: float, y1: float, rx: float, ry: float, angle: float, large: bool, sweep: bool,
+         x2: float, y2: float) -> np.ndarray:
+    """Points of an SVG elliptical arc after (x1, y1), up to (x2, y2) (endpoint to center conversion of the SVG spec)."""
+    rx, ry = abs(rx), abs(ry)
+    if (x1, y1) == (x2, y2):
+        return np.empty((0, 2))
+    if rx == 0 or ry == 0:
+        return np.array([(x2, y2)])
+    phi = math.radians(angle)
+    cos, sin = math.cos(phi), math.sin(phi)
+    dx, dy = (x1 - x2) / 2, (y1 - y2) / 2
+    xp, yp = cos * dx + sin * dy, -sin * dx + cos * dy
+    # radii too small to reach the end point are scaled up
+    grow = xp ** 2 / rx ** 2 + yp ** 2 / ry ** 2
+    if grow > 1:
+        rx, ry = rx * math.sqrt(grow), ry * math.sqrt(grow)
+    numerator = rx ** 2 * ry ** 2 - rx ** 2 * yp ** 2 - ry ** 2 * xp ** 2
+    factor = math.sqrt(max(0.0, numerator / (rx ** 2 * yp ** 2 + ry ** 2 * xp ** 2)))
+    if large == sweep:
+        factor = -factor
+    cxp, cyp = factor * rx * yp / ry, -factor * ry * xp / rx
+    cx, cy = cos * cxp - sin * cyp + (x1 + x2) / 2, sin * cxp + cos * cyp + (y1 + y2) / 2
+    theta = math.atan2((yp - cyp) / ry, (xp - cxp) / rx)
+    delta = math.atan2((-yp - cyp) / ry, (-xp - cxp) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    steps = max(2, int(math.ceil(abs(delta) / (2 * math.pi) * 4 * _BEZIER_STEPS)))
+    t = theta + delta * np.linspace(0, 1, steps + 1)[1:]
+    points = np.column_stack([cx + rx * np.cos(t) * cos - ry * np.sin(t) * sin,
+                              cy + rx * np.cos(t) * sin + ry * np.sin(t) * cos])
+    points[-1] = (x2, y2)
+    return points
+
+
+def _path_rings(d: str) -> Tuple[List[np.ndarray], List[bool]]:
+    """
+    Flatten SVG path data into point rings. Curves and arcs are sampled.
+
+    Raises:
+        ValueError: If the path data can't be parsed
+    """
+    tokens = re.findall(r"[MmLlHhVvCcSsQqTtAaZz]|" + _NUMBER, d)
+    rings, closed = [], []
+    points: List[Tuple[float, float]] = []
+    x = y = 0.0
+    start = (0.0, 0.0)
+    control = None  # last control point of a cubic (for S) or quadratic (for T) curve
+    command = None
+    i = 0
+
+    def take(n):
+        nonlocal i
+        if i + n > len(tokens) or any(re.match(r"[A-Za-z]", t) for t in tokens[i:i + n]):
+            raise ValueError(f"SVG path command {command} needs {n} numbers: {d[:80]!r}")
+        values = [float(t) for t in tokens[i:i + n]]
+        i += n
+        return values
+
+    def flag():
+        value = take(1)[0]
+        if value not in (0.0, 1.0):
+            raise ValueError(f"SVG arc flag must be 0 or 1, got {value:g}: {d[:80]!r}")
+        return bool(value)
+
+    def finish(is_closed):
+        nonlocal points
+        if len(points) > 1:
+            rings.append(np.array(points))
+            closed.append(is_closed)
+        points = []
+
+    def curve(p):
+        t = np.linspace(0, 1, _BEZIER_STEPS + 1)[1:, None]
+        if len(p) == 4:
+            return (1 - t) ** 3 * p[0] + 3 * (1 - t) ** 2 * t * p[1] + 3 * (1 - t) * t ** 2 * p[2] + t ** 3 * p[3]
+        return (1 - t) ** 2 * p[0] + 2 * (1 - t) * t * p[1] + t ** 2 * p[2]
+
+    while i < len(tokens):
+        if re.match(r"[A-Za-z]", tokens[i]):
+            previous, command = command, tokens[i]
+            i += 1
+            if command in "Zz":
+                finish(True)
+                x, y = start
+                continue
+        elif command is None:
+            raise ValueError(f"SVG path data must start with a command: {d[:80]!r}")
+        else:
+            previous = command
+        relative = command.islower()
+        c = command.upper()
+        p = previous.upper() if previous else ""
+        ox, oy = (x, y) if relative else (0.0, 0.0)
+        smooth = None
+        if c == "M":
+            finish(False)
+            px, py = take(2)
+            x, y = ox + px, oy + py
+            start = (x, y)
+            points = [(x, y)]
+            command = "l" if relative else "L"  # further pairs are line tos
+        elif c == "L":
+            px, py = take(2)
+            x, y = ox + px, oy + py
+            points.append((x, y))
+        elif c == "H":
+            x = take(1)[0] + (x if relative else 0.0)
+            points.append((x, y))
+        elif c == "V":
+            y = take(1)[0] + (y if relative else 0.0)
+            points.append((x, y))
+        elif c in "CSQT":
+            v = take({"C": 6, "S": 4, "Q": 4, "T": 2}[c])
+            controls = [(ox + v[k], oy + v[k + 1]) for k in range(0, len(v), 2)]
+            if c in "ST":
+                # the first control point is the previous one mirrored, or the current point
+                follows = p in "CS" if c == "S" else p in "QT"
+                first = (2 * x - control[0], 2 * y - control[1]) if follows and control is not None else (x, y)
+                controls.insert(0, first)
+            points.extend(map(tuple, curve(np.array([(x, y)] + controls))))
+            smooth = controls[-2]
+            x, y = controls[-1]
+        elif c == "A":
+            rx, ry, angle = take(3)
+            large, sweep = flag(), flag()
+            px, py = take(2)
+            points.extend(map(tuple, _arc(x, y, rx, ry, angle, large, sweep, ox + px, oy + py)))
+            x, y = ox + px, oy + py
+        control = smooth
+    finish(False)
+    return rings, closed
+
+
+def _style(element: ET.Element, inherited: Dict[str, str]) -> Dict[str, str]:
+    """fill, stroke and stroke-width of an element: inherited from its parents, then its attributes,
+    then its style attribute, which takes precedence like in CSS."""
+    style = {name: value for name, value in inherited.items()}
+    for name in ("fill", "stroke", "stroke-width"):
+        if element.get(name) is not None:
+            style[name] = element.get(name).strip()
+    for item in (element.get("style") or "").split(";"):
+        name, _, value = item.partition(":")
+        if name.strip() in ("fill", "stroke", "stroke-width"):
+            style[name.strip()] = value.strip()
+    return style
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_svg(path: str, scale: float = 1.0) -> List[Shape]:
+    """
+    Read the shapes of an SVG file, in um.
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+    """
+    if not Path(path).exists():
+        raise FileNotFoundError(f"SVG file not found: {path}")
+    shapes: List[Shape] = []
+
+    def apply(matrix, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return (points @ matrix[:2, :2].T + matrix[:2, 2]) * scale
+
+    def outline(ring, width):
+        return Shape("path", [np.vstack([ring, ring[:1]])], width=width)
+
+    def walk(element, parent, inherited):
+        matrix = parent @ _parse_transform(element.get("transform"))
+        tag = _local(element.tag)
+        style = _style(element, inherited)
+        a = lambda name: float(element.get(name, 0))
+        stroke_only = style.get("fill") == "none"
+        invisible = stroke_only and style.get("stroke") == "none"
+        width = _numbers(style.get("stroke-width", "1"))
+        stroke_width = (width[0] if width else 1.0) * scale * math.sqrt(abs(np.linalg.det(matrix[:2, :2])))
+        if invisible:
+            pass
+        elif tag == "rect":
+            x, y, w, h = a("x"), a("y"), a("width"), a("height")
+            ring = apply(matrix, [(x, y), (x + w, y), (x + w, y + h), (x, y + h)])
+            shapes.append(outline(ring, stroke_width) if stroke_only else Shape("polygon", [ring]))
+        elif tag in ("circle", "ellipse"):
+            rx = a("r") if tag == "circle" else a("rx")
+            ry = a("r") if tag == "circle" else a("ry")
+            t = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+            ring = apply(matrix, np.column_stack([a("cx") + rx * np.cos(t), a("cy") + ry * np.sin(t)]))
+            shapes.append(outline(ring, stroke_width) if stroke_only else Shape("polygon", [ring]))
+        elif tag in ("polygon", "polyline"):
+            ring = apply(matrix, _numbers(element.get("points")))
+            if tag == "polyline":
+                shapes.append(Shape("path", [ring], width=stroke_width))
+            elif stroke_only:
+                shapes.append(outline(ring, stroke_width))
+            else:
+                shapes.append(Shape("polygon", [ring]))
+        elif tag == "path":
+            rings, closed = _path_rings(element.get("d", ""))
+            rings = [apply(matrix, ring) for ring in rings]
+            if stroke_only:
+                shapes.extend(outline(ring, stroke_width) if is_closed else Shape("path", [ring], width=stroke_width)
+                              for ring, is_closed in zip(rings, closed))
+            elif rings:
+                shapes.append(Shape("polygon", rings))
+        elif tag == "line":
+            ring = apply(matrix, [(a("x1"), a("y1")), (a("x2"), a("y2"))])
+            shapes.append(Shape("path", [ring], width=stroke_width))
+        for child in element:
+            if _local(child.tag) not in ("defs", "clipPath", "mask", "symbol"):
+                walk(child, matrix, style)
+
+    walk(ET.parse(path).getroot(), np.eye(3), {})
+    return shapes
+
+
+# --- DXF / GDS ---
+
+def read_dxf(path: str, scale: float = 1.0) -> List[Shape]:
+    """
+    Read closed polylines (filled), circles and open polylines (as paths) from a DXF file, in um.
+
+    Raises:
+        ImportError: If ezdxf is not installed
+    """
+    if ezdxf is None:
+        raise ImportError("Reading DXF files needs the ezdxf package")
+    shapes: List[Shape] = []
+    for entity in ezdxf.readfile(path).modelspace():
+        kind = entity.dxftype()
+        if kind == "CIRCLE":
+            center = np.array([[entity.dxf.center.x, entity.dxf.center.y]]) * scale
+            shapes.append(Shape("circle", [center], radius=entity.dxf.radius * scale))
+        elif kind in ("LWPOLYLINE", "POLYLINE"):
+            points = np.array([(p[0], p[1]) for p in entity.get_points("xy")] if kind == "LWPOLYLINE"
+                              else [(v.dxf.location.x, v.dxf.location.y) for v in entity.vertices]) * scale
+            if entity.is_closed:
+                shapes.append(Shape("polygon", [points]))
+            else:
+                width = entity.dxf.get("const_width", 0) * scale if kind == "LWPOLYLINE" else 0.0
+                shapes.append(Shape("path", [points], width=width))
+        elif kind == "LINE":
+            points = np.array([[entity.dxf.start.x, entity.dxf.start.y], [entity.dxf.end.x, entity.dxf.end.y]]) * scale
+            shapes.append(Shape("path", [points]))
+    return _flip_y(shapes)
+
+
+def read_gds(path: str, layer: Optional[int] = None) -> List[Shape]:
+    """
+    Read the polygons and paths of the top cell of a GDS file, in um, flattening references.
+
+    Raises:
+        ImportError: If gdstk is not installed
+    """
+    if gdstk is None:
+        raise ImportError("Reading GDS files needs the gdstk package")
+    library = gdstk.read_gds(path, unit=1e-6)
+    cell = library.top_level()[0].flatten()
+    polygons = list(cell.polygons) + [p for path_ in cell.paths for p in path_.to_polygons()]
+    shapes = [Shape("polygon", [np.asarray(p.points)]) for p in polygons if layer is None or p.layer == layer]
+    return _flip_y(shapes)
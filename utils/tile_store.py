@@ -0,0 +1,165 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from manager.dmd import binarize_mask
+
+
+class TileStore:
+    """
+    Deduplicated, bit-packed store of the tiles of a mask.
+
+    Every tile is binarized (non-zero pixels are on), packed to 1 bit per pixel and hashed.
+    Identical tiles (blank, fully exposed, repeated channel segments) are stored once, and the grid
+    keeps the id of the unique tile at every position. The store can be saved to disk, so re-printing
+    the same design doesn't need re-tiling.
+    """
+
+    def __init__(self, packed: np.ndarray, index: np.ndarray, tile_shape: Tuple[int, int], cache_size: int = 16):
+        """
+        Args:
+            packed: Unique tiles, bit-packed, shape (n_unique, bytes_per_tile)
+            index: Id of the unique tile at every grid position, shape (grid_height, grid_width)
+            tile_shape: (tile_height, tile_width)
+            cache_size: Number of unpacked tiles kept in memory
+        """
+        self.packed = packed
+        self.index = index
+        self.tile_shape = tuple(tile_shape)
+        self.grid_height, self.grid_width = index.shape
+        self.pixel_counts = np.unpackbits(packed, axis=1).sum(axis=1, dtype=np.int64) if len(packed) else np.zeros(0)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()  # tiles are unpacked on the prepare workers of print_job
+
+    @classmethod
+    def from_tiles(cls, tiles, cache_size: int = 16) -> "TileStore":
+        """
+        Build a store from a grid of tiles[row][col], e.g. from tile_array or LazyMask.tiles().
+
+        Raises:
+            ValueError: If the tiles don't all have the same shape
+        """
+        grid_height = len(tiles)
+        grid_width = len(tiles[0]) if grid_height > 0 else 0
+        index = np.zeros((grid_height, grid_width), dtype=np.int32)
+        ids: Dict[bytes, int] = {}
+        packed: List[np.ndarray] = []
+        tile_shape = None
+        for row in range(grid_height):
+            for col in range(grid_width):
+                tile = np.asarray(tiles[row][col])
+                if tile_shape is None:
+                    tile_shape = tile.shape
+                elif tile.shape != tile_shape:
+                    raise ValueError(f"Tile {row},{col} has shape {tile.shape}, expected {tile_shape}")
+                bits = np.packbits(binarize_mask(tile))
+                digest = hashlib.blake2b(bits.tobytes(), digest_size=16).digest()
+                if digest not in ids:
+                    ids[digest] = len(packed)
+                    packed.append(bits)
+                index[row, col] = ids[digest]
+        packed_array = np.stack(packed) if packed else np.zeros((0, 0), dtype=np.uint8)
+        return cls(packed_array, index, tile_shape or (0, 0), cache_size)
+
+    def tile(self, row: int, col: int) -> np.ndarray:
+        """Unpacked tile (uint8, 0/1). Repeated tiles return the same read-only array."""
+        return self.unique_tile(int(self.index[row, col]))
+
+    def unique_tile(self, tile_id: int) -> np.ndarray:
+        """Unpacked unique tile by id. The last cache_size tiles are kept unpacked."""
+        with self._cache_lock:
+            if tile_id in self._cache:
+                self._cache.move_to_end(tile_id)
+                return self._cache[tile_id]
+        size = self.tile_shape[0] * self.tile_shape[1]
+        tile = np.unpackbits(self.packed[tile_id], count=size).reshape(self.tile_shape)
+        tile.flags.writeable = False
+        with self._cache_lock:
+            self._cache[tile_id] = tile
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tile
+
+    def is_empty(self, row: int, col: int) -> bool:
+        return self.pixel_counts[self.index[row, col]] == 0
+
+    def tiles(self) -> List[List[np.ndarray]]:
+        """Grid of tiles[row][col], like tile_array. Repeated tiles share one array."""
+        return [[self.tile(row, col) for col in range(self.grid_width)] for row in range(self.grid_height)]
+
+    def select(self, tile_indices: Iterable[Tuple[int, int]]) -> Tuple["TileSelection", List[int], List[bool]]:
+        """
+        Tiles, tile ids and empty flags for a list of (row, col), e.g. path_plan.tile_indices.
+        The tiles, ids and flags can be passed to print_job as tiles, keys and empty. The tiles are
+        unpacked only when print_job reads them, so the plan stays bit-packed in memory.
+        """
+        keys, empty = [], []
+        for row, col in tile_indices:
+            keys.append(int(self.index[row, col]))
+            empty.append(bool(self.is_empty(row, col)))
+        return TileSelection(self, keys), keys, empty
+
+    def stats(self) -> Dict[str, float]:
+        """Deduplication statistics."""
+        n_tiles = self.index.size
+        n_unique = len(self.packed)
+        size = self.tile_shape[0] * self.tile_shape[1]
+        counts = self.pixel_counts[self.index].ravel() if n_tiles else np.zeros(0)
+        return {
+            "tiles": n_tiles,
+            "unique": n_unique,
+            "duplicates": n_tiles - n_unique,
+            "empty": int(np.count_nonzero(counts == 0)),
+            "full": int(np.count_nonzero(counts == size)) if size else 0,
+            "bytes_packed": int(self.packed.nbytes),
+            "bytes_uint8": n_tiles * size,
+        }
+
+    def save(self, path: str) -> None:
+        """Save the store to a compressed .npz file. The .npz suffix is added if path doesn't have it."""
+        np.savez_compressed(_npz_path(path), packed=self.packed, index=self.index,
+                            tile_shape=np.array(self.tile_shape))
+
+    @classmethod
+    def load(cls, path: str, cache_size: int = 16) -> "TileStore":
+        """
+        Load a store saved with save.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist
+        """
+        path = _npz_path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"Tile store not found: {path}")
+        with np.load(path) as data:
+            return cls(data["packed"], data["index"], tuple(data["tile_shape"].tolist()), cache_size)
+
+
+class TileSelection(Sequence):
+    """
+    Read-only list of tiles of a TileStore, unpacked on access through the store's cache.
+    """
+
+    def __init__(self, store: TileStore, keys: List[int]):
+        self.store = store
+        self.keys = keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return TileSelection(self.store, self.keys[index])
+        return self.store.unique_tile(self.keys[index])
+
+
+def _npz_path(path: Union[str, Path]) -> Path:
+    """path with the .npz suffix that np.savez_compressed adds."""
+    path = Path(path)
+    return path if path.suffix == ".npz" else path.with_name(path.name + ".npz")